@@ -0,0 +1,5 @@
+# Time the package started being imported, to report how long the action
+# server takes to be ready (see actions.py).
+import time
+
+IMPORT_STARTED = time.perf_counter()
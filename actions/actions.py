@@ -6,6 +6,8 @@
 
 import logging
 import re
+import sys
+import time
 from typing import Any, Text, Dict, List
 from rasa_sdk import Action, Tracker
 from rasa_sdk.events import SlotSet
@@ -13,19 +15,23 @@ from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.forms import FormValidationAction
 from rasa_sdk.events import UserUtteranceReverted
 from rasa_sdk.types import DomainDict
-from fuzzywuzzy import process
-import pandas as pd
 from rasa_sdk.events import SlotSet, AllSlotsReset, ActiveLoop
-
-
-movies_df = pd.read_csv("Dataset/imdb_top_1000.csv")
-
-actor_df = pd.concat([movies_df['Star1'], movies_df['Star2'], movies_df['Star3']]).unique()
-director_df = movies_df['Director'].unique()
-movies = movies_df['Series_Title'].unique()
-valid_genre = ['Drama', 'Crime', 'Action', 'Adventure', 'Biography', 'History', 'Sci-Fi',
- 'Romance', 'Western', 'Fantasy', 'Comedy', 'Thriller', 'Animation', 'Family',
- 'War', 'Mystery', 'Music', 'Horror', 'Musical', 'Film-Noir', 'Sport']
+from . import IMPORT_STARTED
+from .cache import response_cache
+from .catalog import GENRES, genre_mask
+from .concurrency import CatalogAction
+from .indexes import normalize
+from .manager import CatalogManager
+from .metrics import count_fuzzy, instrument_actions, lap
+from .query import MovieQuery
+from .rendering import format_rows, utter_movies
+
+logger = logging.getLogger(__name__)
+
+catalog_manager = CatalogManager()
+# cached answers were computed on the previous catalog
+catalog_manager.on_swap(lambda generation: response_cache.invalidate())
+valid_genre = GENRES
 soglia_fuzzy = 70
 
 class ActionAskClarification(Action):
@@ -37,51 +43,61 @@ class ActionAskClarification(Action):
         return [UserUtteranceReverted()]
 
 
-class ActionListTopMovies(Action):
+class ActionListTopMovies(CatalogAction):
+    # the answer only depends on the dataset
+    cached_slots = ()
+
     def name(self) -> Text:
         return "action_list_top_movies"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        
-        top_movies = movies_df.sort_values(by="IMDB_Rating", ascending=False).head(10)
+    @staticmethod
+    def top_movies_response(db) -> Text:
+        top_movies = db.catalog.take(db.rank_index.top("IMDB_Rating", 10))
+        lap("sorting")
 
         response = "🎬 Here are the top-rated movies in IMDB:\n\n"
-        response += "\n".join([
-            f"⭐ {row['Series_Title']} - Rating: {row['IMDB_Rating']}" 
-            for _, row in top_movies.iterrows()
-        ])
+        response += "\n".join(format_rows(top_movies, "⭐ {Series_Title} - Rating: {IMDB_Rating}"))
+        return response
+
+    def run_sync(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
 
-        dispatcher.utter_message(text=response)
+        dispatcher.utter_message(text=self.top_movies_response(catalog_manager.current))
         return []
     
 
-class ActionAskDirectorMovie(Action):
+class ActionAskDirectorMovie(CatalogAction):
+    cached_slots = ("movie",)
+
     def name(self) -> str:
         return "action_ask_director"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: dict):
+    def run_sync(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: dict):
         
+        db = catalog_manager.current
         movie_name = tracker.get_slot("movie")
+        lap("slot_read")
 
         if not movie_name:
             dispatcher.utter_message(text="❓ Please tell me the movie you are asking about. 🎥")
             return [SlotSet('movie', None)]
 
-        movie_row = movies_df[movies_df['Series_Title'].str.contains(movie_name, case=False, na=False)]
+        movie_row = db.catalog.take(db.title_index.search(movie_name))
+        lap("exact_lookup")
         
         if movie_row.empty:
-            new_name, score = process.extractOne(movie_name, movies.tolist())
+            new_name, score = db.title_matcher.extract_one(movie_name)
+            lap("fuzzy_fallback")
+            count_fuzzy(score > soglia_fuzzy)
 
             if score > soglia_fuzzy:
                 dispatcher.utter_message("You misspelled the name of the movie. Don't worry, I've got it! 😊✨")
-                movie_row = movies_df[movies_df['Series_Title'].str.contains(new_name, case=False, na=False)]
+                movie_row = db.catalog.take(db.title_index.search(new_name))
 
         
         if not movie_row.empty:
             if len(movie_row) > 1:
                 message = "🔍 Multiple movies found matching your query:\n"
-                for _, row in movie_row.iterrows():
-                    message += f"🎬 {row['Series_Title']} - Directed by {row['Director']} 🌟\n"
+                message += "\n".join(format_rows(movie_row, "🎬 {Series_Title} - Directed by {Director} 🌟"))
                 dispatcher.utter_message(text=message.strip())
             else:
                 director = movie_row.iloc[0]['Director']
@@ -95,33 +111,35 @@ class ActionAskDirectorMovie(Action):
 
         return [SlotSet('movie', None)]
     
-class ActionAskGenre(Action):
+class ActionAskGenre(CatalogAction):
     def name(self) -> str:
         return "action_ask_genre"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: dict):
+    def run_sync(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: dict):
 
+        db = catalog_manager.current
         movie_name = tracker.get_slot("movie")
+        lap("slot_read")
 
         if not movie_name:
             dispatcher.utter_message(text="❓ I couldn't catch the name of the movie. Can you repeat it? 🎥")
             return [SlotSet('movie', None)]
 
 
-        movie_row = movies_df[movies_df['Series_Title'].str.contains(movie_name, case=False, na=False)]
+        movie_row = db.catalog.take(db.title_index.search(movie_name))
+        lap("exact_lookup")
 
         if movie_row.empty:
-            new_name, score = process.extractOne(movie_name, movies.tolist())
+            new_name, score = db.title_matcher.extract_one(movie_name)
+            lap("fuzzy_fallback")
+            count_fuzzy(score > soglia_fuzzy)
             if score > soglia_fuzzy:
                 dispatcher.utter_message("You misspelled the movie. Don't worry, I've got it! 😊✨")
-                movie_row = movies_df[movies_df['Series_Title'].str.contains(new_name, case=False, na=False)]
+                movie_row = db.catalog.take(db.title_index.search(new_name))
 
 
         if not movie_row.empty:
-            alternatives = [
-                f"🎞️ {row['Series_Title']} - Genre: {row['Genre']}" 
-                for _, row in movie_row.iterrows()
-            ]
+            alternatives = format_rows(movie_row, "🎞️ {Series_Title} - Genre: {Genre}")
             response = "🎬 Here are the genres for the matching movies:\n\n" + "\n".join(alternatives)
             dispatcher.utter_message(text=response)
         else:
@@ -131,38 +149,43 @@ class ActionAskGenre(Action):
 
         return [SlotSet('movie', None)]
     
-class ActionAskDirector(Action):
+class ActionAskDirector(CatalogAction):
+    cached_slots = ("director",)
+
     def name(self) -> str:
         return "action_movies_by_director"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: dict):
+    def run_sync(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: dict):
         
+        db = catalog_manager.current
         director = tracker.get_slot("director")
+        lap("slot_read")
         
         if not director:
             dispatcher.utter_message(text="🎬 I couldn't catch the name of the director. Can you repeat it?")
             return [SlotSet('director', None)]
 
         
-        dir_movies = movies_df[movies_df['Director'].str.contains(director, case=False, na=False)]
+        dir_rows = db.director_index.search(director)
+        dir_movies = db.catalog.take(dir_rows)
+        lap("exact_lookup")
         
         if dir_movies.empty:
-            if len(director.split()) > 1:
-                new_name, score = process.extractOne(director, director_df.tolist())
-                director = new_name
-            elif len(director.split()) == 1:
-                new_name, score = process.extractOne(director, [s.split()[-1] if len(s.split()) > 1 else "" for s in director_df.tolist()])
-                director = new_name
+            new_name, score = db.director_matcher.extract_one(director)
+            lap("fuzzy_fallback")
+            count_fuzzy(score > soglia_fuzzy)
+            director = new_name
 
             if score > soglia_fuzzy:
                 dispatcher.utter_message(text=f"Did you mean '{director}'? Don't worry, I've found the information for you! 😊")
-                dir_movies = movies_df[movies_df['Director'].str.contains(new_name, case=False, na=False)]
+                dir_rows = db.director_index.search(new_name)
+                dir_movies = db.catalog.take(dir_rows)
                 
 
         if not dir_movies.empty:
            
-            matching_directors = dir_movies[['Director']].stack().unique()
-            director_with_same_surname = [name for name in matching_directors if name.split()[-1].lower() == director.split()[-1].lower()]
+            matching_directors = db.director_index.people(dir_rows)
+            director_with_same_surname = db.director_index.with_surname(matching_directors, director)
 
             if len(director_with_same_surname) == 0:
                 dispatcher.utter_message(text="Wait a moment 🤔. You need to provide either the full name or just the last word of the name (surname).")
@@ -176,7 +199,7 @@ class ActionAskDirector(Action):
                 )
                 return [SlotSet('director', None)]
             
-            full_name = next((name for name in matching_directors if director.lower() in name.lower()), director)
+            full_name = next((name for name in matching_directors if normalize(director) in normalize(name)), director)
 
             movie_list = dir_movies['Series_Title'].tolist()
             movie_titles = '\n'.join([f"🎞️ {movie}" for movie in movie_list])  # Aggiungi un'icona a ogni titolo
@@ -191,56 +214,41 @@ class ActionAskDirector(Action):
         return [SlotSet('director', None)]
 
 
-class ActionAskActor(Action):
+class ActionAskActor(CatalogAction):
+    cached_slots = ("actor",)
+
     def name(self) -> str:
         return "action_movies_by_actor"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: dict):
+    def run_sync(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: dict):
         
+        db = catalog_manager.current
         actor_name = tracker.get_slot("actor")
         original_actor_name = actor_name 
+        lap("slot_read")
         if not actor_name:
             dispatcher.utter_message(text="I couldn't catch the name of the actor. Can you repeat it?")
             return [SlotSet('actor', None)]
 
-        actor_movies = movies_df[
-            (movies_df['Star1'].str.contains(actor_name, case=False, na=False)) |
-            (movies_df['Star2'].str.contains(actor_name, case=False, na=False)) |
-            (movies_df['Star3'].str.contains(actor_name, case=False, na=False)) |
-            (movies_df['Star4'].str.contains(actor_name, case=False, na=False))
-        ]
+        actor_rows = db.actor_index.search(actor_name)
+        actor_movies = db.catalog.take(actor_rows)
+        lap("exact_lookup")
 
         if actor_movies.empty:
             # Utilizziamo il fuzzy matching per correggere eventuali errori
-            all_actors = (
-                movies_df['Star1'].dropna().tolist() +
-                movies_df['Star2'].dropna().tolist() +
-                movies_df['Star3'].dropna().tolist() +
-                movies_df['Star4'].dropna().tolist()
-            )
-            all_actors = list(set(all_actors))
-            if len(actor_name.split())>1:
-                corrected_name, score = process.extractOne(actor_name, all_actors)
-            elif len(actor_name.split())==1:
-                all_actor_surname = [s.split()[-1] if len(s.split()) > 1 else "" for s in all_actors]
-                corrected_name, score = process.extractOne(actor_name, all_actor_surname)
+            corrected_name, score = db.actor_matcher.extract_one(actor_name)
+            lap("fuzzy_fallback")
+            count_fuzzy(score > soglia_fuzzy)
 
             if score > soglia_fuzzy:  # Soglia per considerare una correzione accettabile
                 actor_name = corrected_name
                 dispatcher.utter_message(text=f"Did you mean '{actor_name}'? Don't worry, I've found the information for you! 😊")
-                actor_movies = movies_df[
-                    (movies_df['Star1'].str.contains(actor_name, case=False, na=False)) |
-                    (movies_df['Star2'].str.contains(actor_name, case=False, na=False)) |
-                    (movies_df['Star3'].str.contains(actor_name, case=False, na=False)) |
-                    (movies_df['Star4'].str.contains(actor_name, case=False, na=False))
-                ]
+                actor_rows = db.actor_index.search(actor_name)
+                actor_movies = db.catalog.take(actor_rows)
 
         if not actor_movies.empty:
-            matching_actors = actor_movies[['Star1', 'Star2', 'Star3', 'Star4']].stack().unique()
-            actors_with_same_surname = [
-                name for name in matching_actors 
-                if name.split()[-1].lower() == actor_name.split()[-1].lower()
-            ]
+            matching_actors = db.actor_index.people(actor_rows)
+            actors_with_same_surname = db.actor_index.with_surname(matching_actors, actor_name)
             if len(actors_with_same_surname) == 0:
                 dispatcher.utter_message(text="Wait a moment 🤔. You need to provide either the full name or just the last word of the name (surname).")
                 return [SlotSet('actor', None)]
@@ -253,7 +261,7 @@ class ActionAskActor(Action):
                 )
                 return [SlotSet('actor', None)]
             
-            full_name = next((name for name in matching_actors if actor_name.lower() in name.lower()), actor_name)
+            full_name = next((name for name in matching_actors if normalize(actor_name) in normalize(name)), actor_name)
             
             movie_list = actor_movies['Series_Title'].tolist()
             movie_titles = '\n'.join([f"🎬 {movie}" for movie in movie_list])  
@@ -265,36 +273,43 @@ class ActionAskActor(Action):
 
 
 
-class ActionAskMovieInfo(Action):
+class ActionAskMovieInfo(CatalogAction):
+    cached_slots = ("movie",)
+
     def name(self) -> str:
         return "action_ask_movie_info"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    def run_sync(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        db = catalog_manager.current
         movie_name = tracker.get_slot("movie")
+        lap("slot_read")
         first_name = movie_name
 
         if not movie_name:
             dispatcher.utter_message(text="I couldn't catch the name of the movie. Can you repeat it?")
             return [SlotSet('movie', None)]
 
-        movie_row = movies_df[movies_df['Series_Title'].str.contains(movie_name, case=False, na=False)]
+        movie_row = db.catalog.take(db.title_index.search(movie_name))
+        lap("exact_lookup")
 
         if movie_row.empty:         
-            new_name, score = process.extractOne(movie_name, movies_df['Series_Title'].tolist())
+            new_name, score = db.title_matcher.extract_one(movie_name)
+            lap("fuzzy_fallback")
+            count_fuzzy(score > soglia_fuzzy)
             if score > soglia_fuzzy:
                 dispatcher.utter_message(f"You misspelled the title. Don't worry, I've got it! You mean {new_name} 😊✨")
-                movie_row = movies_df[movies_df['Series_Title'].str.contains(new_name, case=False, na=False)]
+                movie_row = db.catalog.take(db.title_index.search(new_name))
 
         if not movie_row.empty:
             movie = movie_row.iloc[0]
             title = movie['Series_Title']
             genre = movie['Genre']
-            year = movie['Released_Year']
+            year = movie['Released_Year'] or "N/A"
             rating = movie['IMDB_Rating']
             overview = movie['Overview']
             director = movie['Director']
             stars = movie[['Star1', 'Star2', 'Star3', 'Star4']].dropna().values
-            runtime = movie['Runtime']
+            runtime = f"{movie['Runtime']} min"
 
             stars_list = ', '.join(stars) if len(stars) > 0 else "No stars listed."
 
@@ -318,29 +333,98 @@ class ActionAskMovieInfo(Action):
 
         return [SlotSet('movie', None)]
 
-class ActionCountFilms(Action):
+class ActionSimilarMovies(CatalogAction):
+    cached_slots = ("movie",)
+
+    def name(self) -> str:
+        return "action_similar_movies"
+
+    def run_sync(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        db = catalog_manager.current
+        movie_name = tracker.get_slot("movie")
+        lap("slot_read")
+
+        if not movie_name:
+            dispatcher.utter_message(text="❓ Tell me a movie you liked and I'll find similar ones. 🎥")
+            return [SlotSet('movie', None)]
+
+        movie_row = db.catalog.take(db.title_index.search(movie_name))
+        lap("exact_lookup")
+
+        if movie_row.empty:
+            new_name, score = db.title_matcher.extract_one(movie_name)
+            lap("fuzzy_fallback")
+            count_fuzzy(score > soglia_fuzzy)
+            if score > soglia_fuzzy:
+                dispatcher.utter_message(f"You misspelled the title. Don't worry, I've got it! You mean {new_name} 😊✨")
+                movie_row = db.catalog.take(db.title_index.search(new_name))
+
+        if movie_row.empty:
+            dispatcher.utter_message(text=f"😔 I'm sorry, I couldn't find the movie '{movie_name}' in my database. 📂")
+            return [SlotSet('movie', None)]
+
+        similar_rows, _ = db.similar.similar(movie_row.index[0], 10)
+        lap("vector_search")
+        utter_movies(
+            dispatcher, db.catalog.take(similar_rows),
+            "🎞️ {Series_Title} ({Released_Year}) - {Genre}",
+            header=f"🎬 If you liked {movie_row.iloc[0]['Series_Title']}, you may also like:",
+        )
+        return [SlotSet('movie', None)]
+
+
+class ActionSearchPlot(CatalogAction):
+    def name(self) -> str:
+        return "action_search_plot"
+
+    def run_sync(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        db = catalog_manager.current
+        # the words of the whole message if the plot was not recognized
+        query = tracker.get_slot("plot") or tracker.latest_message.get("text")
+        lap("slot_read")
+
+        if not query:
+            dispatcher.utter_message(text="🔎 Tell me something about the plot and I'll look for the movie.")
+            return [SlotSet('plot', None)]
+
+        rows, _ = db.text_search.search(query, 5)
+        lap("text_search")
+        if len(rows):
+            utter_movies(
+                dispatcher, db.catalog.take(rows),
+                "🎞️ {Series_Title} ({Released_Year})\n📝 {Overview}",
+                header=f"🔎 Here are the movies that best match '{query}':",
+            )
+        else:
+            dispatcher.utter_message(text=f"😔 I'm sorry, no plot in my database matches '{query}'.")
+
+        return [SlotSet('plot', None)]
+
+
+class ActionCountFilms(CatalogAction):
     def name(self) -> str:
         return "action_count_films"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: dict) -> list:
+    def run_sync(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: dict) -> list:
+        db = catalog_manager.current
         form_author = tracker.get_slot("form_author")
         form_quality = tracker.get_slot("form_quality") or "none"
+        lap("slot_read")
         
-        all_directors = movies_df['Director'].unique()
-        filtered_movies = movies_df[movies_df['Director'].str.contains(form_author, case=False, na=False)]
+        filtered_rows = db.director_index.search(form_author)
+        filtered_movies = db.catalog.take(filtered_rows)
+        lap("exact_lookup")
         
         if filtered_movies.empty:
-            if len(form_author.split()) > 1:
-                new_name, score = process.extractOne(form_author, all_directors)
-                form_author = new_name
-                
-            elif len(form_author.split()) == 1:
-                new_name, score = process.extractOne(form_author, [s.split()[-1] if len(s.split()) > 1 else "" for s in all_directors.tolist()])
-                form_author = new_name
-               
+            new_name, score = db.director_matcher.extract_one(form_author)
+            lap("fuzzy_fallback")
+            count_fuzzy(score > soglia_fuzzy)
+            form_author = new_name
+
             if score > soglia_fuzzy:
                 dispatcher.utter_message(text=f"Did you mean '{form_author}'? Don't worry, I've found the information for you! 😊")
-                filtered_movies = movies_df[movies_df['Director'].str.contains(form_author, case=False, na=False)]
+                filtered_rows = db.director_index.search(form_author)
+                filtered_movies = db.catalog.take(filtered_rows)
                 
             else:
                 dispatcher.utter_message(
@@ -350,8 +434,8 @@ class ActionCountFilms(Action):
         
         if not filtered_movies.empty:
             # Caso in cui si sono piu autori che hanno lo stesso cognome(ultima parte del nominativo)
-            matching_directors = filtered_movies[['Director']].stack().unique()
-            director_with_same_surname = [name for name in matching_directors if name.split()[-1].lower() == form_author.split()[-1].lower()]
+            matching_directors = db.director_index.people(filtered_rows)
+            director_with_same_surname = db.director_index.with_surname(matching_directors, form_author)
 
             if len(director_with_same_surname) == 0:
                 dispatcher.utter_message(text="Wait a moment 🤔. You need to provide either the full name or just the last word of the name (surname).")
@@ -365,43 +449,37 @@ class ActionCountFilms(Action):
                 return [SlotSet("form_author", None), SlotSet("form_quality", None)]
 
         
-        full_name = next((name for name in matching_directors if form_author.lower() in name.lower()), form_author)
+        full_name = next((name for name in matching_directors if normalize(form_author) in normalize(name)), form_author)
 
         if form_quality == "none":
-            filtered_movies = movies_df[movies_df['Director'] == full_name]
-            
-            num_films = len(filtered_movies)
-            if not filtered_movies.empty:
-                filtered_movies = filtered_movies.sort_values(by=['IMDB_Rating'], ascending=[False])
-                dispatcher.utter_message(
-                    text=f"🎬 The number of films by {full_name} are {num_films}.\n"
+            num_films = db.aggregates.count("director", full_name)
+            lap("filtering")
+            if num_films:
+                filtered_movies = db.catalog.take(db.rank_index.top("IMDB_Rating", rows=db.director_index.rows_of(full_name)))
+                lap("sorting")
+                utter_movies(
+                    dispatcher, filtered_movies,
+                    "🎞️ Movie: {Series_Title}\n⭐ Rating: {IMDB_Rating}",
+                    header=f"🎬 The number of films by {full_name} are {num_films}.\n",
                 )
-                for _, row in filtered_movies.iterrows():
-                    dispatcher.utter_message(
-                        text=f"🎞️ Movie: {row['Series_Title']}\n⭐ Rating: {row['IMDB_Rating']}",
-                        image=row['Poster_Link']
-                    )
             else:
                 dispatcher.utter_message(
                     text=f"😔 Sorry, no films found for {full_name}."
                 )
         else:
             form_quality = float(form_quality)
-            filtered_movies = movies_df[
-                (movies_df['Director'] == full_name) &
-                (movies_df['IMDB_Rating'] >= form_quality)
-            ]
-            num_films = len(filtered_movies)
-            if not filtered_movies.empty:
-                filtered_movies = filtered_movies.sort_values(by=['IMDB_Rating'], ascending=[False])
-                dispatcher.utter_message(
-                    text=f"🎥 The number of films by {full_name} with a rating higher than {form_quality} are {num_films}."
+            # counted from the aggregates: the films are only fetched when there are some
+            num_films = db.aggregates.count("director", full_name, min_rating=form_quality)
+            lap("filtering")
+            if num_films:
+                director_rows = db.rank_index.at_least('IMDB_Rating', form_quality, rows=db.director_index.rows_of(full_name))
+                filtered_movies = db.catalog.take(db.rank_index.top("IMDB_Rating", rows=director_rows))
+                lap("sorting")
+                utter_movies(
+                    dispatcher, filtered_movies,
+                    "🎞️ Film: {Series_Title}\n⭐ Rating: {IMDB_Rating}",
+                    header=f"🎥 The number of films by {full_name} with a rating higher than {form_quality} are {num_films}.",
                 )
-                for _, row in filtered_movies.iterrows():
-                    dispatcher.utter_message(
-                        text=f"🎞️ Film: {row['Series_Title']}\n⭐ Rating: {row['IMDB_Rating']}",
-                        image=row['Poster_Link']
-                    )
             else:
                 dispatcher.utter_message(
                     text=f"😔 Sorry, no films by {full_name} with a rating higher than {form_quality} were found."
@@ -494,38 +572,31 @@ class ValidateFilmCountForm(FormValidationAction):
 
         return {"form_quality": None} 
 
-class ActionProvideMovieRecommendation(Action):
+class ActionProvideMovieRecommendation(CatalogAction):
     def name(self) -> Text:
         return "action_provide_movie_recommendation"
 
-    def run(
+    def run_sync(
         self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]
     ) -> List[Dict[Text, Any]]:
         
         min_release_year = tracker.get_slot("min_release_year")
         genre = tracker.get_slot("form_genre")  
         min_rating = tracker.get_slot("form_quality")
+        lap("slot_read")
 
         if not (min_release_year and genre and min_rating):
             dispatcher.utter_message(text="⚠️ It seems like some information is missing. Please try again.")
             return []
 
-        if isinstance(genre, list):
-            genre = "".join(f"(?=.*{genree})" for genree in genre)
-
         filtered_movies = self.filter_movies(min_release_year, genre, min_rating)
 
         if not filtered_movies.empty:
-            dispatcher.utter_message(text="🎬 Here are some movies I recommend based on your preferences:")
-            for _, row in filtered_movies.iterrows():
-                dispatcher.utter_message(
-                    text=(
-                        f"📽️ Title: {row['Series_Title']} ({row['Released_Year']})\n"
-                        f"⭐ Rating: {row['IMDB_Rating']}\n"
-                        f"🎭 Genre: {row['Genre']}"
-                    ),
-                    image=row.get("Poster_Link", None),
-                )
+            utter_movies(
+                dispatcher, filtered_movies,
+                "📽️ Title: {Series_Title} ({Released_Year})\n⭐ Rating: {IMDB_Rating}\n🎭 Genre: {Genre}",
+                header="🎬 Here are some movies I recommend based on your preferences:",
+            )
         else:
             dispatcher.utter_message(
                 text="😔 Sorry, I couldn't find any movies matching your preferences. Try adjusting the criteria!"
@@ -533,16 +604,22 @@ class ActionProvideMovieRecommendation(Action):
 
         return self.reset_slots()
 
-    def filter_movies(self, min_release_year, genre, min_rating):
-            
-            movies_df["Released_Year"] = pd.to_numeric(movies_df["Released_Year"], errors="coerce").fillna(0).astype(int)
-            filtered_movies = movies_df[
-                (movies_df["Released_Year"] >= min_release_year if min_release_year else True)
-                & (movies_df["Genre"].str.contains(genre, case=False, na=False) if genre else True)
-                & (movies_df["IMDB_Rating"] >= min_rating if min_rating else True)
-            ].head(10)
-            filtered_movies = filtered_movies.sort_values(by=['Released_Year', 'IMDB_Rating'], ascending=[False, False])
-            return filtered_movies
+    def filter_movies(self, min_release_year, genre, min_rating, match_all_genres=True):
+            # genre is a list of genres (or a comma separated string): with
+            # match_all_genres a movie needs all of them, otherwise any of them
+            db = catalog_manager.current
+            query = MovieQuery(db.catalog, db.rank_index, db.genre_index)
+            if min_release_year:
+                query = query.where("Released_Year", ">=", min_release_year)
+            if genre:
+                mask = genre_mask(genre)
+                if mask is None:
+                    return db.catalog.take([])
+                query = query.where_genres(mask, match_all_genres)
+            if min_rating:
+                query = query.where("IMDB_Rating", ">=", min_rating)
+
+            return db.catalog.take(query.top(10, by=["Released_Year", "IMDB_Rating"]))
 
 
     def reset_slots(self):
@@ -658,16 +735,17 @@ class ValidateGrossVotesRecommendationForm(FormValidationAction):
         return {"form_gross": tracker.get_slot("form_gross")} 
         
 
-class ActionGrossVotesRecommendation(Action):
+class ActionGrossVotesRecommendation(CatalogAction):
     def name(self) -> Text:
         return "action_gross_votes_recommendation"
 
-    def run(self, dispatcher: CollectingDispatcher, 
+    def run_sync(self, dispatcher: CollectingDispatcher, 
             tracker: Tracker, 
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         votes_threshold = tracker.get_slot("form_votes")
         gross_threshold = tracker.get_slot("form_gross")
+        lap("slot_read")
 
         try:
             votes_threshold = int(votes_threshold)
@@ -678,27 +756,21 @@ class ActionGrossVotesRecommendation(Action):
             )
             return []
 
-        movies_df["Gross"] = movies_df["Gross"].replace({',': ''}, regex=True)
-        movies_df["Gross"] = pd.to_numeric(movies_df["Gross"], errors='coerce')
-
-        
-        filtered_movies = movies_df[
-            (movies_df['No_of_Votes'] >= votes_threshold) & 
-            (movies_df['Gross'] >= gross_threshold)
-        ].dropna(subset=['Series_Title', 'No_of_Votes', 'Gross'])
-
-        filtered_movies = filtered_movies.head(10)
-        filtered_movies = filtered_movies.sort_values(by=['No_of_Votes', 'Gross'], ascending=[False, False])
+        # NaN never passes a threshold, so movies without gross are left out
+        db = catalog_manager.current
+        query = (
+            MovieQuery(db.catalog, db.rank_index)
+            .where('No_of_Votes', '>=', votes_threshold)
+            .where('Gross', '>=', gross_threshold)
+        )
+        filtered_movies = db.catalog.take(query.top(10, by=['No_of_Votes', 'Gross']))
         if not filtered_movies.empty:
-            dispatcher.utter_message(text="🎥 Here are the top 10 films that match your criteria:")
-            for _, movie in filtered_movies.iterrows():
-                message = (
-                    f"• {movie['Series_Title']}\n"
-                    f"   - Votes: {movie['No_of_Votes']} (based on reviews)\n"
-                    f"   - Gross: ${movie['Gross']}\n"
-                )
-                dispatcher.utter_message(text=message, image=movie['Poster_Link'])
-            
+            utter_movies(
+                dispatcher, filtered_movies,
+                "• {Series_Title}\n   - Votes: {No_of_Votes} (based on reviews)\n   - Gross: ${Gross}\n",
+                header="🎥 Here are the top 10 films that match your criteria:",
+            )
+
         else:
             dispatcher.utter_message(
                 text=f"😔 Sorry, I couldn't find any movies with at least {votes_threshold} votes and ${gross_threshold} gross."
@@ -756,3 +828,13 @@ class ActionResumeFormGrossMovie(Action):
        
         dispatcher.utter_message(text="🔄 Let's pick up where we left off! 😊")
         return [ActiveLoop("gross_votes_recommendation_form")]
+
+
+# latency metrics of every action above, see metrics.py
+instrument_actions(sys.modules[__name__])
+
+_loaded = catalog_manager.history[0]
+logger.info(
+    f"Actions ready {time.perf_counter() - IMPORT_STARTED:.2f}s after import: "
+    f"catalog of {_loaded['movies']} movies ({_loaded['kind']}) loaded in {_loaded['build_s']:.2f}s"
+)
@@ -0,0 +1,276 @@
+# Aggregates of the catalog for counting and statistics questions ("how
+# many films by Nolan above 8", "how many dramas from the 90s", "average
+# rating of the crime films of the 70s").
+#
+# The movies are grouped by director, actor, genre, decade and genre and
+# decade together. The movies of each group are stored sorted by rating,
+# best first, with running totals of their ratings, gross and votes: the
+# count, mean and best rating, total gross and total votes of the movies of
+# a group rated above any threshold are read from one binary search in the
+# group, however many movies it has. The totals are integers (ratings in
+# hundredths, gross in dollars), so that the difference of two of them is
+# the exact sum of the movies in between. All the groups of a dimension share
+# flat arrays, in the layout of a CSR matrix: the movies of group g are the
+# entries offsets[g]:offsets[g + 1].
+#
+# The aggregates are built with every catalog generation, so a reload
+# rebuilds them, and incremental updates patch them (see updates.py).
+#
+#   python -m actions.aggregates director "Christopher Nolan" --min-rating 8
+#   python -m actions.aggregates genre_decade drama 1990 --min-rating 8
+
+import argparse
+import copy
+import itertools
+import json
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Text, Tuple
+
+import numpy as np
+
+from .catalog import DATASET_PATH, GENRES, MovieCatalog, open_catalog
+from .indexes import normalize
+
+STAR_COLUMNS = ["Star1", "Star2", "Star3", "Star4"]
+# ratings are summed in hundredths
+RATING_SCALE = 100
+
+
+def _director_keys(catalog: MovieCatalog, rows: np.ndarray) -> Tuple[np.ndarray, List[Hashable]]:
+    names = catalog.column("Director", rows)
+    pairs = [(row, normalize(name)) for row, name in zip(rows.tolist(), names) if isinstance(name, str) and name]
+    return np.array([row for row, _ in pairs], dtype=np.int64), [key for _, key in pairs]
+
+
+def _actor_keys(catalog: MovieCatalog, rows: np.ndarray) -> Tuple[np.ndarray, List[Hashable]]:
+    columns = [catalog.column(column, rows) for column in STAR_COLUMNS]
+    pairs = []
+    for row, names in zip(rows.tolist(), zip(*columns)):
+        # a star listed twice in a movie counts once
+        keys = dict.fromkeys(normalize(name) for name in names if isinstance(name, str) and name)
+        pairs.extend((row, key) for key in keys)
+    return np.array([row for row, _ in pairs], dtype=np.int64), [key for _, key in pairs]
+
+
+def _genre_keys(catalog: MovieCatalog, rows: np.ndarray) -> Tuple[np.ndarray, List[Hashable]]:
+    masks = np.asarray(catalog.column("Genre_Mask"), dtype=np.int64)[rows]
+    of_genre = [rows[(masks >> bit & 1).astype(bool)] for bit in range(len(GENRES))]
+    keys = [genre.lower() for genre, genre_rows in zip(GENRES, of_genre) for _ in range(len(genre_rows))]
+    return np.concatenate(of_genre), keys
+
+
+def _decade_keys(catalog: MovieCatalog, rows: np.ndarray) -> Tuple[np.ndarray, List[Hashable]]:
+    years = np.asarray(catalog.column("Released_Year"), dtype=np.int64)[rows]
+    # 0: unknown year
+    known = years > 0
+    return rows[known], (years[known] // 10 * 10).tolist()
+
+
+def _genre_decade_keys(catalog: MovieCatalog, rows: np.ndarray) -> Tuple[np.ndarray, List[Hashable]]:
+    genre_rows, genres = _genre_keys(catalog, rows)
+    decade_rows, decades = _decade_keys(catalog, genre_rows)
+    known = np.isin(genre_rows, decade_rows)
+    return decade_rows, [(genre, decade) for genre, decade in zip(itertools.compress(genres, known), decades)]
+
+
+# dimension -> (entry rows, group keys) of the given rows of a catalog
+DIMENSIONS: Dict[Text, Callable[[MovieCatalog, np.ndarray], Tuple[np.ndarray, List[Hashable]]]] = {
+    "director": _director_keys,
+    "actor": _actor_keys,
+    "genre": _genre_keys,
+    "decade": _decade_keys,
+    "genre_decade": _genre_decade_keys,
+}
+
+
+def _ranked(catalog: MovieCatalog, rows: np.ndarray, groups: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """`rows` sorted by group, then rating (best first, unrated last), and
+    their ratings, negated (so ascending within a group)."""
+    ratings = np.asarray(catalog.column("IMDB_Rating"), dtype=np.float64)[rows]
+    order = np.lexsort((rows, -ratings) if groups is None else (rows, -ratings, groups))
+    return rows[order], -ratings[order]
+
+
+def _running_totals(catalog: MovieCatalog, rows: np.ndarray, negated: np.ndarray) -> Dict[Text, np.ndarray]:
+    """Running totals of the measures of `rows`, after a leading 0."""
+    gross = np.asarray(catalog.column("Gross"), dtype=np.float64)[rows]
+    votes = np.asarray(catalog.column("No_of_Votes"), dtype=np.float64)[rows]
+    return {
+        name: np.concatenate([[0], np.cumsum(np.rint(np.nan_to_num(values) * scale).astype(np.int64))])
+        for name, values, scale in (("rating", -negated, RATING_SCALE), ("gross", gross, 1), ("votes", votes, 1))
+    }
+
+
+class _Groups:
+    """The movies of the groups of one dimension, each group sorted by
+    rating (best first, unrated last), with running totals.
+
+    Incremental updates leave the shared arrays as they are: the groups
+    they change get their own arrays, in `changed`, which are looked up
+    first."""
+
+    def __init__(self, group_of: Dict[Hashable, int], groups: np.ndarray, rows: np.ndarray, catalog: MovieCatalog):
+        # key -> group, in the order of the groups
+        self.group_of = group_of
+        self.rows, self.negated = _ranked(catalog, rows, groups)
+        self.offsets = np.zeros(len(group_of) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(groups, minlength=len(group_of)), out=self.offsets[1:])
+        # running totals over all the entries, a leading 0 for the differences
+        self.totals = _running_totals(catalog, self.rows, self.negated)
+        # key -> (rows, negated ratings, running totals) of the patched groups
+        self.changed: Dict[Hashable, Tuple[np.ndarray, np.ndarray, Dict[Text, np.ndarray]]] = {}
+
+    @classmethod
+    def build(cls, catalog: MovieCatalog, dimension: Text, rows: np.ndarray) -> "_Groups":
+        entry_rows, keys = DIMENSIONS[dimension](catalog, rows)
+        group_of: Dict[Hashable, int] = {}
+        groups = np.fromiter((group_of.setdefault(key, len(group_of)) for key in keys), dtype=np.int64, count=len(keys))
+        return cls(group_of, groups, entry_rows, catalog)
+
+    @classmethod
+    def from_postings(cls, catalog: MovieCatalog, postings: Dict[Hashable, Sequence[int]]) -> "_Groups":
+        """Groups of the {key: rows} of an index (e.g. PersonIndex.rows)."""
+        lengths = np.fromiter(map(len, postings.values()), dtype=np.int64, count=len(postings))
+        rows = np.fromiter(itertools.chain.from_iterable(postings.values()), dtype=np.int64, count=int(lengths.sum()))
+        groups = np.repeat(np.arange(len(postings), dtype=np.int64), lengths)
+        if catalog.deleted is not None:
+            live = ~catalog.deleted[rows]
+            rows, groups = rows[live], groups[live]
+        return cls({key: group for group, key in enumerate(postings)}, groups, rows, catalog)
+
+    def group(self, key: Hashable) -> Optional[Tuple[np.ndarray, np.ndarray, Dict[Text, np.ndarray]]]:
+        """(rows, negated ratings, running totals) of the group of `key`."""
+        if key in self.changed:
+            return self.changed[key]
+        group = self.group_of.get(key)
+        if group is None:
+            return None
+        start, end = int(self.offsets[group]), int(self.offsets[group + 1])
+        totals = {name: values[start:end + 1] for name, values in self.totals.items()}
+        return self.rows[start:end], self.negated[start:end], totals
+
+    def patched(
+        self, previous: MovieCatalog, catalog: MovieCatalog, dimension: Text, stale: np.ndarray, fresh: np.ndarray
+    ) -> "_Groups":
+        """Groups of `catalog`, whose `stale` rows (as in the `previous`
+        catalog) were removed and `fresh` ones added. Only the groups of
+        those rows are sorted again; emptied ones stay, empty."""
+        old_rows, old_keys = DIMENSIONS[dimension](previous, stale[stale < len(previous)])
+        new_rows, new_keys = DIMENSIONS[dimension](catalog, fresh)
+        added: Dict[Hashable, List[int]] = {}
+        for row, key in zip(new_rows.tolist(), new_keys):
+            added.setdefault(key, []).append(row)
+        groups = copy.copy(self)
+        groups.changed = dict(self.changed)
+        for key in dict.fromkeys(itertools.chain(old_keys, added)):
+            current = self.group(key)
+            rows = current[0] if current is not None else np.zeros(0, dtype=np.int64)
+            rows = np.concatenate([rows[~np.isin(rows, stale)], np.asarray(added.get(key, []), dtype=np.int64)])
+            rows, negated = _ranked(catalog, rows)
+            groups.changed[key] = rows, negated, _running_totals(catalog, rows, negated)
+        return groups
+
+    def stats(self, key: Hashable, min_rating: Optional[float] = None, strict: bool = False) -> Optional[Dict[Text, Any]]:
+        group = self.group(key)
+        if group is None:
+            return None
+        _, ratings, totals = group
+        # the unrated movies (NaN) are last
+        end, rated = len(ratings), int(np.searchsorted(ratings, np.inf, side="right"))
+        if min_rating is not None:
+            end = rated = int(np.searchsorted(ratings, -min_rating, side="left" if strict else "right"))
+        total = {name: int(values[end] - values[0]) for name, values in totals.items()}
+        return {
+            "count": end,
+            "mean_rating": total["rating"] / (RATING_SCALE * rated) if rated else None,
+            "max_rating": float(-ratings[0]) if rated else None,
+            "gross": float(total["gross"]),
+            "votes": total["votes"],
+        }
+
+
+class AggregateCube:
+    """Counts and statistics of the movies of each director, actor, genre,
+    decade and genre and decade, by rating threshold."""
+
+    def __init__(self, dimensions: Dict[Text, _Groups]):
+        self.dimensions = dimensions
+
+    @classmethod
+    def build(cls, catalog: MovieCatalog, people: Optional[Dict[Text, Dict[Text, Sequence[int]]]] = None) -> "AggregateCube":
+        """The aggregates of `catalog`. The groups of the people can be
+        taken from the `rows` of their PersonIndex ({"director": ...,
+        "actor": ...}), which are keyed like them."""
+        people = people or {}
+        rows = np.arange(len(catalog), dtype=np.int64)
+        if catalog.deleted is not None:
+            rows = rows[~catalog.deleted]
+        return cls({
+            dimension: _Groups.from_postings(catalog, people[dimension]) if dimension in people
+            else _Groups.build(catalog, dimension, rows)
+            for dimension in DIMENSIONS
+        })
+
+    @staticmethod
+    def key(dimension: Text, value: Any) -> Hashable:
+        """The group key of a value as asked: a name, a genre, a year of the
+        decade, or a (genre, year) pair."""
+        if dimension in ("director", "actor"):
+            # as in PersonIndex.rows_of
+            return normalize(value)
+        if dimension == "genre":
+            return str(value).strip().lower()
+        if dimension == "decade":
+            return int(value) // 10 * 10
+        genre, year = value
+        return str(genre).strip().lower(), int(year) // 10 * 10
+
+    def stats(
+        self, dimension: Text, value: Any, min_rating: Optional[float] = None, strict: bool = False
+    ) -> Optional[Dict[Text, Any]]:
+        """{count, mean_rating, max_rating, gross, votes} of the movies of a
+        group rated at least (more than, if `strict`) `min_rating`; None
+        for an unknown group. Unknown gross and votes count as 0."""
+        if dimension not in self.dimensions:
+            raise ValueError(f"Unknown dimension {dimension!r}, expected one of {', '.join(self.dimensions)}")
+        return self.dimensions[dimension].stats(self.key(dimension, value), min_rating, strict)
+
+    def count(self, dimension: Text, value: Any, min_rating: Optional[float] = None, strict: bool = False) -> int:
+        """Movies of a group rated at least (more than, if `strict`) `min_rating`."""
+        stats = self.stats(dimension, value, min_rating, strict)
+        return stats["count"] if stats else 0
+
+    def patched(
+        self, previous: MovieCatalog, catalog: MovieCatalog, changed: Iterable[int], deleted: Iterable[int] = ()
+    ) -> "AggregateCube":
+        """New aggregates for `catalog`, whose `changed` and `deleted` rows
+        are the only ones that differ from the aggregated catalog,
+        `previous`; only the groups of those rows are updated."""
+        changed = np.asarray(list(changed), dtype=np.int64)
+        deleted = np.asarray(list(deleted), dtype=np.int64)
+        stale = np.union1d(changed, deleted)
+        fresh = np.setdiff1d(changed, deleted)
+        cube = copy.copy(self)
+        cube.dimensions = {
+            dimension: groups.patched(previous, catalog, dimension, stale, fresh)
+            for dimension, groups in self.dimensions.items()
+        }
+        return cube
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print the statistics of a group of movies of the catalog.")
+    parser.add_argument("--catalog", default=DATASET_PATH, help="CSV dataset or columnar catalog directory")
+    parser.add_argument("dimension", choices=list(DIMENSIONS))
+    parser.add_argument("value", nargs="+", help="name, genre or year; genre and year for genre_decade")
+    parser.add_argument("--min-rating", type=float, help="only the movies rated at least this")
+    args = parser.parse_args()
+
+    value = tuple(args.value) if args.dimension == "genre_decade" else " ".join(args.value)
+    if args.dimension == "genre_decade" and len(value) != 2:
+        parser.exit(2, "genre_decade needs a genre and a year\n")
+    stats = AggregateCube.build(open_catalog(args.catalog)).stats(args.dimension, value, args.min_rating)
+    if stats is None:
+        parser.exit(1, f"No {args.dimension} {' '.join(args.value)!r} in the catalog\n")
+    if stats["mean_rating"] is not None:
+        stats["mean_rating"] = round(stats["mean_rating"], 2)
+    print(json.dumps(stats, indent=2))
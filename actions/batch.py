@@ -0,0 +1,290 @@
+# Batch evaluation of the lookup actions.
+#
+# Offline evaluation replays thousands of questions through the actions.
+# Called one at a time, each of them does its own lookups and, when the name
+# is misspelled, scores it alone against every title or name of the catalog.
+# `run_batch` resolves a whole list of queries together:
+#
+#   1. the distinct queries are looked up together in the index of their
+#      action (see TitleIndex.search_many and PersonIndex.search_many);
+#   2. only the queries without a match are fuzzy-matched, together, in one
+#      matrix of scores per matcher (see FuzzyMatcher.extract_many);
+#   3. the accepted corrections are looked up together.
+#
+# Every distinct request is then answered by the `run_sync` of its action,
+# on a copy of the catalog generation whose indexes and matchers return the
+# results computed above, and whose catalog builds the DataFrame of each
+# distinct selection of rows once: the messages are the ones the action
+# sends in a conversation, and come with the matched rows and the fuzzy
+# correction.
+#
+# The queries are read from a JSONL file, one {"action": ..., "query": ...}
+# per line, plus "slots" for the other slots of the action (e.g.
+# {"form_quality": "8"} for action_count_films):
+#
+#   python -m actions.batch queries.jsonl --out results.jsonl
+#   python -m actions.batch queries.jsonl --check                     # compare with one call per query
+#   python -m actions.batch queries.jsonl --expected results.jsonl    # compare with a previous run
+
+import argparse
+import copy
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Text, Tuple
+
+import numpy as np
+from rasa_sdk import Tracker
+from rasa_sdk.executor import CollectingDispatcher
+
+from .actions import (
+    ActionAskActor,
+    ActionAskDirector,
+    ActionAskMovieInfo,
+    ActionCountFilms,
+    catalog_manager,
+    soglia_fuzzy,
+)
+from .manager import CatalogGeneration
+
+# action -> (slot of the query, index searched, matcher of the misspelled queries)
+BATCH_ACTIONS: Dict[Text, Tuple[Text, Text, Text]] = {
+    "action_ask_movie_info": ("movie", "title_index", "title_matcher"),
+    "action_movies_by_actor": ("actor", "actor_index", "actor_matcher"),
+    "action_movies_by_director": ("director", "director_index", "director_matcher"),
+    "action_count_films": ("form_author", "director_index", "director_matcher"),
+}
+
+ACTIONS = {action.name(): action for action in (
+    ActionAskMovieInfo(), ActionAskActor(), ActionAskDirector(), ActionCountFilms()
+)}
+
+
+class _Answered:
+    """`target`, with some of its one-argument methods answering from
+    precomputed results: `_Answered(index, search={query: rows})`."""
+
+    def __init__(self, target: Any, **answers: Dict[Any, Any]):
+        self._target = target
+        self._answers = answers
+
+    def __getattr__(self, name: Text) -> Any:
+        attribute = getattr(self._target, name)
+        answers = self._answers.get(name)
+        if answers is None:
+            return attribute
+
+        def answer(key):
+            if key not in answers:
+                return attribute(key)
+            result = answers[key]
+            # the indexes return new lists
+            return list(result) if isinstance(result, list) else result
+
+        return answer
+
+
+class _Taken:
+    """`catalog`, whose `take` builds the frame of each distinct selection
+    of rows once, and returns copies of it."""
+
+    def __init__(self, catalog: Any):
+        self._catalog = catalog
+        self._frames: Dict[Tuple, Any] = {}
+
+    def __getattr__(self, name: Text) -> Any:
+        return getattr(self._catalog, name)
+
+    def __len__(self) -> int:
+        return len(self._catalog)
+
+    def take(self, rows, columns: Optional[Sequence[Text]] = None):
+        key = (tuple(np.asarray(rows, dtype=np.int64).tolist()), None if columns is None else tuple(columns))
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self._frames[key] = self._catalog.take(list(key[0]), columns)
+        return frame.copy()
+
+
+def _slots(request: Dict[Text, Any]) -> Dict[Text, Any]:
+    slot = BATCH_ACTIONS[request["action"]][0]
+    slots = dict(request.get("slots") or {})
+    if "query" in request:
+        slots[slot] = request["query"]
+    return slots
+
+
+def _call(action: Text, slots: Dict[Text, Any]) -> Dict[Text, Any]:
+    """Messages and events of one call of `action` on the current generation."""
+    dispatcher = CollectingDispatcher()
+    tracker = Tracker("batch", slots, {}, [], False, None, {}, None)
+    try:
+        events = ACTIONS[action].run_sync(dispatcher, tracker, {})
+    except Exception as e:
+        return {"messages": dispatcher.messages, "events": [], "error": f"{type(e).__name__}: {e}"}
+    return {"messages": dispatcher.messages, "events": events}
+
+
+def _text(messages: Sequence[Dict[Text, Any]]) -> Text:
+    return "\n".join(message["text"] for message in messages if message.get("text"))
+
+
+def run_batch(requests: Sequence[Dict[Text, Any]], generation: Optional[CatalogGeneration] = None) -> List[Dict[Text, Any]]:
+    """Answer every request ({"action", "query", "slots"}) on `generation`
+    (default: the current one), in order.
+
+    Each result has the action, its slots, the rows matched by the query
+    (after correction) and their titles, the fuzzy correction tried if
+    there was no exact match (name, score and whether it was accepted), and
+    the messages, their text and the events of the action.
+    """
+    generation = generation or catalog_manager.current
+    for request in requests:
+        if request.get("action") not in BATCH_ACTIONS:
+            raise ValueError(f"Unknown action {request.get('action')!r}, expected one of {', '.join(BATCH_ACTIONS)}")
+
+    # distinct queries of each (index, matcher), in order of appearance
+    groups: Dict[Tuple[Text, Text], Dict[Text, None]] = {}
+    for request in requests:
+        slot, index, matcher = BATCH_ACTIONS[request["action"]]
+        query = _slots(request).get(slot)
+        if isinstance(query, str) and query:
+            groups.setdefault((index, matcher), {})[query] = None
+
+    found: Dict[Text, Dict[Text, List[int]]] = {}
+    corrections: Dict[Text, Dict[Text, Tuple[Optional[Text], int]]] = {}
+    for (index_name, matcher_name), queries in groups.items():
+        index, rows = getattr(generation, index_name), found.setdefault(index_name, {})
+        rows.update(index.search_many([query for query in queries if query not in rows]))
+        best = getattr(generation, matcher_name).extract_many([query for query in queries if not rows[query]])
+        corrections.setdefault(matcher_name, {}).update(best)
+        rows.update(index.search_many(
+            {name: None for name, score in best.values() if score > soglia_fuzzy and name not in rows}
+        ))
+
+    answered = copy.copy(generation)
+    answered.catalog = _Taken(generation.catalog)
+    for index_name, rows in found.items():
+        setattr(answered, index_name, _Answered(getattr(generation, index_name), search=rows))
+    for matcher_name, best in corrections.items():
+        setattr(answered, matcher_name, _Answered(getattr(generation, matcher_name), extract_one=best))
+
+    titles = generation.catalog.column("Series_Title")
+    answers: Dict[Text, Dict[Text, Any]] = {}
+    results = []
+    with catalog_manager.pinned(answered):
+        for request in requests:
+            action = request["action"]
+            slot, index_name, matcher_name = BATCH_ACTIONS[action]
+            slots = _slots(request)
+            query = slots.get(slot)
+
+            rows: List[int] = []
+            correction = None
+            if isinstance(query, str) and query:
+                rows = found[index_name][query]
+                best = corrections[matcher_name].get(query) if not rows else None
+                if best is not None and best[0] is not None:
+                    name, score = best
+                    correction = {"name": name, "score": score, "accepted": score > soglia_fuzzy}
+                    if correction["accepted"]:
+                        rows = found[index_name][name]
+
+            key = json.dumps([action, slots], sort_keys=True, default=str)
+            if key not in answers:
+                answers[key] = _call(action, slots)
+            answer = copy.deepcopy(answers[key])
+            results.append({
+                "action": action,
+                "query": query,
+                "slots": slots,
+                "rows": [int(row) for row in rows],
+                "titles": [titles[row] for row in rows],
+                "correction": correction,
+                **answer,
+                "text": _text(answer["messages"]),
+            })
+    return results
+
+
+def run_each(requests: Sequence[Dict[Text, Any]], generation: Optional[CatalogGeneration] = None) -> List[Dict[Text, Any]]:
+    """Answer the requests one call at a time, as in conversations."""
+    generation = generation or catalog_manager.current
+    results = []
+    with catalog_manager.pinned(generation):
+        for request in requests:
+            answer = _call(request["action"], _slots(request))
+            results.append({**answer, "text": _text(answer["messages"])})
+    return results
+
+
+def _answer(result: Dict[Text, Any]) -> Tuple:
+    return result["messages"], result["events"], result.get("error")
+
+
+def _compare(requests: Sequence[Dict[Text, Any]], results: Sequence[Dict[Text, Any]],
+             expected: Sequence[Dict[Text, Any]], what: Text) -> int:
+    """Print the requests answered differently than in `expected`; return how many."""
+    mismatches = 0
+    for line, (request, result, other) in enumerate(zip(requests, results, expected), 1):
+        if _answer(result) != _answer(other):
+            mismatches += 1
+            print(f"line {line}: {request['action']} {request.get('query')!r} differs from {what}:\n"
+                  f"  batch: {result['text']!r}\n  {what}: {other['text']!r}", file=sys.stderr)
+    return mismatches
+
+
+def _timed(func: Callable, *args: Any) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def _read_jsonl(path: Text) -> List[Dict[Text, Any]]:
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    with f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a batch of lookup queries with the actions.")
+    parser.add_argument("queries", help='JSONL file of {"action", "query", "slots"} ("-": standard input)')
+    parser.add_argument("--out", help="write the results there, one JSON per line (default: standard output)")
+    parser.add_argument("--check", action="store_true", help="also answer the queries one call at a time and compare")
+    parser.add_argument("--expected", help="results of a previous run to compare with")
+    args = parser.parse_args()
+
+    requests = _read_jsonl(args.queries)
+    generation = catalog_manager.current
+    try:
+        results, seconds = _timed(run_batch, requests, generation)
+    except ValueError as e:
+        parser.exit(2, f"{e}\n")
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    for result in results:
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+    if args.out:
+        out.close()
+
+    distinct = len({(request["action"], result["query"]) for request, result in zip(requests, results)})
+    fuzzy = sum(result["correction"] is not None for result in results)
+    errors = sum("error" in result for result in results)
+    print(f"{len(results)} queries ({distinct} distinct, {fuzzy} fuzzy-matched, {errors} errors) "
+          f"on {len(generation.catalog)} movies in {seconds:.3f}s: {len(results) / max(seconds, 1e-9):.0f} queries/s",
+          file=sys.stderr)
+
+    mismatches = 0
+    if args.check:
+        each, each_seconds = _timed(run_each, requests, generation)
+        mismatches += _compare(requests, results, each, "one call")
+        print(f"One call per query: {each_seconds:.3f}s (batch speedup {each_seconds / max(seconds, 1e-9):.1f}x)",
+              file=sys.stderr)
+    if args.expected:
+        expected = _read_jsonl(args.expected)
+        if len(expected) != len(results):
+            parser.exit(1, f"{args.expected} has {len(expected)} results for {len(results)} queries\n")
+        mismatches += _compare(requests, results, expected, "expected")
+    if args.check or args.expected:
+        print(f"{mismatches} mismatches", file=sys.stderr)
+    sys.exit(1 if mismatches else 0)
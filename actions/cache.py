@@ -0,0 +1,129 @@
+# Cache of the rendered answers of the lookup actions.
+#
+# Most conversations ask the same few questions (the top-10 list, the
+# director of a famous film, the films of a popular actor), and the answer
+# only depends on the action and on the values of a few slots. The cache
+# keeps, for each (action name, normalized slot values), the messages sent
+# through the dispatcher and the returned events, so that a repeated
+# question is answered without touching the catalog.
+#
+# Entries are evicted least recently used first once there are more than
+# MOVIEBOT_CACHE_SIZE of them, and expire MOVIEBOT_CACHE_TTL seconds after
+# being stored. The whole cache must be invalidated when the catalog is
+# reloaded. A size of 0 disables it.
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Text, Tuple
+
+from .indexes import normalize
+
+
+CACHE_SIZE = int(os.environ.get("MOVIEBOT_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.environ.get("MOVIEBOT_CACHE_TTL", "3600"))
+
+Response = Tuple[List[Dict[Text, Any]], List[Dict[Text, Any]]]
+
+
+def slot_key(value: Any) -> Any:
+    """Cache key of a slot value: case, accents and spacing are ignored."""
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return tuple(slot_key(item) for item in value)
+    if isinstance(value, str):
+        return " ".join(normalize(value).split())
+    try:
+        hash(value)
+    except TypeError:
+        # e.g. a dict, for entities with roles and groups or custom slots
+        return json.dumps(value, sort_keys=True, default=str)
+    return value
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of (messages, events) with a time to live."""
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Tuple[float, Response]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # bumped by invalidate(): responses computed before are not stored
+        self.generation = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    @staticmethod
+    def key(action: Text, slots: Iterable[Any]) -> Tuple:
+        return (action,) + tuple(slot_key(value) for value in slots)
+
+    def get(self, key: Tuple) -> Optional[Response]:
+        """Copy of the response stored under `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            messages, events = entry[1]
+        return [dict(message) for message in messages], [dict(event) for event in events]
+
+    def put(
+        self, key: Tuple, messages: List[Dict[Text, Any]], events: List[Dict[Text, Any]],
+        generation: Optional[int] = None,
+    ) -> None:
+        """Store a response; dropped if the cache was invalidated since
+        `generation` was read."""
+        if not self.enabled:
+            return
+        response = ([dict(message) for message in messages], [dict(event) for event in events])
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self) -> None:
+        """Forget every response, e.g. because the catalog changed."""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+            self.generation += 1
+
+    def stats(self) -> Dict[Text, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# shared by all the actions of the process
+response_cache = ResponseCache()
@@ -0,0 +1,563 @@
+# Loading and storage of the IMDB movie dataset.
+#
+# The raw CSV stores most measures as text ("142 min", "28,341,469", a
+# "PG" in Released_Year...). They are parsed once here, so the actions can
+# compare and sort them directly and never have to write to the shared
+# data while handling a request.
+#
+# The actions access the movies through a MovieCatalog, which has two
+# implementations:
+#   - DataFrameCatalog: the parsed CSV, in memory in a compact layout: the
+#     people, genre and certificate columns are dictionary-encoded (the five
+#     people columns share one table of names, whose strings are also the
+#     ones all the indexes hold), and the long texts (Overview,
+#     Poster_Link) are packed out of the DataFrame into one UTF-8 buffer
+#     each, decoded only for the rows being shown
+#   - ColumnarCatalog: a directory of memory-mapped NumPy columns, built once
+#     from the CSV with `python -m actions.catalog build`. Column pages are
+#     only read when used and long texts (Overview, Poster_Link...) are only
+#     decoded for the rows being shown.
+#
+# Rebuilding a columnar catalog in place is safe for a server using it:
+# every file is replaced by a new one (never truncated, which would break
+# its mappings) and meta.json is written last.
+
+import argparse
+import copy
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Text, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CSV_PATH = os.path.join(PROJECT_ROOT, "Dataset", "imdb_top_1000.csv")
+COLUMNAR_PATH = os.path.join(PROJECT_ROOT, "Dataset", "imdb_top_1000.catalog")
+# a CSV file or a directory built by `python -m actions.catalog build`
+DATASET_PATH = os.environ.get("MOVIEBOT_CATALOG", CSV_PATH)
+
+COLUMNS = ["Poster_Link", "Series_Title", "Released_Year", "Certificate", "Runtime", "Genre",
+           "IMDB_Rating", "Overview", "Meta_score", "Director", "Star1", "Star2", "Star3", "Star4",
+           "No_of_Votes", "Gross", "Genres", "Genre_Mask"]
+NUMERIC_COLUMNS = {
+    "Released_Year": "int64",
+    "Runtime": "int64",
+    "IMDB_Rating": "float64",
+    "Meta_score": "float64",
+    "No_of_Votes": "int64",
+    "Gross": "float64",
+    "Genre_Mask": "int64",
+}
+
+# columns of the CSV, the others are derived from them
+RAW_COLUMNS = [name for name in COLUMNS if name not in ("Genres", "Genre_Mask")]
+
+# dictionary-encoded in memory; the people columns share their table of names
+PEOPLE_COLUMNS = ["Director", "Star1", "Star2", "Star3", "Star4"]
+CATEGORY_COLUMNS = PEOPLE_COLUMNS + ["Genre", "Certificate"]
+# kept out of the DataFrame, decoded only for the rows being shown
+PACKED_COLUMNS = ["Overview", "Poster_Link"]
+
+GENRE_SEPARATOR = ","
+
+# Genres of the dataset, in the order of their bit in Genre_Mask.
+GENRES = ['Drama', 'Crime', 'Action', 'Adventure', 'Biography', 'History', 'Sci-Fi',
+ 'Romance', 'Western', 'Fantasy', 'Comedy', 'Thriller', 'Animation', 'Family',
+ 'War', 'Mystery', 'Music', 'Horror', 'Musical', 'Film-Noir', 'Sport']
+GENRE_BITS = {genre.lower(): 1 << bit for bit, genre in enumerate(GENRES)}
+
+
+def split_genres(genre: Text) -> Tuple[Text, ...]:
+    """'Crime, Drama' -> ('Crime', 'Drama')"""
+    if not isinstance(genre, str):
+        return ()
+    return tuple(g.strip() for g in genre.split(GENRE_SEPARATOR) if g.strip())
+
+
+def genre_mask(genres: Union[Text, Iterable[Text]]) -> Optional[int]:
+    """Bitmask of the given genre names (case insensitive).
+
+    Accepts a list of names or a comma separated string. Returns None if any
+    of the names is not one of GENRES.
+    """
+    if isinstance(genres, str):
+        genres = split_genres(genres)
+    mask = 0
+    for genre in genres:
+        bit = GENRE_BITS.get(genre.strip().lower())
+        if bit is None:
+            return None
+        mask |= bit
+    return mask
+
+
+def load_movies(path: Text = CSV_PATH) -> pd.DataFrame:
+    """Read the dataset and parse every column into its proper dtype.
+
+    - Released_Year: int, 0 when unknown
+    - Runtime: int, minutes
+    - Gross: float, NaN when unknown
+    - No_of_Votes: int
+    - IMDB_Rating, Meta_score: float, NaN when unknown
+    - Genres: tuple of the genres listed in Genre (which is kept for display)
+    - Genre_Mask: int64 bitmask of Genres, see GENRES
+
+    The returned DataFrame is shared by all the actions and must be treated
+    as read-only.
+    """
+    return parse_movies(read_dataset(path))
+
+
+def read_dataset(path: Text = CSV_PATH, **kwargs) -> pd.DataFrame:
+    """`pd.read_csv(path, **kwargs)`, where an empty file is a dataset
+    without movies (e.g. once they were all deleted)."""
+    try:
+        return pd.read_csv(path, **kwargs)
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame({name: pd.Series([], dtype=object) for name in RAW_COLUMNS})
+
+
+def parse_movies(movies_df: pd.DataFrame) -> pd.DataFrame:
+    """Parse the raw CSV columns of `movies_df` in place (see load_movies).
+
+    Columns missing from `movies_df` are left out, so partial rows (e.g. the
+    fields of an update) can be parsed too.
+    """
+    def parsed(column, parse):
+        if column in movies_df:
+            movies_df[column] = parse(movies_df[column])
+
+    parsed("Released_Year", lambda years: pd.to_numeric(years, errors="coerce").fillna(0).astype(int))
+    parsed("Runtime", lambda runtimes: (
+        pd.to_numeric(runtimes.astype(str).str.extract(r"(\d+)", expand=False), errors="coerce")
+        .fillna(0)
+        .astype(int)
+    ))
+    parsed("Gross", lambda gross: pd.to_numeric(
+        gross.astype(str).str.replace(",", "", regex=False), errors="coerce"
+    ).astype(float))
+    parsed("No_of_Votes", lambda votes: pd.to_numeric(votes, errors="coerce").fillna(0).astype(int))
+    parsed("IMDB_Rating", lambda ratings: pd.to_numeric(ratings, errors="coerce").astype(float))
+    parsed("Meta_score", lambda scores: pd.to_numeric(scores, errors="coerce").astype(float))
+    if "Genre" in movies_df:
+        movies_df["Genres"] = movies_df["Genre"].map(split_genres)
+        # genres outside GENRES don't get a bit, instead of voiding the whole mask
+        movies_df["Genre_Mask"] = movies_df["Genres"].map(
+            lambda genres: genre_mask([g for g in genres if g.lower() in GENRE_BITS])
+        ).astype("int64")
+
+    return movies_df
+
+
+def _object_array(values: List) -> np.ndarray:
+    # element by element, so that tuples are not turned into a 2-D array
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+class MovieCatalog:
+    """Read-only access to the movies, whatever the storage.
+
+    Rows are identified by their position in the dataset (0..len-1), which
+    is what all the indexes store. A deleted row keeps its position and is
+    flagged in `deleted` (None when no row was ever deleted).
+    """
+
+    columns: List[Text] = COLUMNS
+    deleted: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def column(self, name: Text, rows: Optional[Sequence[int]] = None) -> np.ndarray:
+        """All the values of a column, in row order; only those of `rows`
+        if given, without decoding the others."""
+        raise NotImplementedError
+
+    def take(self, rows: Iterable[int], columns: Optional[Sequence[Text]] = None) -> pd.DataFrame:
+        """The given rows, in the given order, indexed by row id."""
+        raise NotImplementedError
+
+    def memory_usage(self) -> Dict[Text, int]:
+        """Bytes held in memory by each column."""
+        raise NotImplementedError
+
+
+class PackedText:
+    """A text column packed in one UTF-8 buffer: value i is
+    data[starts[i]:ends[i]], or missing where `null`. Equal values share
+    their bytes."""
+
+    def __init__(self, data: np.ndarray, starts: np.ndarray, ends: np.ndarray, null: np.ndarray):
+        self.data = data
+        self.starts = starts
+        self.ends = ends
+        self.null = null
+
+    @classmethod
+    def pack(cls, values: Sequence, base: int = 0) -> "PackedText":
+        """Pack `values` (strings, anything else is missing), their bytes
+        starting at `base` in the buffer."""
+        distinct: Dict[Text, int] = {}
+        codes = np.array(
+            [distinct.setdefault(value, len(distinct)) if isinstance(value, str) else -1 for value in values],
+            dtype=np.int64,
+        )
+        encoded = [value.encode("utf-8") for value in distinct]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        ends = np.cumsum(lengths) + base
+        # code -1 (missing) picks the empty value at `base`
+        starts, ends = np.append(ends - lengths, base)[codes], np.append(ends, base)[codes]
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), starts, ends, codes < 0)
+
+    def __len__(self) -> int:
+        return len(self.null)
+
+    def take(self, rows: Iterable[int], missing=None) -> List:
+        data, starts, ends, null = self.data, self.starts, self.ends, self.null
+        return [missing if null[row] else data[starts[row]:ends[row]].tobytes().decode("utf-8") for row in rows]
+
+    def patched(self, updates: Dict[int, object], appended: Sequence) -> "PackedText":
+        """New column with the `updates` ({row: value}) and the `appended`
+        values, whose bytes are added at the end of the buffer."""
+        rows = list(updates)
+        new = PackedText.pack([updates[row] for row in rows] + list(appended), base=len(self.data))
+        columns = []
+        for old, fresh in ((self.starts, new.starts), (self.ends, new.ends), (self.null, new.null)):
+            column = np.concatenate([old, fresh[len(rows):]])
+            column[rows] = fresh[:len(rows)]
+            columns.append(column)
+        return PackedText(np.concatenate([self.data, new.data]), *columns)
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + self.starts.nbytes + self.ends.nbytes + self.null.nbytes
+
+
+def _encode(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Codes (-1 where missing) and table of the distinct values."""
+    codes, table = pd.factorize(values)
+    return codes.astype(np.int32), _object_array(list(table))
+
+
+def compact_frame(movies_df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[Text, np.ndarray]]:
+    """`movies_df` with its CATEGORY_COLUMNS replaced by codes, and the
+    table of each of them (the same one for all the people columns)."""
+    frame = movies_df.copy(deep=False)
+    tables = {}
+    people = [name for name in PEOPLE_COLUMNS if name in frame]
+    if people:
+        codes, table = _encode(np.concatenate([frame[name].to_numpy(dtype=object) for name in people]))
+        for i, name in enumerate(people):
+            frame[name] = codes[i * len(frame):(i + 1) * len(frame)]
+            tables[name] = table
+    for name in CATEGORY_COLUMNS:
+        if name in frame and name not in tables:
+            frame[name], tables[name] = _encode(frame[name].to_numpy(dtype=object))
+    for name in frame.columns:
+        # plain object arrays: read (and patched) without conversion
+        if isinstance(frame[name].dtype, pd.StringDtype):
+            frame[name] = pd.Series(frame[name].to_numpy(dtype=object), index=frame.index, dtype=object)
+    return frame, tables
+
+
+class DataFrameCatalog(MovieCatalog):
+    """The whole dataset in memory: a pandas DataFrame, with codes in place
+    of the CATEGORY_COLUMNS, plus the PACKED_COLUMNS. The Genres are derived
+    from Genre when read."""
+
+    def __init__(self, movies_df: pd.DataFrame, packed: Optional[Dict[Text, PackedText]] = None):
+        movies_df = movies_df.reset_index(drop=True)
+        self.packed = dict(packed or {})
+        stored = set(movies_df.columns) | set(self.packed) | ({"Genres"} if "Genre" in movies_df else set())
+        self.columns = [name for name in COLUMNS if name in stored]
+        for name in PACKED_COLUMNS:
+            if name in movies_df:
+                self.packed[name] = PackedText.pack(movies_df[name].tolist())
+        kept = [name for name in movies_df.columns if name not in self.packed and name != "Genres"]
+        self.movies_df, self.tables = compact_frame(movies_df[kept])
+        # value -> code in each table, built when first patched
+        self._codes: Dict[Text, Dict[object, int]] = {}
+
+    @classmethod
+    def from_csv(cls, path: Text = CSV_PATH) -> "DataFrameCatalog":
+        return cls(load_movies(path))
+
+    def __len__(self) -> int:
+        return len(self.movies_df)
+
+    def _values(self, name: Text, rows=None) -> np.ndarray:
+        """The values of a column, decoded, for `rows` only if given."""
+        if name == "Genres":
+            return _object_array([split_genres(genre) for genre in self._values("Genre", rows)])
+        if name in self.packed:
+            return _object_array(self.packed[name].take(range(len(self)) if rows is None else rows, np.nan))
+        values = self.movies_df[name].to_numpy()
+        if rows is not None:
+            values = values[rows]
+        if name in self.tables:
+            # the table is empty when the column has no value at all (or no row)
+            codes, present = values, values >= 0
+            values = np.full(len(codes), np.nan, dtype=object)
+            values[present] = self.tables[name][codes[present]]
+        return values
+
+    def column(self, name: Text, rows: Optional[Sequence[int]] = None) -> np.ndarray:
+        return self._values(name, None if rows is None else np.asarray(rows, dtype=np.int64))
+
+    def take(self, rows: Iterable[int], columns: Optional[Sequence[Text]] = None) -> pd.DataFrame:
+        rows = np.asarray(rows, dtype=np.int64)
+        return pd.DataFrame({name: self._values(name, rows) for name in columns or self.columns}, index=rows)
+
+    def memory_usage(self) -> Dict[Text, int]:
+        """Bytes used by each column; the table of names shared by the
+        people columns is counted apart, as "(people)"."""
+        usage = {}
+        for name in self.movies_df.columns:
+            usage[name] = int(self.movies_df[name].memory_usage(index=False, deep=True))
+            if name in self.tables and name not in PEOPLE_COLUMNS:
+                usage[name] += int(pd.Series(self.tables[name]).memory_usage(index=False, deep=True))
+        for name, packed in self.packed.items():
+            usage[name] = packed.nbytes
+        people = [name for name in PEOPLE_COLUMNS if name in self.tables]
+        if people:
+            usage["(people)"] = int(pd.Series(self.tables[people[0]]).memory_usage(index=False, deep=True))
+        return usage
+
+    def _table(self, name: Text) -> Text:
+        # the people columns share one table
+        return "(people)" if name in PEOPLE_COLUMNS else name
+
+    def _encoded(self, name: Text, values: Sequence, tables: Dict[Text, np.ndarray]) -> np.ndarray:
+        """Codes of `values` in the table of column `name`; the values not
+        in it yet are appended to it, in `tables`."""
+        table = tables[name]
+        codes = self._codes.setdefault(self._table(name), {})
+        if not codes and len(table):
+            codes.update((value, code) for code, value in enumerate(table.tolist()))
+        encoded = np.full(len(values), -1, dtype=np.int32)
+        added: List = []
+        for i, value in enumerate(values):
+            if not isinstance(value, str):
+                continue
+            code = codes.get(value)
+            # the mapping is shared with the other patched catalogs: check it
+            if code is None or code >= len(table) + len(added) or (
+                table[code] if code < len(table) else added[code - len(table)]
+            ) != value:
+                code = codes[value] = len(table) + len(added)
+                added.append(value)
+            encoded[i] = code
+        if added:
+            table = np.concatenate([table, _object_array(added)])
+            for other in tables:
+                if self._table(other) == self._table(name):
+                    tables[other] = table
+        return encoded
+
+    def patched(
+        self, updates: Dict[int, Dict[Text, object]], inserts: pd.DataFrame, deletes: Iterable[int] = ()
+    ) -> "DataFrameCatalog":
+        """A new catalog with `updates` ({row: {column: value}}) applied,
+        the parsed rows of `inserts` appended and the `deletes` rows flagged.
+        This catalog is left untouched for its current readers: the new one
+        copies its arrays, overwrites the changed rows, and appends the new
+        names to copies of its tables and the new texts to its packed
+        columns."""
+        tables = dict(self.tables)
+        columns = {}
+        for name in self.movies_df.columns:
+            values = self.movies_df[name].to_numpy()
+            rows = [row for row, fields in updates.items() if name in fields]
+            fresh = [updates[row][name] for row in rows] + (list(inserts[name]) if len(inserts) else [])
+            if name in tables:
+                fresh = self._encoded(name, fresh, tables)
+            elif values.dtype == object:
+                fresh = _object_array(fresh)
+            else:
+                fresh = np.asarray(fresh, dtype=values.dtype)
+            values = np.concatenate([values, fresh[len(rows):]])
+            values[rows] = fresh[:len(rows)]
+            columns[name] = values
+        packed = {
+            name: column.patched(
+                {row: fields[name] for row, fields in updates.items() if name in fields},
+                list(inserts[name]) if len(inserts) else [],
+            )
+            for name, column in self.packed.items()
+        }
+
+        catalog = copy.copy(self)
+        catalog.movies_df = pd.DataFrame(
+            {name: pd.Series(values, dtype=values.dtype, copy=False) for name, values in columns.items()}, copy=False
+        )
+        catalog.tables, catalog.packed, catalog._codes = tables, packed, dict(self._codes)
+        deleted = np.zeros(len(catalog), dtype=bool)
+        if self.deleted is not None:
+            deleted[:len(self.deleted)] = self.deleted
+        deleted[list(deletes)] = True
+        catalog.deleted = deleted if deleted.any() else None
+        return catalog
+
+
+class ColumnarCatalog(MovieCatalog):
+    """Memory-mapped columns written by `build_columnar`.
+
+    Numeric columns are plain .npy arrays. Text columns are stored as one
+    UTF-8 byte array plus an array of offsets and a null mask, so a single
+    value can be decoded without reading the rest of the column. Missing
+    texts read as NaN, like in a DataFrameCatalog.
+    """
+
+    VERSION = 1
+
+    def __init__(self, directory: Text):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != self.VERSION:
+            raise ValueError(f"Unsupported catalog version in {directory}: {meta.get('version')}")
+        self.rows = meta["rows"]
+        self.kinds: Dict[Text, Text] = meta["columns"]
+        self._columns: Dict[Text, np.ndarray] = {}
+        # the decoded people columns share their strings, like in a DataFrameCatalog
+        self._names: Dict[Text, Text] = {}
+        # all mapped now: the files of a later rebuild are not mixed with these
+        self._arrays: Dict[Text, np.ndarray] = {}
+        for name, kind in self.kinds.items():
+            for part in ([name] if kind == "numeric" else [name + ".null", name + ".offsets", name + ".data"]):
+                self._arrays[part] = np.load(os.path.join(directory, part + ".npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def _array(self, name: Text) -> np.ndarray:
+        return self._arrays[name]
+
+    def _text(self, name: Text, row: int) -> Union[Text, float]:
+        if self._array(name + ".null")[row]:
+            return np.nan
+        offsets = self._array(name + ".offsets")
+        return self._array(name + ".data")[offsets[row]:offsets[row + 1]].tobytes().decode("utf-8")
+
+    def column(self, name: Text, rows: Optional[Sequence[int]] = None) -> np.ndarray:
+        if name == "Genres":
+            return _object_array([split_genres(genre) for genre in self.column("Genre", rows)])
+        if self.kinds[name] == "numeric":
+            return self._array(name) if rows is None else np.asarray(self._array(name)[np.asarray(rows, dtype=np.int64)])
+        if rows is not None and name not in self._columns:
+            return _object_array([self._text(name, row) for row in rows])
+        if name not in self._columns:
+            values = [self._text(name, row) for row in range(self.rows)]
+            if name in PEOPLE_COLUMNS:
+                values = [self._names.setdefault(value, value) if isinstance(value, str) else value for value in values]
+            self._columns[name] = _object_array(values)
+        return self._columns[name] if rows is None else self._columns[name][np.asarray(rows, dtype=np.int64)]
+
+    def take(self, rows: Iterable[int], columns: Optional[Sequence[Text]] = None) -> pd.DataFrame:
+        rows = np.asarray(rows, dtype=np.int64)
+        data = {}
+        for name in columns or self.columns:
+            if name == "Genres":
+                data[name] = _object_array([split_genres(self._text("Genre", row)) for row in rows])
+            elif self.kinds[name] == "numeric":
+                data[name] = np.asarray(self._array(name)[rows])
+            elif name in self._columns:
+                data[name] = self._columns[name][rows]
+            else:
+                data[name] = _object_array([self._text(name, row) for row in rows])
+        return pd.DataFrame(data, index=rows)
+
+    def memory_usage(self) -> Dict[Text, int]:
+        """Bytes of the columns decoded in memory so far; the mapped files
+        are in the page cache, shared with the other processes."""
+        usage = {}
+        for name, values in self._columns.items():
+            # the strings of the people columns are counted once, apart
+            deep = name not in PEOPLE_COLUMNS
+            usage[name] = int(pd.Series(values).memory_usage(index=False, deep=deep))
+        if self._names:
+            usage["(people)"] = int(pd.Index(list(self._names), dtype=object).memory_usage(deep=True))
+        return usage
+
+
+def _replace(path: Text, write) -> None:
+    """Write `path` through `write(file)` into a new file, then move it in place."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _save(path: Text, array: np.ndarray) -> None:
+    _replace(path, lambda f: np.save(f, array))
+
+
+def build_columnar(csv_path: Text = CSV_PATH, directory: Text = COLUMNAR_PATH) -> None:
+    """Convert the CSV dataset into a ColumnarCatalog directory."""
+    movies_df = load_movies(csv_path)
+    os.makedirs(directory, exist_ok=True)
+
+    kinds = {}
+    for name in COLUMNS:
+        if name == "Genres":
+            continue
+        if name in NUMERIC_COLUMNS:
+            _save(os.path.join(directory, name + ".npy"), movies_df[name].to_numpy(dtype=NUMERIC_COLUMNS[name]))
+            kinds[name] = "numeric"
+            continue
+
+        values = movies_df[name].tolist()
+        null = np.array([not isinstance(value, str) for value in values], dtype=bool)
+        encoded = [value.encode("utf-8") if isinstance(value, str) else b"" for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        _save(os.path.join(directory, name + ".null.npy"), null)
+        _save(os.path.join(directory, name + ".offsets.npy"), offsets)
+        _save(os.path.join(directory, name + ".data.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+        kinds[name] = "text"
+
+    meta = {"version": ColumnarCatalog.VERSION, "rows": len(movies_df), "columns": kinds}
+    _replace(os.path.join(directory, "meta.json"), lambda f: f.write(json.dumps(meta, indent=2).encode("utf-8")))
+
+
+def open_catalog(path: Text = DATASET_PATH) -> MovieCatalog:
+    """A ColumnarCatalog if `path` is a directory, else the CSV in memory."""
+    if os.path.isdir(path):
+        return ColumnarCatalog(path)
+    return DataFrameCatalog.from_csv(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the memory-mapped movie catalog from the CSV dataset.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="convert the CSV into a columnar catalog directory")
+    build.add_argument("--csv", default=CSV_PATH, help="CSV dataset to convert")
+    build.add_argument("--out", default=COLUMNAR_PATH, help="catalog directory to write")
+    memory = subparsers.add_parser("memory", help="print the memory used by each column of the catalog")
+    memory.add_argument("--catalog", default=DATASET_PATH, help="CSV dataset or columnar catalog directory")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_columnar(args.csv, args.out)
+        print(f"Catalog written to {args.out}")
+    else:
+        catalog = open_catalog(args.catalog)
+        for name in catalog.columns:
+            # the columnar catalog only decodes the text columns when asked to
+            catalog.column(name)
+        usage = catalog.memory_usage()
+        # a CSV is also measured as parsed, before being compacted
+        plain = {} if os.path.isdir(args.catalog) else {
+            name: int(values.memory_usage(index=False, deep=True)) for name, values in load_movies(args.catalog).items()
+        }
+        print(f"{'column':<16}{'MiB':>10}" + (f"{'parsed MiB':>12}" if plain else ""))
+        for name in sorted(set(usage) | set(plain), key=lambda name: -usage.get(name, 0)):
+            print(f"{name:<16}{usage.get(name, 0) / 2 ** 20:>10.2f}"
+                  + (f"{plain.get(name, 0) / 2 ** 20:>12.2f}" if plain else ""))
+        print(f"{'total':<16}{sum(usage.values()) / 2 ** 20:>10.2f}"
+              + (f"{sum(plain.values()) / 2 ** 20:>12.2f}" if plain else "") + f"  ({len(catalog)} movies)")
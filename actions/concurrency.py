@@ -0,0 +1,114 @@
+# Execution of the catalog work outside the action server's event loop.
+#
+# The rasa_sdk action server runs every action on a single asyncio event
+# loop, so a synchronous `run` doing pandas scans or fuzzy matching stalls
+# all the other conversations while it runs. Actions deriving from
+# CatalogAction implement `run_sync` instead: it is executed in a bounded
+# thread pool shared by all the actions, and each action class also has a
+# limit on how many of its calls can be in flight at once.
+#
+# An action listing its slots in `cached_slots` has its answers stored in
+# the response cache (see cache.py), keyed on the values of those slots:
+# a repeated question is answered from the cache, without using the pool.
+# The same key coalesces the identical calls running at the same time (see
+# singleflight.py): only the first one runs, the others share its answer.
+#
+#   MOVIEBOT_POOL_SIZE           threads in the pool (default: CPUs, at most 8)
+#   MOVIEBOT_ACTION_CONCURRENCY  in-flight calls per action (default: pool size)
+
+import asyncio
+import functools
+import os
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple
+
+from rasa_sdk import Action, Tracker
+from rasa_sdk.executor import CollectingDispatcher
+
+from .cache import Response, response_cache
+from .metrics import traced
+from .singleflight import single_flight
+
+
+POOL_SIZE = int(os.environ.get("MOVIEBOT_POOL_SIZE", min(8, os.cpu_count() or 1)))
+ACTION_CONCURRENCY = int(os.environ.get("MOVIEBOT_ACTION_CONCURRENCY", POOL_SIZE))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """The shared pool, created on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="moviebot-catalog")
+        return _executor
+
+
+async def run_in_pool(func: Callable, *args: Any) -> Any:
+    """Run `func(*args)` in the shared pool and wait for it without blocking the loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args))
+
+
+class CatalogAction(Action, ABC):
+    """An action whose body, `run_sync`, runs in the shared thread pool."""
+
+    # maximum number of calls of this action running at the same time
+    max_concurrency: int = ACTION_CONCURRENCY
+    # slots the answer depends on, if it can be cached (() for a constant answer)
+    cached_slots: Optional[Tuple[Text, ...]] = None
+
+    @abstractmethod
+    def run_sync(
+        self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]
+    ) -> List[Dict[Text, Any]]:
+        raise NotImplementedError
+
+    def _limit(self) -> asyncio.Semaphore:
+        # a semaphore belongs to an event loop, so keep one per loop
+        if not hasattr(self, "_semaphores"):
+            self._semaphores = weakref.WeakKeyDictionary()
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphores[loop]
+
+    async def _answer(self, tracker: Tracker, domain: Dict[Text, Any]) -> Response:
+        """(messages, events) of one call of `run_sync`."""
+        dispatcher = CollectingDispatcher()
+        async with self._limit():
+            events = await run_in_pool(traced, self.name(), self.run_sync, dispatcher, tracker, domain)
+        return dispatcher.messages, events
+
+    async def run(
+        self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]
+    ) -> List[Dict[Text, Any]]:
+        if self.cached_slots is None or not (response_cache.enabled or single_flight.enabled):
+            async with self._limit():
+                return await run_in_pool(traced, self.name(), self.run_sync, dispatcher, tracker, domain)
+
+        generation = response_cache.generation
+        key = response_cache.key(self.name(), [tracker.get_slot(slot) for slot in self.cached_slots])
+        cached = response_cache.get(key) if response_cache.enabled else None
+        if cached is not None:
+            messages, events = cached
+            dispatcher.messages.extend(messages)
+            return events
+
+        if single_flight.enabled:
+            # a call made before the catalog changed must not answer for the new one
+            (messages, events), shared = await single_flight.run(
+                (generation,) + key, lambda: self._answer(tracker, domain)
+            )
+        else:
+            (messages, events), shared = await self._answer(tracker, domain), False
+        if not shared:
+            response_cache.put(key, messages, events, generation)
+        # the calls sharing an answer each get their own copy
+        dispatcher.messages.extend(dict(message) for message in messages)
+        return [dict(event) for event in events]
@@ -0,0 +1,168 @@
+# Fuzzy matching of misspelled titles and names against the dataset.
+#
+# Candidates are deduplicated and preprocessed once, when the matcher is
+# built, and recent queries are kept in an LRU cache. Scoring uses rapidfuzz,
+# which scores the whole candidate array in C, when it is installed, and
+# falls back to fuzzywuzzy otherwise. Scores are WRatio 0-100 integers, as
+# `process.extractOne` returns, so `soglia_fuzzy` keeps its meaning; the two
+# libraries compute WRatio slightly differently, so a score may differ by a
+# few points between them.
+#
+# `extract_many` matches a list of queries at once: rapidfuzz scores them
+# against all the candidates in one matrix, on all the cores. On a single
+# core the queries are matched one by one instead, since extractOne stops
+# scoring a candidate as soon as it cannot beat the best one so far.
+#
+# The scoring libraries are only imported when first needed: a catalog
+# attached from a snapshot has its choices preprocessed already.
+
+import copy
+import os
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Sequence, Text, Tuple
+
+import numpy as np
+
+# scores computed at once by extract_many (8 bytes each)
+CDIST_CELLS = 1 << 24
+
+
+@lru_cache(maxsize=None)
+def _fuzz():
+    """(fuzzywuzzy.fuzz, fuzzywuzzy.utils, rapidfuzz.fuzz, rapidfuzz.process),
+    the last two None without rapidfuzz."""
+    from fuzzywuzzy import fuzz, utils
+
+    try:
+        from rapidfuzz import fuzz as rf_fuzz, process as rf_process
+    except ImportError:  # pragma: no cover - optional speedup
+        rf_fuzz = rf_process = None
+    return fuzz, utils, rf_fuzz, rf_process
+
+
+def _preprocess(text: Text) -> Text:
+    # same preprocessing fuzzywuzzy applies before WRatio in extractOne
+    return _fuzz()[1].full_process(text, force_ascii=True)
+
+
+class FuzzyMatcher:
+    """Best match for a query among a fixed list of candidate strings."""
+
+    def __init__(self, choices: Iterable[Text], cache_size: int = 1024):
+        self.cache_size = cache_size
+        self.choices = [choice for choice in dict.fromkeys(choices) if choice]
+        self.processed = [_preprocess(choice) for choice in self.choices]
+        self.extract_one = lru_cache(maxsize=cache_size)(self._extract_one)
+
+    def __getstate__(self):
+        # the cache is not pickled, see snapshot.py
+        state = dict(self.__dict__)
+        del state["extract_one"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.extract_one = lru_cache(maxsize=self.cache_size)(self._extract_one)
+
+    def patched(self, added: Iterable[Text] = (), removed: Iterable[Text] = ()) -> "FuzzyMatcher":
+        """New matcher without the `removed` choices and with the `added`
+        ones; only the added choices are preprocessed."""
+        added = [choice for choice in dict.fromkeys(added) if choice]
+        matcher = copy.copy(self)
+        matcher.choices, matcher.processed = list(self.choices), list(self.processed)
+        # the choices are distinct: each one is found by a scan of the list, in C
+        for choice in set(removed):
+            if choice in matcher.choices:
+                i = matcher.choices.index(choice)
+                del matcher.choices[i], matcher.processed[i]
+        for choice in added:
+            if choice not in matcher.choices:
+                matcher.choices.append(choice)
+                matcher.processed.append(_preprocess(choice))
+        matcher.extract_one = lru_cache(maxsize=self.cache_size)(matcher._extract_one)
+        return matcher
+
+    def _extract_one(self, query: Text) -> Tuple[Optional[Text], int]:
+        """Return `(best_choice, score)`, like `process.extractOne`;
+        `(None, 0)` if there are no choices."""
+        if not self.choices:
+            return None, 0
+
+        processed_query = _preprocess(query)
+        fuzz, _, rf_fuzz, rf_process = _fuzz()
+
+        if rf_process is not None:
+            _, score, index = rf_process.extractOne(
+                processed_query, self.processed, scorer=rf_fuzz.WRatio, processor=None
+            )
+            return self.choices[index], int(round(score))
+
+        best_index, best_score = 0, -1
+        for index, candidate in enumerate(self.processed):
+            score = fuzz.WRatio(processed_query, candidate, full_process=False)
+            if score > best_score:
+                best_index, best_score = index, score
+        return self.choices[best_index], best_score
+
+    def extract_many(self, queries: Sequence[Text]) -> Dict[Text, Tuple[Optional[Text], int]]:
+        """`extract_one(query)` of each of the `queries`, scored together."""
+        queries = list(dict.fromkeys(queries))
+        _, _, rf_fuzz, rf_process = _fuzz()
+        if rf_process is None or not self.choices or (os.cpu_count() or 1) < 2:
+            return {query: self._extract_one(query) for query in queries}
+
+        best: Dict[Text, Tuple[Optional[Text], int]] = {}
+        step = max(1, CDIST_CELLS // len(self.processed))
+        for start in range(0, len(queries), step):
+            chunk = queries[start:start + step]
+            scores = rf_process.cdist(
+                [_preprocess(query) for query in chunk], self.processed,
+                scorer=rf_fuzz.WRatio, processor=None, dtype=np.float64, workers=-1,
+            )
+            # first best choice, like extractOne
+            indexes = scores.argmax(axis=1)
+            for query, index, score in zip(chunk, indexes, scores[np.arange(len(chunk)), indexes]):
+                best[query] = self.choices[index], int(round(score))
+        return best
+
+    def cache_info(self):
+        return self.extract_one.cache_info()
+
+
+class PersonMatcher:
+    """Fuzzy matching of people, by full name or by surname only.
+
+    A query of more than one word is matched against the full names, a single
+    word against the surnames (last word of each name).
+    """
+
+    def __init__(self, names: Iterable[Text], cache_size: int = 1024):
+        names = [name for name in dict.fromkeys(names) if isinstance(name, str)]
+        self.full_names = FuzzyMatcher(names, cache_size)
+        self.surnames = FuzzyMatcher(
+            (name.split()[-1] for name in names if len(name.split()) > 1), cache_size
+        )
+
+    def patched(
+        self, added: Iterable[Text] = (), removed: Iterable[Text] = (), removed_surnames: Iterable[Text] = ()
+    ) -> "PersonMatcher":
+        """New matcher with the `added` people and without the `removed` ones
+        (and without the `removed_surnames`, that nobody left has)."""
+        added = [name for name in added if isinstance(name, str)]
+        matcher = copy.copy(self)
+        matcher.full_names = self.full_names.patched(added, removed)
+        matcher.surnames = self.surnames.patched(
+            (name.split()[-1] for name in added if len(name.split()) > 1), removed_surnames
+        )
+        return matcher
+
+    def extract_one(self, query: Text) -> Tuple[Optional[Text], int]:
+        if len(query.split()) > 1:
+            return self.full_names.extract_one(query)
+        return self.surnames.extract_one(query)
+
+    def extract_many(self, queries: Sequence[Text]) -> Dict[Text, Tuple[Optional[Text], int]]:
+        return {
+            **self.full_names.extract_many([query for query in queries if len(query.split()) > 1]),
+            **self.surnames.extract_many([query for query in queries if len(query.split()) <= 1]),
+        }
@@ -0,0 +1,301 @@
+# Gazetteer of the catalog: tags the titles, directors and actors it knows in
+# an utterance, for the NLU pipeline (see components/catalog_gazetteer.py).
+#
+# All the names are compiled into one Aho-Corasick automaton, so an
+# utterance is tagged in a single pass over its characters, however many
+# names the catalog has. Matches must start and end on word boundaries; of
+# overlapping ones the leftmost, then the longest, wins ("The Lion King"
+# rather than "King"). Case and accents are ignored. Titles made only of
+# common words ("Up", "Her", "It") are left to the entity classifier.
+#
+# The automaton is stored as flat arrays, in the layout of a CSR matrix:
+# the transitions of state s are the entries offsets[s]:offsets[s + 1] of
+# `labels` (code points, ascending) and `targets`. It is compiled once per
+# version of the dataset and of its change log (the movies added there are
+# tagged too) and saved next to the dataset, then memory-mapped:
+#
+#   python -m actions.gazetteer build
+#   python -m actions.gazetteer tag "who directed the lion king"
+#
+#   MOVIEBOT_GAZETTEER  directory of the compiled automaton (default: <dataset>.gazetteer)
+
+import argparse
+import bisect
+import json
+import os
+import unicodedata
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Text, Tuple
+
+import numpy as np
+
+from .catalog import DATASET_PATH, DataFrameCatalog, MovieCatalog, _replace, _save, open_catalog
+from .manager import STAR_COLUMNS, source_signature
+from .search import QUERY_STOPWORDS
+from .updates import changes_path, patch_catalog, read_changes
+
+# entity -> columns of its names
+ENTITY_COLUMNS: Dict[Text, List[Text]] = {
+    "movie": ["Series_Title"],
+    "director": ["Director"],
+    "actor": STAR_COLUMNS,
+}
+
+
+def gazetteer_path(dataset_path: Text = DATASET_PATH) -> Text:
+    """The automaton of a dataset: imdb_top_1000.csv -> imdb_top_1000.gazetteer"""
+    return os.environ.get("MOVIEBOT_GAZETTEER", os.path.splitext(dataset_path.rstrip(os.sep))[0] + ".gazetteer")
+
+
+@lru_cache(maxsize=4096)
+def _fold_char(ch: Text) -> Text:
+    base = unicodedata.normalize("NFKD", ch)[:1] or ch
+    folded = base.casefold()
+    return folded if len(folded) == 1 else base
+
+
+def fold(text: Text) -> Text:
+    """Casefold and strip accents one character at a time, so that the
+    positions in the result are those of `text`."""
+    return "".join(_fold_char(ch) for ch in text)
+
+
+def _is_name(folded: Text) -> bool:
+    words = folded.split()
+    return len(folded) > 1 and any(word not in QUERY_STOPWORDS for word in words)
+
+
+class Automaton:
+    """Aho-Corasick automaton over a fixed list of patterns."""
+
+    def __init__(self, offsets: np.ndarray, labels: np.ndarray, targets: np.ndarray, fail: np.ndarray,
+                 output: np.ndarray, next_output: np.ndarray, lengths: np.ndarray):
+        self.arrays = {"offsets": offsets, "labels": labels, "targets": targets, "fail": fail,
+                       "output": output, "next_output": next_output, "lengths": lengths}
+        # memoryviews: indexing them gives Python ints, much faster than NumPy scalars
+        self._offsets, self._labels, self._targets, self._fail, self._output, self._next_output, self._lengths = (
+            memoryview(np.ascontiguousarray(array)) for array in
+            (offsets, labels, targets, fail, output, next_output, lengths)
+        )
+
+    @classmethod
+    def build(cls, patterns: Sequence[Text]) -> "Automaton":
+        """The automaton of the (distinct, non-empty) `patterns`; a match
+        reports the position of its pattern in the list."""
+        children: Dict[Tuple[int, int], int] = {}
+        parents, codes, depths, terminal = [0], [0], [0], {}
+        for pattern_id, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                key = (state, ord(ch))
+                child = children.get(key)
+                if child is None:
+                    child = children[key] = len(parents)
+                    parents.append(state)
+                    codes.append(ord(ch))
+                    depths.append(depths[state] + 1)
+                state = child
+            terminal[state] = pattern_id
+
+        states = len(parents)
+        fail = np.zeros(states, dtype=np.int32)
+        output = np.full(states, -1, dtype=np.int32)
+        next_output = np.full(states, -1, dtype=np.int32)
+        for state, pattern_id in terminal.items():
+            output[state] = pattern_id
+        # breadth first: the failure state of a state is shallower than it
+        for state in np.argsort(np.asarray(depths), kind="stable")[1:].tolist():
+            parent, code = parents[state], codes[state]
+            if parent:
+                target = int(fail[parent])
+                while target and (target, code) not in children:
+                    target = int(fail[target])
+                fail[state] = children.get((target, code), 0)
+            link = int(fail[state])
+            next_output[state] = link if output[link] >= 0 else next_output[link]
+
+        edges = np.array(list(children), dtype=np.int64).reshape(-1, 2)
+        order = np.lexsort((edges[:, 1], edges[:, 0]))
+        offsets = np.zeros(states + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edges[:, 0], minlength=states), out=offsets[1:])
+        return cls(
+            offsets, edges[order, 1].astype(np.int32),
+            np.fromiter(children.values(), dtype=np.int32, count=len(children))[order],
+            fail, output, next_output, np.array([len(pattern) for pattern in patterns], dtype=np.int32),
+        )
+
+    def __len__(self) -> int:
+        return len(self._fail)
+
+    def _goto(self, state: int, code: int) -> int:
+        lo, hi = self._offsets[state], self._offsets[state + 1]
+        i = bisect.bisect_left(self._labels, code, lo, hi)
+        return self._targets[i] if i < hi and self._labels[i] == code else -1
+
+    def matches(self, text: Text) -> List[Tuple[int, int, int]]:
+        """(start, end, pattern) of every occurrence of a pattern in `text`."""
+        found = []
+        state = 0
+        for end, ch in enumerate(text, 1):
+            code = ord(ch)
+            target = self._goto(state, code)
+            while target < 0 and state:
+                state = self._fail[state]
+                target = self._goto(state, code)
+            state = max(target, 0)
+            hit = state if self._output[state] >= 0 else self._next_output[state]
+            while hit > 0:
+                pattern = self._output[hit]
+                found.append((end - self._lengths[pattern], end, pattern))
+                hit = self._next_output[hit]
+        return found
+
+    def memory_bytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays.values())
+
+
+class Gazetteer:
+    """The titles and people of a catalog, and the automaton finding them."""
+
+    VERSION = 1
+
+    def __init__(self, automaton: Automaton, values: List[Text], entities: List[List[Text]]):
+        self.automaton = automaton
+        # for each pattern: its name as in the catalog, and the entities it is a name of
+        self.values = values
+        self.entities = entities
+
+    @classmethod
+    def build(cls, catalog: MovieCatalog) -> "Gazetteer":
+        patterns: Dict[Text, int] = {}
+        values: List[Text] = []
+        entities: List[List[Text]] = []
+        for entity, columns in ENTITY_COLUMNS.items():
+            for column in columns:
+                for row, name in enumerate(catalog.column(column)):
+                    if not isinstance(name, str) or (catalog.deleted is not None and catalog.deleted[row]):
+                        continue
+                    name = " ".join(name.split())
+                    pattern = fold(name)
+                    if not _is_name(pattern):
+                        continue
+                    if pattern not in patterns:
+                        patterns[pattern] = len(values)
+                        values.append(name)
+                        entities.append([])
+                    if entity not in entities[patterns[pattern]]:
+                        entities[patterns[pattern]].append(entity)
+        return cls(Automaton.build(list(patterns)), values, entities)
+
+    def tag(self, text: Text, entities: Optional[Iterable[Text]] = None) -> List[Dict[Text, Any]]:
+        """The names found in `text`, as NLU entities: one per entity type
+        of each name, with its value as in the catalog."""
+        wanted = None if entities is None else set(entities)
+        folded = fold(text)
+        matches = [
+            (start, end, pattern) for start, end, pattern in self.automaton.matches(folded)
+            if (start == 0 or not folded[start - 1].isalnum()) and (end == len(folded) or not folded[end].isalnum())
+        ]
+        # leftmost, then longest, of the overlapping matches
+        matches.sort(key=lambda match: (match[0], match[0] - match[1]))
+        tagged = []
+        covered = 0
+        for start, end, pattern in matches:
+            if start < covered:
+                continue
+            types = [entity for entity in self.entities[pattern] if wanted is None or entity in wanted]
+            if not types:
+                continue
+            covered = end
+            for entity in types:
+                tagged.append({"entity": entity, "start": start, "end": end, "value": self.values[pattern]})
+        return tagged
+
+    def save(self, directory: Text, signature: Optional[Sequence[int]]) -> None:
+        os.makedirs(directory, exist_ok=True)
+        for name, array in self.automaton.arrays.items():
+            _save(os.path.join(directory, name + ".npy"), array)
+        names = {"values": self.values, "entities": self.entities}
+        _replace(os.path.join(directory, "names.json"), lambda f: f.write(json.dumps(names).encode("utf-8")))
+        meta = {
+            "version": self.VERSION, "names": len(self.values), "states": len(self.automaton),
+            "signature": list(signature) if signature is not None else None,
+        }
+        # written last: the automaton is only complete once its meta.json is
+        _replace(os.path.join(directory, "meta.json"), lambda f: f.write(json.dumps(meta, indent=2).encode("utf-8")))
+
+    @classmethod
+    def load(cls, directory: Text, signature: Optional[Sequence[int]] = None) -> Optional["Gazetteer"]:
+        """The gazetteer saved in `directory`, memory-mapped; None if there
+        is none or it was compiled from another version of the dataset."""
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != cls.VERSION or (signature is not None and meta.get("signature") != list(signature)):
+                return None
+            with open(os.path.join(directory, "names.json"), encoding="utf-8") as f:
+                names = json.load(f)
+            arrays = {
+                name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+                for name in ("offsets", "labels", "targets", "fail", "output", "next_output", "lengths")
+            }
+        except (OSError, ValueError):
+            return None
+        return cls(Automaton(**arrays), names["values"], names["entities"])
+
+
+def gazetteer_signature(dataset_path: Text = DATASET_PATH) -> Optional[Tuple[int, ...]]:
+    """The signature of a dataset and of its change log: the names change
+    with either."""
+    signature = source_signature(dataset_path)
+    if signature is None:
+        return None
+    return signature + (source_signature(changes_path(dataset_path)) or (0, 0))
+
+
+def open_names(dataset_path: Text = DATASET_PATH) -> MovieCatalog:
+    """The catalog of a dataset with the records of its change log applied,
+    as the action server sees it."""
+    catalog = open_catalog(dataset_path)
+    if isinstance(catalog, DataFrameCatalog):
+        records, _ = read_changes(changes_path(dataset_path))
+        catalog = patch_catalog(catalog, records)
+    return catalog
+
+
+def open_gazetteer(dataset_path: Text = DATASET_PATH, directory: Optional[Text] = None) -> Gazetteer:
+    """The gazetteer of the current version of a dataset and its change log:
+    the one saved in `directory` (default: next to the dataset) if it is up
+    to date, else compiled now and saved there."""
+    directory = directory or gazetteer_path(dataset_path)
+    signature = gazetteer_signature(dataset_path)
+    gazetteer = Gazetteer.load(directory, signature)
+    if gazetteer is None:
+        gazetteer = Gazetteer.build(open_names(dataset_path))
+        try:
+            gazetteer.save(directory, signature)
+        except OSError:
+            pass
+    return gazetteer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the gazetteer of the catalog or tag an utterance with it.")
+    parser.add_argument("--catalog", default=DATASET_PATH, help="dataset of the gazetteer")
+    parser.add_argument("--out", help="automaton directory (default: MOVIEBOT_GAZETTEER or <dataset>.gazetteer)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="compile the automaton and save it next to the dataset")
+    tag = subparsers.add_parser("tag", help="print the entities found in an utterance")
+    tag.add_argument("text")
+    args = parser.parse_args()
+    out = args.out or gazetteer_path(args.catalog)
+
+    if args.command == "build":
+        signature = gazetteer_signature(args.catalog)
+        gazetteer = Gazetteer.build(open_names(args.catalog))
+        gazetteer.save(out, signature)
+        print(f"Gazetteer of {len(gazetteer.values)} names ({len(gazetteer.automaton)} states, "
+              f"{gazetteer.automaton.memory_bytes() / 2 ** 20:.1f} MiB) written to {out}")
+    else:
+        for entity in open_gazetteer(args.catalog, out).tag(args.text):
+            print(json.dumps({**entity, "text": args.text[entity["start"]:entity["end"]]}, ensure_ascii=False))
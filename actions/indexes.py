@@ -0,0 +1,539 @@
+# Lookup structures built once from the movie dataset, so that the actions
+# don't have to scan the DataFrame on every message.
+#
+# When some rows of the catalog change, `patched` returns a new structure
+# with only those rows updated. The new structure shares everything it does
+# not modify with the old one, which its readers can keep using.
+
+import copy
+import unicodedata
+from bisect import bisect_left, insort
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Text, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def normalize(text: Text) -> Text:
+    """Casefold and strip accents, so that 'Amélie' and 'amelie' compare equal."""
+    decomposed = unicodedata.normalize("NFKD", str(text).casefold())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def _shared(strings: Dict[Text, Text], text: Text) -> Text:
+    """The string equal to `text` in `strings`, added if there is none."""
+    return strings.setdefault(text, text)
+
+
+class _Overlay(Mapping):
+    """A dict seen through the `changes` (None for a removed key) made to a
+    shared `base`, so that `patched` doesn't copy a whole dict for a few
+    keys."""
+
+    def __init__(self, base: Mapping, changes: Dict):
+        self.base, self.changes = base, changes
+        self._len = len(base)
+        for key, value in changes.items():
+            self._len += (value is not None) - (key in base)
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self.changes[key] if key in self.changes else self.base.get(key)
+        return default if value is None else value
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def __iter__(self) -> Iterator:
+        for key in self.base:
+            if key not in self.changes:
+                yield key
+        for key, value in self.changes.items():
+            if value is not None:
+                yield key
+
+    def __len__(self) -> int:
+        return self._len
+
+
+def _layered(mapping: Mapping, changes: Dict) -> Mapping:
+    """`mapping` with `changes` (None for a removed key) applied.
+
+    The changes of successive patches pile up over the same base, which is
+    copied into a new plain dict once they reach a tenth of its size: each
+    change costs a constant amount of copying over time.
+    """
+    if isinstance(mapping, _Overlay):
+        mapping, changes = mapping.base, {**mapping.changes, **changes}
+    if len(changes) * 10 < len(mapping):
+        return _Overlay(mapping, changes)
+    merged = dict(mapping)
+    for key, value in changes.items():
+        if value is None:
+            merged.pop(key, None)
+        else:
+            merged[key] = value
+    return merged
+
+
+class _Patch:
+    """The changes `patched` makes to a dict shared with the old structure."""
+
+    def __init__(self, base: Mapping):
+        self.base = base
+        self.changes: Dict = {}
+
+    def get(self, key, default=None):
+        value = self.changes[key] if key in self.changes else self.base.get(key)
+        return default if value is None else value
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def __setitem__(self, key, value) -> None:
+        self.changes[key] = value
+
+    def __delitem__(self, key) -> None:
+        self.changes[key] = None
+
+    def result(self) -> Mapping:
+        return _layered(self.base, self.changes)
+
+
+class _Postings(_Patch):
+    """The changes `patched` makes to a {key: sorted row list} dict."""
+
+    def __init__(self, lists: Mapping):
+        super().__init__(lists)
+        self._owned: Set = set()
+
+    def _own(self, key) -> List[int]:
+        if key not in self._owned:
+            self.changes[key] = list(self.get(key, ()))
+            self._owned.add(key)
+        return self.changes[key]
+
+    def add(self, key, row: int) -> None:
+        postings = self._own(key)
+        i = bisect_left(postings, row)
+        if i == len(postings) or postings[i] != row:
+            postings.insert(i, row)
+
+    def remove(self, key, row: int) -> None:
+        if key not in self:
+            return
+        postings = self._own(key)
+        i = bisect_left(postings, row)
+        if i < len(postings) and postings[i] == row:
+            del postings[i]
+        if not postings:
+            del self[key]
+            self._owned.discard(key)
+
+
+class TitleIndex:
+    """Exact and substring search over the movie titles.
+
+    Row ids are positions in the dataset, returned in dataset order, so
+    `catalog.take(ids)` gives the same rows as the old
+    `str.contains(query, case=False)` mask.
+    """
+
+    def __init__(self, titles: Iterable[Text], ngram: int = 3):
+        self.ngram = ngram
+        self.titles = list(titles)
+        self.normalized = [normalize(title) for title in self.titles]
+
+        self.exact: Dict[Text, List[int]] = defaultdict(list)
+        grams: Dict[Text, List[int]] = defaultdict(list)
+        for row, title in enumerate(self.normalized):
+            self.exact[title].append(row)
+            for gram in self._grams(title):
+                # rows are visited in order, so each posting list stays sorted
+                postings = grams[gram]
+                if not postings or postings[-1] != row:
+                    postings.append(row)
+        self.exact = dict(self.exact)
+        self.grams = dict(grams)
+
+    def _grams(self, text: Text) -> List[Text]:
+        return [text[i:i + self.ngram] for i in range(len(text) - self.ngram + 1)]
+
+    def lookup(self, query: Text) -> List[int]:
+        """Rows whose title is exactly `query` (after normalization)."""
+        return list(self.exact.get(normalize(query), []))
+
+    def patched(self, changes: Dict[int, Optional[Text]]) -> "TitleIndex":
+        """New index where each row of `changes` has the given title (None
+        for a deleted row); rows past the end are appended."""
+        index = copy.copy(self)
+        index.titles = list(self.titles)
+        index.normalized = list(self.normalized)
+        exact, grams = _Postings(self.exact), _Postings(self.grams)
+
+        size = max(changes, default=-1) + 1
+        index.titles.extend([None] * (size - len(index.titles)))
+        index.normalized.extend([""] * (size - len(index.normalized)))
+        for row, title in changes.items():
+            old = index.normalized[row]
+            if index.titles[row] is not None:
+                exact.remove(old, row)
+                for gram in set(self._grams(old)):
+                    grams.remove(gram, row)
+            new = normalize(title) if title is not None else ""
+            index.titles[row], index.normalized[row] = title, new
+            if title is not None:
+                exact.add(new, row)
+                for gram in set(self._grams(new)):
+                    grams.add(gram, row)
+
+        index.exact, index.grams = exact.result(), grams.result()
+        return index
+
+    def search(self, query: Text) -> List[int]:
+        """Rows whose title contains `query` (after normalization)."""
+        return self._search(normalize(query))
+
+    def search_many(self, queries: Iterable[Text]) -> Dict[Text, List[int]]:
+        """`search` of each of the `queries`: the ones normalized to the same
+        text are searched once, and those too short for the n-grams are all
+        matched in one scan of the titles."""
+        needles = {query: normalize(query) for query in queries}
+        found: Dict[Text, List[int]] = {needle: [] for needle in needles.values() if 0 < len(needle) < self.ngram}
+        if found:
+            for row, title in enumerate(self.normalized):
+                for needle, rows in found.items():
+                    if needle in title:
+                        rows.append(row)
+        for needle in needles.values():
+            if needle not in found:
+                found[needle] = self._search(needle)
+        return {query: list(found[needle]) for query, needle in needles.items()}
+
+    def _search(self, needle: Text) -> List[int]:
+        if not needle:
+            # deleted rows have no title
+            return [row for row, title in enumerate(self.titles) if title is not None]
+
+        if len(needle) < self.ngram:
+            candidates: Iterable[int] = range(len(self.normalized))
+        else:
+            # the rarest n-gram of the query bounds the candidate rows, the
+            # substring check below takes care of the rest
+            candidates = []
+            for gram in set(self._grams(needle)):
+                postings = self.grams.get(gram)
+                if postings is None:
+                    return []
+                if not candidates or len(postings) < len(candidates):
+                    candidates = postings
+
+        return [row for row in candidates if needle in self.normalized[row]]
+
+
+class PersonIndex:
+    """Inverted index from people (directors or stars) to their movies.
+
+    Built from one or more name columns of the dataset. Full names and
+    surnames are normalized, so lookups and the "same surname"
+    disambiguation are dictionary hits instead of DataFrame scans.
+    """
+
+    def __init__(self, *columns: Iterable[Text]):
+        self.row_people: List[Tuple[Text, ...]] = []
+        self.rows: Dict[Text, List[int]] = defaultdict(list)
+        self.by_surname: Dict[Text, List[Text]] = defaultdict(list)
+        self.surname_of: Dict[Text, Text] = {}
+
+        # one string per distinct key, shared by all the structures below
+        keys: Dict[Text, Text] = {}
+        key_of: Dict[Text, Text] = {}
+        for row, names in enumerate(zip(*columns)):
+            people = tuple(name for name in dict.fromkeys(names) if isinstance(name, str) and name)
+            self.row_people.append(people)
+            for name in people:
+                key = key_of.get(name)
+                if key is None:
+                    key = key_of[name] = _shared(keys, normalize(name))
+                    surname = _shared(keys, normalize(name.split()[-1]))
+                    self.surname_of[name] = surname
+                    self.by_surname[surname].append(name)
+                self.rows[key].append(row)
+
+        self.rows = dict(self.rows)
+        self.by_surname = dict(self.by_surname)
+        self.names = list(self.surname_of)
+        self.normalized_names = [key_of[name] for name in self.names]
+
+    def rows_of(self, name: Text) -> List[int]:
+        """Rows featuring exactly this person."""
+        return list(self.rows.get(normalize(name), []))
+
+    def search(self, query: Text) -> List[int]:
+        """Rows featuring the person named by `query`.
+
+        `query` can be a full name or a surname; anything else falls back to
+        a substring match over the distinct names (not over the rows).
+        """
+        key = normalize(query).strip()
+        if not key:
+            return []
+        if key in self.rows:
+            return list(self.rows[key])
+        if key in self.by_surname:
+            return self._rows_of_all(normalize(name) for name in self.by_surname[key])
+        return self._rows_of_all(name for name in self.normalized_names if key in name)
+
+    def search_many(self, queries: Iterable[Text]) -> Dict[Text, List[int]]:
+        """`search` of each of the `queries`: full names and surnames are
+        dictionary hits, the other keys are all matched in one scan of the
+        names."""
+        keys = {query: normalize(query).strip() for query in queries}
+        partial: Dict[Text, List[Text]] = {
+            key: [] for key in keys.values() if key and key not in self.rows and key not in self.by_surname
+        }
+        if partial:
+            for name in self.normalized_names:
+                for key, names in partial.items():
+                    if key in name:
+                        names.append(name)
+        found: Dict[Text, List[int]] = {key: self._rows_of_all(names) for key, names in partial.items()}
+        for key in keys.values():
+            if key not in found:
+                found[key] = self.search(key) if key else []
+        return {query: list(found[key]) for query, key in keys.items()}
+
+    def _rows_of_all(self, keys: Iterable[Text]) -> List[int]:
+        rows: Set[int] = set()
+        for key in keys:
+            rows.update(self.rows[key])
+        return sorted(rows)
+
+    def patched(self, changes: Dict[int, Sequence[Text]]) -> "PersonIndex":
+        """New index where each row of `changes` features the given people
+        (none for a deleted row); rows past the end are appended."""
+        index = copy.copy(self)
+        index.row_people = list(self.row_people)
+        surname_of, rows, by_surname = _Patch(self.surname_of), _Postings(self.rows), _Patch(self.by_surname)
+
+        size = max(changes, default=-1) + 1
+        index.row_people.extend([()] * (size - len(index.row_people)))
+        added: List[Text] = []
+        dropped: Set[Text] = set()
+        for row, names in changes.items():
+            old = index.row_people[row]
+            new = tuple(name for name in dict.fromkeys(names) if isinstance(name, str) and name)
+            index.row_people[row] = new
+            for name in old:
+                if name not in new:
+                    rows.remove(normalize(name), row)
+                    dropped.add(name)
+            for name in new:
+                if name not in old:
+                    rows.add(normalize(name), row)
+                    if name not in surname_of:
+                        surname = normalize(name.split()[-1])
+                        surname_of[name] = surname
+                        by_surname[surname] = by_surname.get(surname, []) + [name]
+                        added.append(name)
+
+        # people who are not in any row any more
+        gone = {
+            name for name in dropped
+            if not any(name in index.row_people[row] for row in rows.get(normalize(name), ()))
+        }
+        for name in gone:
+            surname = surname_of.get(name)
+            del surname_of[name]
+            by_surname[surname] = [other for other in by_surname.get(surname) if other != name]
+            if not by_surname.get(surname):
+                del by_surname[surname]
+
+        index.rows, index.by_surname, index.surname_of = rows.result(), by_surname.result(), surname_of.result()
+        index.names, index.normalized_names = list(self.names), list(self.normalized_names)
+        for name in gone:
+            i = index.names.index(name)
+            del index.names[i], index.normalized_names[i]
+        index.names += added
+        index.normalized_names += [normalize(name) for name in added]
+        return index
+
+    def people(self, rows: Iterable[int]) -> List[Text]:
+        """Distinct people appearing in `rows`, in dataset order."""
+        seen: Dict[Text, None] = {}
+        for row in rows:
+            for name in self.row_people[row]:
+                seen.setdefault(name)
+        return list(seen)
+
+    def with_surname(self, names: Iterable[Text], query: Text) -> List[Text]:
+        """The `names` sharing the surname (last word) of `query`."""
+        words = query.split()
+        if not words:
+            return []
+        surname = normalize(words[-1])
+        return [name for name in names if self.surname_of.get(name) == surname]
+
+
+class RankIndex:
+    """Rows pre-sorted by each ranking column, best (highest) first.
+
+    Ties keep dataset order and missing values come last. `top` returns the
+    best rows of any subset by partitioning on the precomputed ranks, so
+    nothing is re-sorted per request. The sorted values also serve the
+    threshold queries: the rows with `column >= value` are a prefix of the
+    order, found by binary search (`at_least`).
+    """
+
+    COLUMNS = ("IMDB_Rating", "No_of_Votes", "Gross", "Released_Year")
+    # position of the rows that are not ranked (deleted)
+    ABSENT = np.iinfo(np.int64).max
+
+    def __init__(self, catalog, columns: Sequence[Text] = COLUMNS):
+        self.order: Dict[Text, np.ndarray] = {}
+        self.position: Dict[Text, np.ndarray] = {}
+        # _key of the values, in `order` (so ascending)
+        self.keys: Dict[Text, np.ndarray] = {}
+        for column in columns:
+            values = pd.Series(catalog.column(column))
+            order = values.sort_values(ascending=False, kind="stable", na_position="last").index.to_numpy()
+            position = np.empty(len(order), dtype=np.int64)
+            position[order] = np.arange(len(order))
+            self.order[column] = order
+            self.position[column] = position
+            self.keys[column] = self._key(values.to_numpy()[order])
+
+    @staticmethod
+    def _key(values: np.ndarray) -> np.ndarray:
+        # ascending key of the descending order, missing values last
+        key = -np.asarray(values, dtype=float)
+        return np.where(np.isnan(key), np.inf, key)
+
+    def patched(self, catalog, changed: Iterable[int], deleted: Iterable[int] = ()) -> "RankIndex":
+        """New index for `catalog`, whose `changed` rows (updated or new)
+        and `deleted` rows are the only ones that differ from the indexed
+        catalog. The stale rows are found from their positions, the other
+        rows keep their relative order and the changed ones are merged in
+        with binary searches."""
+        index = copy.copy(self)
+        index.order, index.position, index.keys = dict(self.order), dict(self.position), dict(self.keys)
+        stale = np.union1d(np.asarray(list(changed), dtype=np.int64), np.asarray(list(deleted), dtype=np.int64))
+        fresh = np.setdiff1d(np.asarray(list(changed), dtype=np.int64), np.asarray(list(deleted), dtype=np.int64))
+
+        for column, order in self.order.items():
+            old_position = self.position[column]
+            gone = old_position[stale[stale < len(old_position)]]
+            gone = gone[gone < len(order)]
+            keep = np.ones(len(order), dtype=bool)
+            keep[gone] = False
+            kept, kept_key = order[keep], self.keys[column][keep]
+            fresh_key = self._key(catalog.column(column)[fresh])
+            ordered = np.lexsort((fresh, fresh_key))
+            rows, keys = fresh[ordered], fresh_key[ordered]
+            # among equal values rows stay in dataset order
+            lo = np.searchsorted(kept_key, keys, side="left")
+            hi = np.searchsorted(kept_key, keys, side="right")
+            at = np.array(
+                [a + np.searchsorted(kept[a:b], row) for a, b, row in zip(lo, hi, rows)], dtype=np.int64
+            )
+            order = np.insert(kept, at, rows)
+            # only the positions after the first removed or inserted row move
+            position = np.full(len(catalog), self.ABSENT, dtype=np.int64)
+            position[:len(old_position)] = old_position
+            position[stale] = self.ABSENT
+            first = int(min(gone.min(initial=len(order)), at.min(initial=len(order))))
+            position[order[first:]] = np.arange(first, len(order))
+            index.order[column], index.position[column] = order, position
+            index.keys[column] = np.insert(kept_key, at, keys)
+        return index
+
+    def count_at_least(self, column: Text, value: float, strict: bool = False) -> int:
+        """Number of rows whose `column` is at least `value` (above it if
+        `strict`); they are the first ones of `top(column)`."""
+        return int(np.searchsorted(self.keys[column], -float(value), side="left" if strict else "right"))
+
+    def at_least(self, column: Text, value: float, rows=None, strict: bool = False) -> np.ndarray:
+        """The rows whose `column` is at least `value` (above it if
+        `strict`), best first; missing values never are.
+
+        With `rows`, only those of `rows` (in their order): each one is
+        checked against the position of the threshold, not its value.
+        """
+        count = self.count_at_least(column, value, strict)
+        if rows is None:
+            return self.order[column][:count]
+        rows = np.asarray(rows, dtype=np.int64)
+        return rows[self.position[column][rows] < count]
+
+    def top(self, column: Text, k: Optional[int] = None, rows=None) -> np.ndarray:
+        """The `k` best rows by `column` (all of them if `k` is None).
+
+        `rows` restricts the ranking to a subset, given as row ids or as a
+        boolean mask over the dataset.
+        """
+        if rows is None:
+            return self.order[column][:k]
+
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        rows = rows.astype(np.int64, copy=False)
+
+        positions = self.position[column][rows]
+        if k is not None and k < len(rows):
+            best = np.argpartition(positions, k)[:k]
+            rows, positions = rows[best], positions[best]
+        return rows[np.argsort(positions)]
+
+
+class GenreIndex:
+    """Rows of each genre, from the bits of the Genre_Mask column."""
+
+    def __init__(self, masks: Sequence[int]):
+        masks = np.asarray(masks, dtype=np.int64)
+        bits = int(masks.max()).bit_length() if len(masks) else 0
+        self.rows: List[np.ndarray] = [np.flatnonzero(masks & (1 << bit)) for bit in range(bits)]
+
+    def _rows_of(self, bit: int) -> np.ndarray:
+        return self.rows[bit] if bit < len(self.rows) else np.zeros(0, dtype=np.int64)
+
+    def candidates(self, mask: int, match_all: bool = True) -> np.ndarray:
+        """Ascending rows that may have all (`match_all`) or any of the
+        genres of `mask`: the rows of its rarest genre, or of all its genres."""
+        postings = [self._rows_of(bit) for bit in range(mask.bit_length()) if mask >> bit & 1]
+        if not postings:
+            return np.zeros(0, dtype=np.int64)
+        if match_all:
+            return min(postings, key=len)
+        return np.unique(np.concatenate(postings))
+
+    def patched(self, catalog, changed: Iterable[int], deleted: Iterable[int] = ()) -> "GenreIndex":
+        """New index for `catalog`, whose `changed` and `deleted` rows are
+        the only ones that differ from the indexed catalog."""
+        changed = np.asarray(list(changed), dtype=np.int64)
+        deleted = np.asarray(list(deleted), dtype=np.int64)
+        stale = np.union1d(changed, deleted)
+        fresh = np.setdiff1d(changed, deleted)
+        masks = np.asarray(catalog.column("Genre_Mask"), dtype=np.int64)[fresh]
+        bits = max(len(self.rows), int(masks.max()).bit_length() if len(masks) else 0)
+
+        index = copy.copy(self)
+        index.rows = []
+        for bit in range(bits):
+            rows = self._rows_of(bit)
+            # the rows are ascending: the stale ones are found by binary search
+            at = np.searchsorted(rows, stale)
+            found = at[rows[np.minimum(at, len(rows) - 1)] == stale] if len(rows) else at[:0]
+            added = fresh[(masks >> bit & 1).astype(bool)]
+            if len(found):
+                rows = np.delete(rows, found)
+            if len(added):
+                rows = np.insert(rows, np.searchsorted(rows, added), added)
+            index.rows.append(rows)
+        return index
@@ -0,0 +1,310 @@
+# Hot reload of the movie catalog.
+#
+# Everything the actions read (the catalog, its indexes and the fuzzy
+# matchers) is built together into a CatalogGeneration. The CatalogManager
+# holds the current generation and a background thread that watches the
+# data source (the CSV file, or the meta.json of a columnar catalog): when
+# it has changed and then stayed the same for one check, a new generation
+# is built next to the current one and then published with a single
+# assignment. An action reads `manager.current` once at its start and uses
+# that generation until it returns, so it never mixes the data of two
+# generations, and the old one is freed when its last reader is done. A
+# build that fails leaves the current generation in use. A thread can also
+# pin a generation of its own with `manager.pinned(...)`, which the batch
+# evaluation (see batch.py) uses to run the actions on it.
+#
+# A full build is replaced by attaching to the snapshot of the source (see
+# snapshot.py) when there is one built from the current version.
+#
+# The watcher also follows the change log of the dataset (see updates.py):
+# new records are applied to the current generation, patching only the rows
+# they touch, and the result is published the same way.
+#
+#   MOVIEBOT_RELOAD_INTERVAL  seconds between two checks of the source (0: never)
+
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Text, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .catalog import DATASET_PATH, MovieCatalog, open_catalog
+from .fuzzy_matcher import FuzzyMatcher, PersonMatcher
+from .indexes import GenreIndex, PersonIndex, RankIndex, TitleIndex
+from .search import FullTextSearch
+from .similarity import SimilarMovies, similar_path
+from .aggregates import AggregateCube
+from .snapshot import load_snapshot, snapshot_path
+from .updates import apply_changes, changes_path, read_changes
+
+logger = logging.getLogger(__name__)
+
+RELOAD_INTERVAL = float(os.environ.get("MOVIEBOT_RELOAD_INTERVAL", "10"))
+
+STAR_COLUMNS = ["Star1", "Star2", "Star3", "Star4"]
+
+
+def _rss_bytes() -> int:
+    """Resident memory of the process (0 if unknown)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # peak, not current, memory; in KiB on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _file_id(path: Text) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+def source_signature(path: Text) -> Optional[Tuple[int, int]]:
+    """(mtime, size) of the file that changes when the source is rewritten."""
+    if os.path.isdir(path):
+        path = os.path.join(path, "meta.json")
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class CatalogGeneration:
+    """A catalog with all the structures built from it."""
+
+    def __init__(self, catalog: MovieCatalog, number: int = 0, source: Optional[Text] = None):
+        self.number = number
+        self.source = source
+        self.catalog = catalog
+
+        stars = [catalog.column(column) for column in STAR_COLUMNS]
+        self.title_index = TitleIndex(catalog.column("Series_Title"))
+        self.director_index = PersonIndex(catalog.column("Director"))
+        self.actor_index = PersonIndex(*stars)
+        self.rank_index = RankIndex(catalog)
+        self.genre_index = GenreIndex(catalog.column("Genre_Mask"))
+        self.title_matcher = FuzzyMatcher(pd.unique(catalog.column("Series_Title")))
+        self.director_matcher = PersonMatcher(pd.unique(catalog.column("Director")))
+        self.actor_matcher = PersonMatcher(np.concatenate(stars))
+        self.text_search = FullTextSearch.build(catalog)
+        self.aggregates = AggregateCube.build(
+            catalog, {"director": self.director_index.rows, "actor": self.actor_index.rows}
+        )
+
+        # built on first use, see `similar`; the manager builds it with the generation
+        self._similar: Optional[SimilarMovies] = None
+        self._similar_lock = threading.Lock()
+
+        self.build_seconds = 0.0
+        self.memory_bytes = 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_similar_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._similar_lock = threading.Lock()
+
+    @property
+    def similar(self) -> SimilarMovies:
+        """The index of similar movies: the one saved next to the source
+        if it matches the catalog, else built now."""
+        if self._similar is None:
+            with self._similar_lock:
+                if self._similar is None:
+                    self._similar = SimilarMovies.open(self.catalog, similar_path(self.source) if self.source else None)
+        return self._similar
+
+    def stats(self) -> Dict[Text, Any]:
+        return {
+            "generation": self.number,
+            "source": self.source,
+            "movies": len(self.catalog),
+            "build_s": self.build_seconds,
+            "memory_mib": self.memory_bytes / 2 ** 20,
+        }
+
+
+class CatalogManager:
+    """Owner of the current CatalogGeneration; reloads it when the source
+    changes and applies the changes appended to its change log."""
+
+    def __init__(self, path: Text = DATASET_PATH, interval: float = RELOAD_INTERVAL, changes: Optional[Text] = None,
+                 snapshot: Optional[Text] = None):
+        self.path = path
+        self.changes = changes or changes_path(path)
+        self.snapshot = snapshot or snapshot_path(path)
+        self.interval = interval
+        self.history: List[Dict[Text, Any]] = []
+        self._listeners: List[Callable[[CatalogGeneration], None]] = []
+        self._reload_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self._watcher_pid: Optional[int] = None
+        # change log read so far: (device, inode) and offset of the next record
+        self._log_id: Optional[Tuple[int, int]] = None
+        self._log_offset = 0
+        # offset of the records that could not be applied, logged once
+        self._failed_offset: Optional[int] = None
+        self._pinned = threading.local()
+
+        self._signature = source_signature(path)
+        self._current = self._build(0)
+
+    @property
+    def current(self) -> CatalogGeneration:
+        """The generation to use for a whole request."""
+        pinned = getattr(self._pinned, "generation", None)
+        if pinned is not None:
+            return pinned
+        if self._watcher_pid != os.getpid():
+            # started on first use, so that it runs in each forked worker
+            self.start()
+        return self._current
+
+    @contextlib.contextmanager
+    def pinned(self, generation: CatalogGeneration) -> Iterator[CatalogGeneration]:
+        """Make `current` return `generation` in this thread until the end of the block."""
+        previous = getattr(self._pinned, "generation", None)
+        self._pinned.generation = generation
+        try:
+            yield generation
+        finally:
+            self._pinned.generation = previous
+
+    def on_swap(self, listener: Callable[[CatalogGeneration], None]) -> None:
+        """Call `listener(new_generation)` after every reload or update."""
+        self._listeners.append(listener)
+
+    def _report(self, generation: CatalogGeneration, kind: Text, start: float, rss: int) -> CatalogGeneration:
+        generation.build_seconds = time.perf_counter() - start
+        generation.memory_bytes = max(0, _rss_bytes() - rss)
+        self.history.append({**generation.stats(), "kind": kind})
+        logger.info(
+            f"Catalog generation {generation.number} ({kind}): {len(generation.catalog)} movies from {self.path}, "
+            f"built in {generation.build_seconds:.2f}s, +{generation.memory_bytes / 2 ** 20:.1f} MiB"
+        )
+        return generation
+
+    def _build(self, number: int) -> CatalogGeneration:
+        rss, start = _rss_bytes(), time.perf_counter()
+        generation = load_snapshot(self.snapshot, source_signature(self.path))
+        if generation is not None:
+            generation.number, generation.source = number, self.path
+            self._report(generation, "snapshot", start, rss)
+        else:
+            generation = CatalogGeneration(open_catalog(self.path), number, self.path)
+            # now rather than on the first request, which would wait for it
+            generation.similar
+            self._report(generation, "full", start, rss)
+        # the dataset doesn't include the logged changes yet
+        self._log_id, self._log_offset = _file_id(self.changes), 0
+        return self._follow(generation) or generation
+
+    def _follow(self, generation: CatalogGeneration) -> Optional[CatalogGeneration]:
+        """`generation` with the records logged since the last read applied,
+        or None if there are none."""
+        records, offset = read_changes(self.changes, self._log_offset)
+        if not records:
+            self._log_offset = offset
+            return None
+        rss, start = _rss_bytes(), time.perf_counter()
+        try:
+            patched = apply_changes(generation, records)
+        except Exception:
+            # the offset stays before the records, to retry them on the next update
+            if self._failed_offset != self._log_offset:
+                logger.exception(f"Could not apply {len(records)} changes from {self.changes}, will retry")
+            self._failed_offset = self._log_offset
+            return None
+        self._log_offset, self._failed_offset = offset, None
+        if patched is None:
+            return None
+        patched.number = generation.number + 1
+        return self._report(patched, f"{len(records)} changes", start, rss)
+
+    def _publish(self, generation: CatalogGeneration) -> None:
+        self._current = generation
+        for listener in self._listeners:
+            listener(generation)
+
+    def reload(self, force: bool = False) -> bool:
+        """Build and publish a new generation if the source changed (or if
+        `force`). Returns whether the current generation was replaced."""
+        with self._reload_lock:
+            return self._reload(force)
+
+    def _reload(self, force: bool) -> bool:
+        signature = source_signature(self.path)
+        if signature is None or (signature == self._signature and not force):
+            return False
+        # remembered even if the build fails, so a broken file is not retried in a loop
+        self._signature = signature
+        try:
+            generation = self._build(self._current.number + 1)
+        except Exception:
+            logger.exception(f"Reload of the catalog from {self.path} failed, keeping generation "
+                             f"{self._current.number}")
+            return False
+        self._publish(generation)
+        return True
+
+    def update(self) -> bool:
+        """Apply the records appended to the change log since the last call.
+        Returns whether the current generation was replaced."""
+        with self._reload_lock:
+            log_id = _file_id(self.changes)
+            if self._log_id is None and log_id is not None:
+                self._log_id, self._log_offset = log_id, 0
+            elif log_id != self._log_id or (log_id is not None and os.path.getsize(self.changes) < self._log_offset):
+                # the log was replaced, e.g. compacted into the dataset: start over
+                return self._reload(force=True)
+            generation = self._follow(self._current)
+            if generation is None:
+                return False
+            self._publish(generation)
+            return True
+
+    def _watch(self) -> None:
+        pending = self._signature
+        while not self._stop.wait(self.interval):
+            signature = source_signature(self.path)
+            # only reload once the source stopped changing, not while it is being written
+            if signature != self._signature and signature == pending:
+                self.reload()
+            pending = signature
+            try:
+                self.update()
+            except OSError:
+                logger.exception(f"Could not read the change log {self.changes}")
+
+    def start(self) -> None:
+        """Start watching the source, in this process."""
+        with self._start_lock:
+            self._watcher_pid = os.getpid()
+            if self.interval <= 0 or (self._watcher is not None and self._watcher.is_alive()):
+                return
+            self._stop.clear()
+            self._watcher = threading.Thread(target=self._watch, name="moviebot-catalog-watcher", daemon=True)
+            self._watcher.start()
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -0,0 +1,342 @@
+# Latency instrumentation of the actions, exposed in the Prometheus format.
+#
+# Every action registered with `instrument_actions` records its wall time,
+# the number of messages it sent and its errors. Actions running in the
+# catalog pool (see concurrency.py) also record where the time went: the
+# code calls `lap(phase)` at the end of each phase (slot_read, exact_lookup,
+# fuzzy_fallback, filtering, sorting, vector_search, text_search), which
+# charges the time since the previous lap to that phase; what follows the
+# last lap is rendering. It also calls `count_fuzzy` each time the exact
+# lookup failed and fuzzy matching was tried. The response cache and the
+# coalescing of identical lookups (see singleflight.py) report how much
+# work they saved.
+#
+# When MOVIEBOT_METRICS_PORT is set (it is 0, off, by default), the
+# metrics are served in the Prometheus text format on
+# http://127.0.0.1:MOVIEBOT_METRICS_PORT/metrics, together with a sampling
+# profiler that can be switched on while the server runs:
+#
+#   MOVIEBOT_METRICS_PORT=9105 rasa run actions
+#   curl localhost:9105/metrics
+#   curl "localhost:9105/debug/profile?seconds=10&hz=100" > stacks.txt   # collapsed stacks, for flamegraph.pl
+#
+# With the pre-fork server, worker N serves its own metrics on port + N.
+
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Text, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from .cache import response_cache
+from .singleflight import single_flight
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST = os.environ.get("MOVIEBOT_METRICS_HOST", "127.0.0.1")
+# 0: no endpoint, so that scripts and tests running the actions don't take a port
+METRICS_PORT = int(os.environ.get("MOVIEBOT_METRICS_PORT", "0"))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MESSAGE_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value: Any) -> Text:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[Text], values: Sequence[Any], extra: Sequence[Tuple[Text, Any]] = ()) -> Text:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: Text, help: Text, labels: Sequence[Text] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[Text, Any]) -> Tuple:
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self) -> Iterable[Text]:
+        raise NotImplementedError
+
+    def render(self) -> Text:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: Text, help: Text, labels: Sequence[Text] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Text]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(self.labels, key)} {value:g}"
+
+
+class Reading(Metric):
+    """A counter or gauge kept elsewhere, read by `read()` when the metrics
+    are rendered."""
+
+    def __init__(self, name: Text, help: Text, read: Callable[[], float], kind: Text = "gauge"):
+        super().__init__(name, help)
+        self.read = read
+        self.kind = kind
+
+    def samples(self) -> Iterable[Text]:
+        yield f"{self.name} {self.read():g}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: Text, help: Text, labels: Sequence[Text] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: [count per bucket..., count in +Inf], sum
+        self._series: Dict[Tuple, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            counts, total = self._series.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def samples(self) -> Iterable[Text]:
+        with self._lock:
+            series = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._series.items())
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket{_labels(self.labels, key, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {total:g}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {cumulative}"
+
+
+REGISTRY: List[Metric] = []
+
+ACTION_SECONDS = Histogram("moviebot_action_seconds", "Wall time of the actions.", ["action"])
+PHASE_SECONDS = Histogram(
+    "moviebot_action_phase_seconds", "Wall time of the actions by phase.", ["action", "phase"]
+)
+ACTION_MESSAGES = Histogram(
+    "moviebot_action_messages", "Messages sent per action call.", ["action"], MESSAGE_BUCKETS
+)
+ACTION_ERRORS = Counter("moviebot_action_errors_total", "Action calls that raised an exception.", ["action"])
+FUZZY_FALLBACKS = Counter(
+    "moviebot_fuzzy_fallbacks_total",
+    "Lookups that fell back to fuzzy matching, by result (matched: the best match was good enough).",
+    ["action", "result"],
+)
+Reading("moviebot_response_cache_hits_total", "Answers served from the response cache.",
+        lambda: response_cache.hits, "counter")
+Reading("moviebot_response_cache_misses_total", "Answers not found in the response cache.",
+        lambda: response_cache.misses, "counter")
+Reading("moviebot_response_cache_entries", "Answers in the response cache.", lambda: response_cache.stats()["size"])
+Reading("moviebot_coalesced_calls_total", "Lookups answered by an identical lookup already running.",
+        lambda: single_flight.coalesced, "counter")
+Reading("moviebot_coalesced_seconds_saved_total", "Computation time not repeated thanks to the coalesced lookups.",
+        lambda: single_flight.saved_seconds, "counter")
+Reading("moviebot_lookups_in_flight", "Distinct lookups running, that identical ones can join.", single_flight.in_flight)
+
+
+def render() -> Text:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+# ---------------------------------------------------------------- phases
+
+_local = threading.local()
+
+
+def traced(action: Text, func: Callable, *args: Any) -> Any:
+    """Call `func(*args)` recording the `lap`s it makes under `action`."""
+    _local.action, _local.last, _local.phases = action, time.perf_counter(), {}
+    try:
+        return func(*args)
+    finally:
+        lap("rendering")
+        for phase, seconds in _local.phases.items():
+            PHASE_SECONDS.observe(seconds, action=action, phase=phase)
+        _local.action = None
+
+
+def lap(phase: Text) -> None:
+    """Charge the time since the previous lap (or the start of the action) to `phase`."""
+    if getattr(_local, "action", None) is None:
+        return
+    now = time.perf_counter()
+    _local.phases[phase] = _local.phases.get(phase, 0.0) + now - _local.last
+    _local.last = now
+
+
+def count_fuzzy(matched: bool) -> None:
+    """Count a fuzzy fallback of the current action."""
+    action = getattr(_local, "action", None)
+    if action is not None:
+        FUZZY_FALLBACKS.inc(action=action, result="matched" if matched else "rejected")
+
+
+def instrument_actions(module) -> None:
+    """Time the `run` of every Action class defined in `module`."""
+    from rasa_sdk import Action
+
+    for _, cls in inspect.getmembers(module, inspect.isclass):
+        if cls.__module__ == module.__name__ and issubclass(cls, Action) and not inspect.isabstract(cls):
+            cls.run = _timed(cls.run)
+
+
+def _timed(run: Callable) -> Callable:
+    @functools.wraps(run)
+    async def timed_run(self, dispatcher, tracker, domain):
+        # in the process running the actions, once; nothing if no port is set
+        serve()
+        name = self.name()
+        sent = len(dispatcher.messages)
+        start = time.perf_counter()
+        try:
+            result = run(self, dispatcher, tracker, domain)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        except Exception:
+            ACTION_ERRORS.inc(action=name)
+            raise
+        finally:
+            ACTION_SECONDS.observe(time.perf_counter() - start, action=name)
+            ACTION_MESSAGES.observe(len(dispatcher.messages) - sent, action=name)
+
+    return timed_run
+
+
+# ---------------------------------------------------------------- profiler
+
+class SamplingProfiler:
+    """Samples the stacks of all the other threads `hz` times per second.
+
+    The result is in the "collapsed stacks" format of flamegraph.pl: one
+    line per distinct stack, frames separated by ';', then the sample count.
+    """
+
+    def __init__(self, hz: float = 100):
+        self.hz = hz
+        self.stacks: _Tally = _Tally()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(1 / self.hz):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> "SamplingProfiler":
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name="moviebot-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Text:
+        """Stop sampling and return the collapsed stacks."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+_profile_lock = threading.Lock()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == "/metrics":
+            self._send(200, render(), "text/plain; version=0.0.4; charset=utf-8")
+        elif url.path == "/debug/profile":
+            try:
+                seconds = min(float(query.get("seconds", 10)), 300)
+                hz = min(float(query.get("hz", 100)), 1000)
+            except ValueError:
+                self._send(400, "seconds and hz must be numbers\n")
+                return
+            if not _profile_lock.acquire(blocking=False):
+                self._send(409, "a profile is already being taken\n")
+                return
+            try:
+                profiler = SamplingProfiler(hz).start()
+                time.sleep(seconds)
+                self._send(200, profiler.stop())
+            finally:
+                _profile_lock.release()
+        else:
+            self._send(404, "not found\n")
+
+    def _send(self, status: int, body: Text, content_type: Text = "text/plain; charset=utf-8") -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+_server_pid: Optional[int] = None
+
+
+def serve(port: Optional[int] = None, host: Text = METRICS_HOST) -> None:
+    """Start the metrics endpoint of this process, once (port 0: never)."""
+    global _server_pid
+    if _server_pid == os.getpid():
+        return
+    _server_pid = os.getpid()
+    port = METRICS_PORT if port is None else port
+    if not port:
+        return
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        logger.warning(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="moviebot-metrics", daemon=True).start()
+    logger.info(f"Metrics on http://{host}:{port}/metrics")
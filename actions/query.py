@@ -0,0 +1,127 @@
+# Filter -> rank pipeline used by the recommendation actions.
+#
+# The catalog is scanned once, in fixed-size chunks: the predicates are
+# applied to each chunk in turn, each one only on the rows that survived
+# the previous ones, and the survivors go through a bounded heap that keeps
+# the k best rows seen so far. Memory stays O(chunk + k) whatever the size
+# of the catalog, and the answer is the true top-k, not the top of the first
+# k matches.
+#
+# Given the indexes of the catalog generation, the thresholds on the ranking
+# columns (see RankIndex.at_least) and the genres (see GenreIndex) each give
+# a set of candidate rows without a scan: only the smallest one is read, and
+# the predicates are applied to its rows instead of the whole catalog.
+
+import heapq
+import operator
+from numbers import Real
+from typing import Callable, List, Optional, Sequence, Text, Tuple
+
+import numpy as np
+
+from .metrics import lap
+
+
+OPERATORS = {
+    ">=": operator.ge,
+    ">": operator.gt,
+    "<=": operator.le,
+    "<": operator.lt,
+    "==": operator.eq,
+}
+
+CHUNK_SIZE = 65536
+
+
+class MovieQuery:
+    """Immutable query over the columns of a MovieCatalog.
+
+    >>> MovieQuery(catalog).where("No_of_Votes", ">=", 100000).top(10, by=["No_of_Votes", "Gross"])
+    """
+
+    def __init__(self, catalog, ranks=None, genres=None, predicates: Tuple = ()):
+        self.catalog = catalog
+        # RankIndex and GenreIndex of the catalog, if any
+        self.ranks = ranks
+        self.genres = genres
+        # (column, test, candidates): `candidates()` gives a superset of the
+        # matching rows from an index, or is None
+        self.predicates: Tuple[Tuple[Text, Callable[[np.ndarray], np.ndarray], Optional[Callable]], ...] = predicates
+
+    def _with(self, column: Text, test: Callable[[np.ndarray], np.ndarray],
+              candidates: Optional[Callable[[], np.ndarray]] = None) -> "MovieQuery":
+        return MovieQuery(self.catalog, self.ranks, self.genres, self.predicates + ((column, test, candidates),))
+
+    def where(self, column: Text, op: Text, value) -> "MovieQuery":
+        """Keep the rows where `column <op> value`; NaN never matches."""
+        compare = OPERATORS[op]
+        candidates = None
+        if (self.ranks is not None and column in self.ranks.order and op in (">=", ">")
+                and isinstance(value, Real) and not isinstance(value, bool)):
+            candidates = lambda: self.ranks.at_least(column, value, strict=op == ">")
+        return self._with(column, lambda values: compare(values, value), candidates)
+
+    def where_genres(self, mask: int, match_all: bool = True) -> "MovieQuery":
+        """Keep the rows having all (or any) of the genre bits in `mask`."""
+        candidates = None
+        if self.genres is not None:
+            candidates = lambda: self.genres.candidates(mask, match_all)
+        if match_all:
+            return self._with("Genre_Mask", lambda bits: (bits & mask) == mask, candidates)
+        return self._with("Genre_Mask", lambda bits: (bits & mask) != 0, candidates)
+
+    def _candidates(self) -> Optional[np.ndarray]:
+        """The smallest set of candidate rows given by the indexes, ascending;
+        None if no predicate has an index."""
+        sets = [candidates() for _, _, candidates in self.predicates if candidates is not None]
+        if not sets:
+            return None
+        return np.sort(min(sets, key=len))
+
+    def rows(self, chunk_size: int = CHUNK_SIZE):
+        """Yield, chunk by chunk, the ids of the rows matching every predicate."""
+        columns = {column: self.catalog.column(column) for column, _, _ in self.predicates}
+        deleted = self.catalog.deleted
+        candidates = self._candidates()
+        total = len(self.catalog) if candidates is None else len(candidates)
+        for start in range(0, total, chunk_size):
+            if candidates is None:
+                rows = np.arange(start, min(start + chunk_size, total))
+            else:
+                rows = candidates[start:start + chunk_size]
+            if deleted is not None:
+                rows = rows[~deleted[rows]]
+            for column, test, _ in self.predicates:
+                rows = rows[test(columns[column][rows])]
+                if not len(rows):
+                    break
+            if len(rows):
+                yield rows
+
+    def top(self, k: int, by: Sequence[Text], chunk_size: int = CHUNK_SIZE) -> List[int]:
+        """Ids of the `k` best matching rows, ordered by the `by` columns
+        (highest first, ties in dataset order, NaN last)."""
+        columns = [self.catalog.column(column) for column in by]
+        heap: List[Tuple] = []
+
+        for rows in self.rows(chunk_size):
+            lap("filtering")
+            keys = [self._sort_key(column[rows]) for column in columns]
+            # only the chunk's own top-k can make it into the global top-k
+            if len(rows) > k:
+                best = np.lexsort([-rows] + keys[::-1])[-k:]
+                rows, keys = rows[best], [key[best] for key in keys]
+            for entry in zip(*[key.tolist() for key in keys], (-rows).tolist()):
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+            lap("sorting")
+
+        lap("filtering")
+        return [-entry[-1] for entry in sorted(heap, reverse=True)]
+
+    @staticmethod
+    def _sort_key(values: np.ndarray) -> np.ndarray:
+        values = values.astype(float)
+        return np.where(np.isnan(values), -np.inf, values)
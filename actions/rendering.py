@@ -0,0 +1,77 @@
+# Rendering of movie lists into dispatcher messages.
+#
+# Rows are formatted straight from the column lists of the DataFrame with a
+# str.format template (no per-row pandas Series). How a list is sent is set
+# by MOVIEBOT_RESPONSE_MODE:
+#   - "messages" (default): one message per film, with its poster
+#   - "compact": the whole list grouped in a single text message
+#   - "carousel": one carousel of at most MOVIEBOT_CAROUSEL_SIZE cards
+
+import os
+from string import Formatter
+from typing import Any, Dict, List, Optional, Text
+
+import pandas as pd
+from rasa_sdk.executor import CollectingDispatcher
+
+
+RESPONSE_MODE = os.environ.get("MOVIEBOT_RESPONSE_MODE", "messages")
+CAROUSEL_SIZE = int(os.environ.get("MOVIEBOT_CAROUSEL_SIZE", "10"))
+
+
+def format_rows(movies_df: pd.DataFrame, template: Text) -> List[Text]:
+    """Format every row of `movies_df` with `template`, e.g.
+    "⭐ {Series_Title} - Rating: {IMDB_Rating}"."""
+    fields = list(dict.fromkeys(name for _, name, _, _ in Formatter().parse(template) if name))
+    if not fields:
+        return [template] * len(movies_df)
+    columns = [movies_df[field].tolist() for field in fields]
+    return [template.format(**dict(zip(fields, values))) for values in zip(*columns)]
+
+
+def utter_movies(
+    dispatcher: CollectingDispatcher,
+    movies_df: pd.DataFrame,
+    template: Text,
+    header: Optional[Text] = None,
+    image_column: Optional[Text] = "Poster_Link",
+    mode: Optional[Text] = None,
+    page: int = 0,
+    page_size: Optional[int] = None,
+) -> None:
+    """Send the movies of `movies_df`, preceded by `header`, in `mode`.
+
+    In carousel mode only the `page`-th window of `page_size` films is sent,
+    followed by a note with the number of films left out.
+    """
+    mode = mode or RESPONSE_MODE
+    texts = format_rows(movies_df, template)
+    images = movies_df[image_column].tolist() if image_column else [None] * len(texts)
+
+    if mode == "compact":
+        lines = [header.strip()] if header else []
+        dispatcher.utter_message(text="\n\n".join(lines + [text.strip() for text in texts]))
+        return
+
+    if header:
+        dispatcher.utter_message(text=header)
+
+    if mode == "carousel":
+        page_size = page_size or CAROUSEL_SIZE
+        start = page * page_size
+        window = range(start, min(start + page_size, len(texts)))
+        elements: List[Dict[Text, Any]] = []
+        for i in window:
+            title, _, subtitle = texts[i].strip().partition("\n")
+            elements.append({"title": title, "subtitle": subtitle, "image_url": images[i]})
+        if elements:
+            dispatcher.utter_message(
+                attachment={"type": "template", "payload": {"template_type": "generic", "elements": elements}}
+            )
+        remaining = len(texts) - window.stop
+        if remaining > 0:
+            dispatcher.utter_message(text=f"➕ ...and {remaining} more.")
+        return
+
+    for text, image in zip(texts, images):
+        dispatcher.utter_message(text=text, image=image)
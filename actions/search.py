@@ -0,0 +1,215 @@
+# Full-text search of the movies by plot and title, ranked by BM25.
+#
+# The words of the Overview and of the Series_Title (counted TITLE_WEIGHT
+# times) of every movie go into an inverted index stored as flat arrays, in
+# the layout of a CSR matrix: the postings of term t are the entries
+# offsets[t]:offsets[t + 1] of `docs` (row ids, ascending) and `tfs` (term
+# frequencies). A query only reads the postings of its own terms, and sums
+# their BM25 scores into one array of scores per movie.
+#
+# Words are casefolded, stripped of accents and of a plural "s", so that
+# "the movie where prisoners escape" finds "a prisoner escapes...".
+#
+# Incremental updates don't touch the arrays: the changed and added movies
+# go into a small second index, their old postings are hidden, and the
+# scores of both are merged. Each update only tokenizes its own movies: their
+# postings are merged into those of the second index, which is folded into
+# the main one when the CSV is compacted and the catalog reloaded.
+
+import copy
+import math
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Text, Tuple
+
+import numpy as np
+
+from .catalog import MovieCatalog
+from .indexes import normalize
+from .similarity import STOPWORDS
+
+TITLE_WEIGHT = 2
+# words of the questions themselves ("the film where...")
+QUERY_STOPWORDS = STOPWORDS | frozenset(
+    "film films movie movies story plot where what whats which find show tell search looking want know".split()
+)
+
+
+def _stem(word: Text) -> Text:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def tokenize(text, stopwords: frozenset = STOPWORDS) -> List[Text]:
+    if not isinstance(text, str):
+        return []
+    return [_stem(word) for word in re.findall(r"[a-z0-9]+", normalize(text)) if word not in stopwords]
+
+
+class TextIndex:
+    """BM25 inverted index of the titles and overviews of some rows."""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, titles: Sequence, overviews: Sequence, rows: Optional[np.ndarray] = None):
+        # row id of each indexed document (None: document i is row i)
+        self.rows = rows
+        vocabulary: Dict[Text, int] = {}
+        terms: List[int] = []
+        docs: List[int] = []
+        counts: List[int] = []
+        lengths = np.zeros(len(titles), dtype=np.float32)
+        for doc, (title, overview) in enumerate(zip(titles, overviews)):
+            tf: Dict[int, int] = {}
+            for weight, tokens in ((TITLE_WEIGHT, tokenize(title)), (1, tokenize(overview))):
+                for token in tokens:
+                    term = vocabulary.setdefault(token, len(vocabulary))
+                    tf[term] = tf.get(term, 0) + weight
+                lengths[doc] += weight * len(tokens)
+            terms.extend(tf)
+            docs.extend([doc] * len(tf))
+            counts.extend(tf.values())
+
+        terms = np.asarray(terms, dtype=np.int64)
+        order = np.argsort(terms, kind="stable")  # documents stay ascending within a term
+        self.vocabulary = vocabulary
+        self.docs = np.asarray(docs, dtype=np.int32)[order]
+        self.tfs = np.asarray(counts, dtype=np.float32)[order]
+        self.offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocabulary)), out=self.offsets[1:])
+        self.lengths = lengths
+        self.average_length = float(lengths.mean()) if len(lengths) else 0.0
+
+    @classmethod
+    def from_catalog(cls, catalog: MovieCatalog, rows: Optional[Sequence[int]] = None) -> "TextIndex":
+        if rows is None:
+            return cls(catalog.column("Series_Title"), catalog.column("Overview"))
+        # only the texts of `rows` are decoded
+        rows = np.asarray(rows, dtype=np.int64)
+        return cls(catalog.column("Series_Title", rows), catalog.column("Overview", rows), rows)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def merged(self, other: "TextIndex", removed: Iterable[int] = ()) -> "TextIndex":
+        """New index of the documents of both (indexes of some rows), in
+        row order, without those of this one whose row is in `other` or in
+        `removed`. Only the postings are merged, no text is tokenized again."""
+        dropped = set(removed) | set(other.rows.tolist())
+        kept = np.asarray([doc for doc, row in enumerate(self.rows.tolist()) if row not in dropped], dtype=np.int64)
+        rows = np.concatenate([self.rows[kept], other.rows])
+        order = np.argsort(rows, kind="stable")
+        # new document of each kept one and of each one of `other`
+        doc_of = np.empty(len(rows), dtype=np.int64)
+        doc_of[order] = np.arange(len(rows))
+        mine = np.full(len(self), -1, dtype=np.int64)
+        mine[kept] = doc_of[:len(kept)]
+
+        vocabulary = dict(self.vocabulary)
+        for token in other.vocabulary:
+            vocabulary.setdefault(token, len(vocabulary))
+        # term ids follow the order of the vocabularies
+        theirs = np.asarray([vocabulary[token] for token in other.vocabulary], dtype=np.int64)
+        docs = mine[self.docs]
+        alive = docs >= 0
+        terms = np.concatenate([np.repeat(np.arange(len(self.vocabulary)), np.diff(self.offsets))[alive],
+                                np.repeat(theirs, np.diff(other.offsets))])
+        docs = np.concatenate([docs[alive], doc_of[len(kept):][other.docs]])
+        tfs = np.concatenate([self.tfs[alive], other.tfs])
+
+        # the terms left without documents are dropped
+        used, terms = np.unique(terms, return_inverse=True)
+        tokens = list(vocabulary)
+        postings = np.lexsort((docs, terms))
+        index = copy.copy(self)
+        index.rows = rows[order]
+        index.vocabulary = {tokens[term]: t for t, term in enumerate(used.tolist())}
+        index.docs = docs[postings].astype(np.int32)
+        index.tfs = tfs[postings]
+        index.offsets = np.zeros(len(used) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(used)), out=index.offsets[1:])
+        index.lengths = np.concatenate([self.lengths[kept], other.lengths])[order]
+        index.average_length = float(index.lengths.mean()) if len(index.lengths) else 0.0
+        return index
+
+    def document_frequency(self, term: Text) -> int:
+        t = self.vocabulary.get(term)
+        return 0 if t is None else int(self.offsets[t + 1] - self.offsets[t])
+
+    def scores(self, terms: Iterable[Tuple[Text, float]], average_length: Optional[float] = None) -> np.ndarray:
+        """BM25 score of every document for the (term, idf) pairs."""
+        average_length = average_length or self.average_length or 1.0
+        norms = self.K1 * (1 - self.B + self.B * self.lengths / average_length)
+        scores = np.zeros(len(self), dtype=np.float32)
+        for term, idf in terms:
+            t = self.vocabulary.get(term)
+            if t is None:
+                continue
+            docs = self.docs[self.offsets[t]:self.offsets[t + 1]]
+            tfs = self.tfs[self.offsets[t]:self.offsets[t + 1]]
+            # a document appears once per term, so no two entries collide
+            scores[docs] += idf * tfs * (self.K1 + 1) / (tfs + norms[docs])
+        return scores
+
+    def memory_bytes(self) -> int:
+        return sum(array.nbytes for array in (self.docs, self.tfs, self.offsets, self.lengths))
+
+
+class FullTextSearch:
+    """Search of the movies of a catalog generation.
+
+    The index of the changed and added movies (see `patched`) is searched
+    with the document frequencies of the original one, so that the scores
+    of both can be compared.
+    """
+
+    def __init__(self, index: TextIndex, hidden: Optional[np.ndarray] = None, extra: Optional[TextIndex] = None):
+        self.index = index
+        self.hidden = hidden
+        self.extra = extra
+
+    @classmethod
+    def build(cls, catalog: MovieCatalog) -> "FullTextSearch":
+        hidden = None if catalog.deleted is None else np.asarray(catalog.deleted, dtype=bool).copy()
+        return cls(TextIndex.from_catalog(catalog), hidden)
+
+    def _idf(self, term: Text) -> float:
+        n = len(self.index)
+        df = self.index.document_frequency(term)
+        if self.extra is not None:
+            n += len(self.extra)
+            df += self.extra.document_frequency(term)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: Text, k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, scores) of the `k` movies best matching `query`, best first."""
+        terms = [(term, self._idf(term)) for term in dict.fromkeys(tokenize(query, QUERY_STOPWORDS))]
+        scores = self.index.scores(terms)
+        if self.hidden is not None:
+            scores[self.hidden[:len(scores)]] = 0
+        rows = np.flatnonzero(scores)
+        scores = scores[rows]
+        if self.extra is not None:
+            extra_scores = self.extra.scores(terms, self.index.average_length)
+            matched = np.flatnonzero(extra_scores)
+            rows = np.concatenate([rows, self.extra.rows[matched]])
+            scores = np.concatenate([scores, extra_scores[matched]])
+        if len(rows) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[best], scores[best]
+        order = np.lexsort((rows, -scores))
+        return rows[order], scores[order]
+
+    def patched(self, catalog: MovieCatalog, changed: Sequence[int], deleted: Sequence[int]) -> "FullTextSearch":
+        """The search of `catalog`, in which the `changed` rows (updated or
+        added) were indexed again and the `deleted` ones removed."""
+        base = len(self.index)
+        hidden = np.zeros(base, dtype=bool) if self.hidden is None else self.hidden.copy()
+        hidden[[row for row in list(changed) + list(deleted) if row < base]] = True
+        extra = TextIndex.from_catalog(catalog, sorted(set(changed)))
+        if self.extra is not None:
+            extra = self.extra.merged(extra, deleted)
+        return FullTextSearch(self.index, hidden, extra if len(extra) else None)
@@ -0,0 +1,135 @@
+# Pre-fork action server: one process per core sharing a single catalog.
+#
+#   python -m actions.server --workers 4 --port 5055
+#
+# `rasa run actions` serves every request from one Python process, so the
+# catalog lookups use one core at most. Here the parent process imports the
+# actions once, which loads the catalog and builds all its indexes, then
+# freezes the garbage collector and forks the workers. The workers share
+# those pages copy-on-write, so adding workers does not multiply the memory
+# taken by the catalog. All the workers accept connections on the same
+# listening socket, opened by the parent, and the parent restarts any worker
+# that dies.
+#
+# With --metrics-port (default: MOVIEBOT_METRICS_PORT, 0: off), worker N
+# serves its metrics (see metrics.py) on that port + N.
+#
+# Fork is only available on POSIX systems.
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict, Optional, Text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 5055
+
+
+def _listen(host: Text, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _serve(executor, sock: socket.socket) -> None:
+    """Worker body: serve the webhook on the inherited socket until killed."""
+    from rasa_sdk.endpoint import create_app
+
+    app = create_app(executor)
+    app.run(sock=sock, single_process=True, motd=False, access_log=False)
+
+
+def _spawn(executor, sock: socket.socket, slot: int, metrics_port: Optional[int] = None) -> int:
+    pid = os.fork()
+    if pid == 0:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            from . import metrics
+
+            port = metrics.METRICS_PORT if metrics_port is None else metrics_port
+            # also with 0, so that the actions don't start it on the base port
+            metrics.serve(port + slot if port else 0)
+            _serve(executor, sock)
+        finally:
+            os._exit(0)
+    return pid
+
+
+def serve(package: Text = "actions", workers: int = 0, host: Text = "0.0.0.0", port: int = DEFAULT_PORT,
+          backlog: int = 1024, metrics_port: Optional[int] = None) -> None:
+    """Load `package` once, then fork `workers` processes serving it
+    (one per CPU if 0), with their metrics on `metrics_port` + N."""
+    if not hasattr(os, "fork"):
+        raise RuntimeError("The pre-fork action server needs os.fork (POSIX only), use `rasa run actions`.")
+
+    from rasa_sdk.executor import ActionExecutor
+
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    executor = ActionExecutor()
+    executor.register_package(package)
+    logger.info(f"Loaded {len(executor.actions)} actions in {time.perf_counter() - start:.2f}s")
+
+    # objects created so far live as long as the workers: keep the collector
+    # from touching (and so copying) their pages in every worker
+    gc.collect()
+    gc.freeze()
+
+    sock = _listen(host, port, backlog)
+    children: Dict[int, int] = {}
+    for slot in range(workers):
+        children[_spawn(executor, sock, slot, metrics_port)] = slot
+    logger.info(f"Action server listening on http://{host}:{port}/webhook with {workers} workers")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        if slot is not None and not stopping:
+            logger.warning(f"Worker {pid} exited with status {status}, restarting it")
+            children[_spawn(executor, sock, slot, metrics_port)] = slot
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the action server with several pre-forked workers.")
+    parser.add_argument("--actions", default="actions", help="package containing the custom actions")
+    parser.add_argument("--workers", type=int, default=0, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--host", default=os.environ.get("SANIC_HOST", "0.0.0.0"))
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--metrics-port", type=int,
+                        help="first port of the metrics endpoints, one per worker (default: MOVIEBOT_METRICS_PORT, 0: off)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(process)d %(levelname)s %(message)s")
+    serve(args.actions, args.workers, args.host, args.port, metrics_port=args.metrics_port)
+    sys.exit(0)
@@ -0,0 +1,383 @@
+# "Movies like X": nearest neighbours of a movie in a vector space.
+#
+# Each movie is embedded from its Overview, Genre, Director and stars,
+# without any downloaded model: its features (overview words, "genre:drama",
+# "director:christopher nolan"...) are weighted by TF-IDF and hashed, with a
+# random sign, into a dense float32 vector of DIM values, normalized so that
+# a dot product is the cosine similarity. The IDF of the features is kept
+# (hashed into IDF_BUCKETS values) to embed the movies changed later on.
+#
+# The neighbours are searched exactly, with one matrix-vector product, up to
+# EXACT_LIMIT movies. Above, an inverted file is used instead: the vectors
+# are clustered by k-means into about sqrt(n) lists and a query only scores
+# the movies of the NPROBE lists whose centroid is closest to it.
+#
+# The index is built in memory with the catalog generation, which takes
+# seconds on large catalogs, or once offline next to the dataset, from where
+# it is memory-mapped (so shared by the workers) for as long as the columns
+# it was computed from and the embedding parameters stay the same:
+#
+#   python -m actions.similarity build
+#   python -m actions.similarity similar "The Matrix"
+
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import time
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Text, Tuple
+
+import numpy as np
+
+from .catalog import DATASET_PATH, MovieCatalog, _replace, _save, open_catalog, split_genres
+from .indexes import TitleIndex, normalize
+
+logger = logging.getLogger(__name__)
+
+DIM = int(os.environ.get("MOVIEBOT_SIMILAR_DIM", "256"))
+EXACT_LIMIT = int(os.environ.get("MOVIEBOT_SIMILAR_EXACT", "50000"))
+NPROBE = int(os.environ.get("MOVIEBOT_SIMILAR_NPROBE", "16"))
+IDF_BUCKETS = 1 << 20
+CHUNK_SIZE = 65536
+# building the index in memory longer than this is worth a warning
+SLOW_BUILD_SECONDS = 1.0
+
+STAR_COLUMNS = ["Star1", "Star2", "Star3", "Star4"]
+# columns the vectors are computed from
+SIMILAR_COLUMNS = ["Overview", "Genre", "Director"] + STAR_COLUMNS
+# the genre and the people tell more about a movie than any single overview word
+FIELD_WEIGHTS = {"word": 1.0, "genre": 3.0, "director": 2.0, "star": 1.5}
+STOPWORDS = frozenset("""
+a about after against all along also an and another any are around as at be becomes been before being between
+both but by can during each from gets has have he her hers him his how in into is it its itself may more most
+must new not now of off on one only or other out over own she so some than that the their them then there
+these they this through to two up when where which while who whom whose will with within years young
+""".split())
+
+
+def similar_path(dataset_path: Text = DATASET_PATH) -> Text:
+    """The index of a dataset: imdb_top_1000.csv -> imdb_top_1000.similar"""
+    return os.environ.get("MOVIEBOT_SIMILAR", os.path.splitext(dataset_path.rstrip(os.sep))[0] + ".similar")
+
+
+def movie_features(overview, genre, director, stars: Sequence) -> Dict[Text, float]:
+    """Weighted features of a movie: sublinear term frequency times the weight of the field."""
+    counts: Counter = Counter()
+    if isinstance(overview, str):
+        counts.update(f"word:{word}" for word in re.findall(r"[a-z]{3,}", normalize(overview))
+                      if word not in STOPWORDS)
+    if isinstance(genre, str):
+        counts.update(f"genre:{g.lower()}" for g in split_genres(genre))
+    for role, names in (("director", [director]), ("star", stars)):
+        counts.update(f"{role}:{normalize(name)}" for name in names if isinstance(name, str) and name)
+    return {feature: FIELD_WEIGHTS[feature.split(":", 1)[0]] * (1 + math.log(count))
+            for feature, count in counts.items()}
+
+
+def _hashed(features: Dict[Text, float]) -> Tuple[np.ndarray, np.ndarray]:
+    """IDF bucket and signed weight of each feature."""
+    hashes = np.array([zlib.crc32(feature.encode("utf-8")) for feature in features], dtype=np.uint32)
+    signs = np.where(hashes >> 31, -1.0, 1.0)
+    return (hashes & (IDF_BUCKETS - 1)).astype(np.int64), signs * np.fromiter(features.values(), float, len(features))
+
+
+def _row_features(catalog: MovieCatalog, rows: Sequence[int]) -> Iterable[Dict[Text, float]]:
+    # only the texts of `rows` are decoded
+    columns = {name: catalog.column(name, rows) for name in SIMILAR_COLUMNS}
+    for i in range(len(rows)):
+        yield movie_features(columns["Overview"][i], columns["Genre"][i], columns["Director"][i],
+                             [columns[name][i] for name in STAR_COLUMNS])
+
+
+def _normalize_rows(vectors: np.ndarray) -> None:
+    for start in range(0, len(vectors), CHUNK_SIZE):
+        chunk = vectors[start:start + CHUNK_SIZE]
+        norms = np.linalg.norm(chunk, axis=1, keepdims=True)
+        chunk /= np.where(norms > 0, norms, 1)
+
+
+def embed(catalog: MovieCatalog, rows: Sequence[int], idf: np.ndarray, dim: int) -> np.ndarray:
+    """Vectors of `rows` with the given IDF (that of the catalog the index was built on)."""
+    vectors = np.zeros((len(rows), dim), dtype=np.float32)
+    for i, features in enumerate(_row_features(catalog, rows)):
+        if features:
+            buckets, weights = _hashed(features)
+            np.add.at(vectors[i], buckets % dim, weights * idf[buckets])
+    _normalize_rows(vectors)
+    return vectors
+
+
+def embed_catalog(catalog: MovieCatalog, dim: int = DIM, out: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """(vectors of all the movies, IDF of the features), the vectors written
+    into `out` if given (e.g. a memory-mapped file)."""
+    n = len(catalog)
+    buckets, weights, owners = [], [], []
+    for row, features in enumerate(_row_features(catalog, range(n))):
+        if features:
+            b, w = _hashed(features)
+            buckets.append(b)
+            weights.append(w)
+            owners.append(np.full(len(b), row, dtype=np.int64))
+    buckets = np.concatenate(buckets) if buckets else np.zeros(0, dtype=np.int64)
+    weights = np.concatenate(weights) if weights else np.zeros(0)
+    owners = np.concatenate(owners) if owners else np.zeros(0, dtype=np.int64)
+
+    # each feature appears once per movie, so this counts the movies having it
+    df = np.bincount(buckets, minlength=IDF_BUCKETS)
+    idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+
+    vectors = np.zeros((n, dim), dtype=np.float32) if out is None else out
+    np.add.at(vectors, (owners, buckets % dim), (weights * idf[buckets]).astype(np.float32))
+    _normalize_rows(vectors)
+    return vectors, idf
+
+
+def _top(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the `k` highest scores, best first (ties by position)."""
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+class VectorIndex:
+    """Nearest neighbours by cosine similarity among L2-normalized vectors,
+    exact or through an inverted file (IVF)."""
+
+    VERSION = 2
+
+    def __init__(self, vectors: np.ndarray, idf: np.ndarray, centroids: Optional[np.ndarray] = None,
+                 order: Optional[np.ndarray] = None, offsets: Optional[np.ndarray] = None):
+        self.vectors = vectors
+        self.idf = idf
+        # IVF: the rows of list i are order[offsets[i]:offsets[i + 1]]
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1]
+
+    @classmethod
+    def build(cls, catalog: MovieCatalog, dim: int = DIM, exact_limit: int = EXACT_LIMIT,
+              out: Optional[np.ndarray] = None) -> "VectorIndex":
+        vectors, idf = embed_catalog(catalog, dim, out)
+        if len(vectors) <= exact_limit:
+            return cls(vectors, idf)
+        return cls(vectors, idf, *cls._cluster(vectors))
+
+    @staticmethod
+    def _cluster(vectors: np.ndarray, iterations: int = 10, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Spherical k-means on a sample, then every vector to its closest centroid."""
+        rng = np.random.default_rng(seed)
+        n = len(vectors)
+        lists = max(1, int(math.sqrt(n)))
+        sample = np.asarray(vectors[np.sort(rng.choice(n, min(n, lists * 64), replace=False))])
+        centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+        for _ in range(iterations):
+            assigned = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assigned, sample)
+            empty = np.bincount(assigned, minlength=lists) == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        assigned = np.concatenate([
+            np.argmax(vectors[start:start + CHUNK_SIZE] @ centroids.T, axis=1)
+            for start in range(0, n, CHUNK_SIZE)
+        ])
+        order = np.argsort(assigned, kind="stable")
+        offsets = np.zeros(lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assigned, minlength=lists), out=offsets[1:])
+        return centroids.astype(np.float32), order.astype(np.int64), offsets
+
+    def candidates(self, query: np.ndarray, nprobe: int = NPROBE) -> Optional[np.ndarray]:
+        """Rows to score for `query` (None: all of them)."""
+        if self.centroids is None:
+            return None
+        lists = _top(self.centroids @ query, nprobe)
+        return np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+
+    def search(self, query: np.ndarray, k: int, hidden: Optional[np.ndarray] = None,
+               nprobe: int = NPROBE) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, scores) of the `k` nearest vectors, skipping the `hidden` rows."""
+        rows = self.candidates(query, nprobe)
+        if rows is None:
+            scores = self.vectors @ query
+            if hidden is not None:
+                scores[hidden[:len(scores)]] = -np.inf
+            best = _top(scores, k)
+            best = best[np.isfinite(scores[best])]
+            return best, scores[best]
+        rows = np.sort(rows)
+        if hidden is not None:
+            rows = rows[~hidden[rows]]
+        scores = np.asarray(self.vectors[rows] @ query)
+        best = _top(scores, k)
+        return rows[best], scores[best]
+
+    def save(self, directory: Text, fingerprint: int) -> None:
+        os.makedirs(directory, exist_ok=True)
+        _save(os.path.join(directory, "idf.npy"), self.idf)
+        if self.centroids is not None:
+            _save(os.path.join(directory, "centroids.npy"), self.centroids)
+            _save(os.path.join(directory, "order.npy"), self.order)
+            _save(os.path.join(directory, "offsets.npy"), self.offsets)
+        meta = {
+            "version": self.VERSION, "movies": len(self.vectors), "dim": self.dim,
+            "fingerprint": fingerprint, "ivf": self.centroids is not None,
+        }
+        _replace(os.path.join(directory, "meta.json"), lambda f: f.write(json.dumps(meta, indent=2).encode("utf-8")))
+
+    @classmethod
+    def load(cls, directory: Text, fingerprint: Optional[int] = None) -> Optional["VectorIndex"]:
+        """The index saved in `directory`, memory-mapped; None if there is
+        none or it was built on other data."""
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != cls.VERSION or (fingerprint is not None and meta.get("fingerprint") != fingerprint):
+            return None
+
+        def array(name: Text) -> np.ndarray:
+            return np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+
+        if meta["ivf"]:
+            return cls(array("vectors"), array("idf"), array("centroids"), array("order"), array("offsets"))
+        return cls(array("vectors"), array("idf"))
+
+
+def fingerprint(catalog: MovieCatalog, dim: int = DIM) -> int:
+    """Checksum of the embedding parameters and of the titles, years and
+    columns the vectors are computed from, to tell whether a saved index
+    fits a catalog."""
+    parameters = [dim, IDF_BUCKETS, FIELD_WEIGHTS, sorted(STOPWORDS)]
+    checksum = zlib.crc32(json.dumps(parameters).encode("utf-8"))
+    checksum = zlib.crc32(np.asarray(catalog.column("Released_Year"), dtype=np.int64).tobytes(), checksum)
+    for name in ["Series_Title"] + SIMILAR_COLUMNS:
+        for start in range(0, len(catalog), CHUNK_SIZE):
+            # decoded a chunk at a time, not kept
+            values = catalog.column(name, range(start, min(start + CHUNK_SIZE, len(catalog))))
+            text = "\n".join(value if isinstance(value, str) else "" for value in values)
+            checksum = zlib.crc32(text.encode("utf-8"), checksum)
+    return checksum
+
+
+def build_index(catalog: MovieCatalog, directory: Text, dim: int = DIM, exact_limit: int = EXACT_LIMIT) -> VectorIndex:
+    """Build the index of `catalog` into `directory`, the vectors being
+    written straight to their memory-mapped file."""
+    os.makedirs(directory, exist_ok=True)
+    # the previous file is replaced, not overwritten, in case a server maps it
+    tmp = os.path.join(directory, "vectors.npy.tmp")
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(len(catalog), dim))
+    index = VectorIndex.build(catalog, dim, exact_limit, out)
+    out.flush()
+    del out
+    os.replace(tmp, os.path.join(directory, "vectors.npy"))
+    index.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+    index.save(directory, fingerprint(catalog, dim))
+    return index
+
+
+class SimilarMovies:
+    """The vector index of a catalog generation.
+
+    After incremental updates the index built on the original catalog is
+    kept as is: the changed and added movies are embedded again into a
+    small side table (with the original IDF), and the base vectors of the
+    changed and deleted ones are hidden.
+    """
+
+    def __init__(self, index: VectorIndex, hidden: Optional[np.ndarray] = None,
+                 extra_rows: Optional[np.ndarray] = None, extra_vectors: Optional[np.ndarray] = None):
+        self.index = index
+        self.hidden = hidden
+        self.extra_rows = np.zeros(0, dtype=np.int64) if extra_rows is None else extra_rows
+        self.extra_vectors = np.zeros((0, index.dim), dtype=np.float32) if extra_vectors is None else extra_vectors
+
+    @classmethod
+    def open(cls, catalog: MovieCatalog, directory: Optional[Text] = None) -> "SimilarMovies":
+        """The index saved in `directory` if it matches `catalog`, else one built in memory."""
+        index = VectorIndex.load(directory, fingerprint(catalog)) if directory else None
+        if index is None:
+            start = time.perf_counter()
+            index = VectorIndex.build(catalog)
+            seconds = time.perf_counter() - start
+            if directory and seconds >= SLOW_BUILD_SECONDS:
+                logger.warning(
+                    f"No index of similar movies in {directory} matches the catalog: built it in memory in "
+                    f"{seconds:.1f}s. Build it once with `python -m actions.similarity build`"
+                )
+        similar = cls(index)
+        if catalog.deleted is not None:
+            similar.hidden = np.asarray(catalog.deleted, dtype=bool).copy()
+        return similar
+
+    def vector(self, row: int) -> np.ndarray:
+        i = np.flatnonzero(self.extra_rows == row)
+        if len(i):
+            return self.extra_vectors[i[-1]]
+        return np.asarray(self.index.vectors[row], dtype=np.float32)
+
+    def similar(self, row: int, k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, similarities) of the `k` movies most similar to `row`, best first."""
+        query = self.vector(row)
+        rows, scores = self.index.search(query, k + 1, self.hidden)
+        if len(self.extra_rows):
+            rows = np.concatenate([rows, self.extra_rows])
+            scores = np.concatenate([scores, self.extra_vectors @ query])
+        keep = rows != row
+        rows, scores = rows[keep], scores[keep]
+        best = _top(scores, k)
+        return rows[best], scores[best]
+
+    def patched(self, catalog: MovieCatalog, changed: Sequence[int], deleted: Sequence[int]) -> "SimilarMovies":
+        """The index of `catalog`, in which the `changed` rows (updated or
+        added) were embedded again and the `deleted` ones removed."""
+        base = len(self.index.vectors)
+        hidden = np.zeros(base, dtype=bool) if self.hidden is None else self.hidden.copy()
+        hidden[[row for row in list(changed) + list(deleted) if row < base]] = True
+        touched = set(changed) | set(deleted)
+        keep = np.array([row not in touched for row in self.extra_rows.tolist()], dtype=bool)
+        changed = np.asarray(sorted(set(changed)), dtype=np.int64)
+        return SimilarMovies(
+            self.index, hidden,
+            np.concatenate([self.extra_rows[keep], changed]),
+            np.concatenate([self.extra_vectors[keep], embed(catalog, changed, self.index.idf, self.index.dim)]),
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the index of similar movies.")
+    parser.add_argument("--catalog", default=DATASET_PATH, help="dataset to index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="embed the movies and save the index next to the dataset")
+    build.add_argument("--out", help="index directory (default: MOVIEBOT_SIMILAR or <dataset>.similar)")
+    build.add_argument("--dim", type=int, default=DIM, help="dimension of the vectors")
+    build.add_argument("--exact-limit", type=int, default=EXACT_LIMIT, help="largest catalog searched exactly, without IVF")
+    query = subparsers.add_parser("similar", help="list the movies most similar to a title")
+    query.add_argument("title")
+    query.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    catalog = open_catalog(args.catalog)
+    if args.command == "build":
+        out = args.out or similar_path(args.catalog)
+        index = build_index(catalog, out, args.dim, args.exact_limit)
+        kind = f"IVF, {len(index.offsets) - 1} lists" if index.centroids is not None else "exact"
+        print(f"Index of {len(catalog)} movies ({kind}) written to {out}")
+    else:
+        rows = TitleIndex(catalog.column("Series_Title")).search(args.title)
+        if not len(rows):
+            parser.exit(1, f"No movie matching {args.title!r}\n")
+        similar = SimilarMovies.open(catalog, similar_path(args.catalog))
+        rows, scores = similar.similar(rows[0], args.k)
+        for row, score in zip(rows, scores):
+            print(f"{score:.3f}  {catalog.column('Series_Title')[row]} ({catalog.column('Released_Year')[row]})")
@@ -0,0 +1,92 @@
+# Coalescing of identical concurrent lookups.
+#
+# When a film is trending, many conversations ask about it within the same
+# few milliseconds: each of them misses the response cache (the first answer
+# is not stored yet) and runs the same lookup and fuzzy fallback. With
+# single-flight, the first call of a key computes the answer and the calls
+# of the same key arriving while it runs wait for it and share its result,
+# or its exception. The key is the one of the response cache (the action and
+# its normalized slots, see cache.py), so only actions with `cached_slots`
+# are coalesced.
+#
+# The calls that shared a computation and the time they saved are counted
+# and exposed with the other metrics (see metrics.py).
+#
+#   MOVIEBOT_COALESCE  1 to coalesce identical concurrent lookups (default), 0 not to
+
+import asyncio
+import os
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Text, Tuple
+
+COALESCE = os.environ.get("MOVIEBOT_COALESCE", "1") != "0"
+
+
+class _Flight:
+    """A computation in progress, and when the other calls joined it."""
+
+    def __init__(self, task: "asyncio.Future"):
+        self.task = task
+        self.joined: List[float] = []
+
+
+class SingleFlight:
+    """Runs one computation at a time per key; the other calls of the key
+    made meanwhile get its result."""
+
+    def __init__(self, enabled: bool = COALESCE):
+        self.enabled = enabled
+        # tasks belong to an event loop, so keep the flights of each loop apart
+        self._flights: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, _Flight]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+        # computations run, calls that joined one, and the seconds those calls didn't spend computing
+        self.computed = 0
+        self.coalesced = 0
+        self.saved_seconds = 0.0
+
+    def _landed(self, flights: Dict[Hashable, _Flight], key: Hashable, flight: _Flight) -> None:
+        del flights[key]
+        now = time.perf_counter()
+        with self._lock:
+            self.computed += 1
+            self.coalesced += len(flight.joined)
+            # each call only waited from when it joined
+            self.saved_seconds += sum(now - joined for joined in flight.joined)
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """(result of `compute()`, or of the computation of `key` already in
+        flight; whether it was shared). Its exception is raised to all."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            flights = self._flights.setdefault(loop, {})
+        flight = flights.get(key)
+        shared = flight is not None
+        if shared:
+            flight.joined.append(time.perf_counter())
+        else:
+            flight = flights[key] = _Flight(asyncio.ensure_future(compute()))
+            flight.task.add_done_callback(lambda task: self._landed(flights, key, flight))
+        # a call given up on does not cancel the computation of the others
+        return await asyncio.shield(flight.task), shared
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return sum(len(flights) for flights in self._flights.values())
+
+    def stats(self) -> Dict[Text, Any]:
+        with self._lock:
+            calls = self.computed + self.coalesced
+            return {
+                "computed": self.computed,
+                "coalesced": self.coalesced,
+                "coalesced_rate": self.coalesced / calls if calls else 0.0,
+                "saved_seconds": self.saved_seconds,
+            }
+
+
+# shared by all the actions of the process
+single_flight = SingleFlight()
@@ -0,0 +1,203 @@
+# Snapshot of a catalog generation: the parsed catalog with all its indexes,
+# fuzzy matchers and search structures, saved once so that the action server
+# attaches to it at startup instead of parsing the dataset and building them
+# again.
+#
+# A snapshot is a directory of three files:
+#   meta.json     format, code and library versions, the signature of the
+#                 source it was built from, and the size and CRC-32 of the
+#                 other files
+#   state.pickle  the CatalogGeneration, pickled with protocol 5 and its
+#                 NumPy arrays left out of band
+#   arrays.bin    the bytes of those arrays, each at a 64-byte aligned offset
+#
+# When loading, arrays.bin is memory-mapped and the arrays are rebuilt on
+# top of the mapping without being copied: they are read-only, and their
+# pages are shared by all the processes attached to the snapshot. A
+# snapshot built with other versions (of the libraries, or of the modules of
+# the pickled classes), from another version of the dataset, or whose
+# checksums don't match is ignored, and the catalog is built from its source
+# as usual. The change log of the dataset is applied on top of the snapshot
+# like on top of a catalog built from the source.
+#
+#   python -m actions.snapshot build     # again after each new version of the dataset
+#   python -m actions.snapshot info
+
+import argparse
+import gc
+import json
+import logging
+import mmap
+import os
+import pickle
+import platform
+import zlib
+from typing import Any, Dict, List, Optional, Sequence, Text
+
+import numpy as np
+import pandas as pd
+
+from .catalog import DATASET_PATH, _replace
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+ALIGNMENT = 64
+# smaller arrays stay in the pickle
+OUT_OF_BAND_BYTES = 4096
+CHECKSUM_CHUNK = 1 << 24
+# modules of the pickled classes: a snapshot is only valid with their code
+PICKLED_MODULES = ["catalog", "indexes", "fuzzy_matcher", "manager", "search", "similarity", "aggregates"]
+
+
+def snapshot_path(dataset_path: Text = DATASET_PATH) -> Text:
+    """The snapshot of a dataset: imdb_top_1000.csv -> imdb_top_1000.snapshot"""
+    return os.environ.get("MOVIEBOT_SNAPSHOT", os.path.splitext(dataset_path.rstrip(os.sep))[0] + ".snapshot")
+
+
+def _code_checksum() -> int:
+    checksum = 0
+    for module in PICKLED_MODULES:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module + ".py"), "rb") as f:
+            checksum = zlib.crc32(f.read(), checksum)
+    return checksum
+
+
+def _versions() -> Dict[Text, Any]:
+    # pickles of NumPy and pandas objects are only guaranteed to load with the same versions
+    return {
+        "format": VERSION,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "code": _code_checksum(),
+    }
+
+
+def _crc32(data, checksum: int = 0) -> int:
+    view = memoryview(data).cast("B")
+    for start in range(0, len(view), CHECKSUM_CHUNK):
+        checksum = zlib.crc32(view[start:start + CHECKSUM_CHUNK], checksum)
+    return checksum
+
+
+def write_snapshot(generation, directory: Text, signature: Optional[Sequence[int]]) -> Dict[Text, Any]:
+    """Save `generation`, built from a source with the given signature
+    (see manager.source_signature), into `directory`."""
+    os.makedirs(directory, exist_ok=True)
+    buffers: List[pickle.PickleBuffer] = []
+
+    def out_of_band(buffer: pickle.PickleBuffer) -> bool:
+        if buffer.raw().nbytes < OUT_OF_BAND_BYTES:
+            return True
+        buffers.append(buffer)
+        return False
+
+    state = pickle.dumps(generation, protocol=5, buffer_callback=out_of_band)
+
+    layout = []
+    checksum = 0
+
+    def write_arrays(f) -> None:
+        nonlocal checksum
+        offset = 0
+        for buffer in buffers:
+            data = buffer.raw()
+            padding = -offset % ALIGNMENT
+            f.write(b"\0" * padding)
+            checksum = zlib.crc32(b"\0" * padding, checksum)
+            offset += padding
+            f.write(data)
+            checksum = _crc32(data, checksum)
+            layout.append([offset, data.nbytes])
+            offset += data.nbytes
+
+    _replace(os.path.join(directory, "arrays.bin"), write_arrays)
+    _replace(os.path.join(directory, "state.pickle"), lambda f: f.write(state))
+    meta = {
+        **_versions(),
+        "source": generation.source,
+        "signature": list(signature) if signature is not None else None,
+        "movies": len(generation.catalog),
+        "state": {"size": len(state), "crc32": _crc32(state)},
+        "arrays": {"size": layout[-1][0] + layout[-1][1] if layout else 0, "crc32": checksum, "layout": layout},
+    }
+    # written last: a snapshot is only complete once its meta.json is
+    _replace(os.path.join(directory, "meta.json"), lambda f: f.write(json.dumps(meta, indent=2).encode("utf-8")))
+    return meta
+
+
+def read_meta(directory: Text) -> Optional[Dict[Text, Any]]:
+    try:
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_snapshot(directory: Text, signature: Optional[Sequence[int]] = None):
+    """The CatalogGeneration saved in `directory`, its arrays memory-mapped;
+    None if there is no usable snapshot there (built from a source with
+    another signature, if one is given)."""
+    meta = read_meta(directory)
+    if meta is None:
+        return None
+    built_with = {key: meta.get(key) for key in _versions()}
+    if built_with != _versions():
+        logger.warning(f"Snapshot {directory} was built with other versions ({built_with}), ignoring it")
+        return None
+    if signature is not None and meta.get("signature") != list(signature):
+        logger.info(f"Snapshot {directory} was built from another version of {meta.get('source')}, ignoring it")
+        return None
+
+    with open(os.path.join(directory, "state.pickle"), "rb") as f:
+        state = f.read()
+    arrays = meta["arrays"]
+    mapped = b""
+    if arrays["size"]:
+        with open(os.path.join(directory, "arrays.bin"), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if (len(state), _crc32(state)) != (meta["state"]["size"], meta["state"]["crc32"]) \
+            or (len(mapped), _crc32(mapped)) != (arrays["size"], arrays["crc32"]):
+        logger.warning(f"Snapshot {directory} is corrupted (checksum mismatch), ignoring it")
+        return None
+
+    view = memoryview(mapped)
+    # millions of containers are created at once: don't let the collector scan them over and over
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        return pickle.loads(state, buffers=[view[offset:offset + size] for offset, size in arrays["layout"]])
+    finally:
+        if collecting:
+            gc.enable()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect the snapshot of the movie catalog.")
+    parser.add_argument("--catalog", default=DATASET_PATH, help="dataset of the snapshot")
+    parser.add_argument("--out", help="snapshot directory (default: MOVIEBOT_SNAPSHOT or <dataset>.snapshot)")
+    parser.add_argument("command", choices=["build", "info"])
+    args = parser.parse_args()
+    out = args.out or snapshot_path(args.catalog)
+
+    if args.command == "build":
+        import time
+
+        from .catalog import open_catalog
+        from .manager import CatalogGeneration, source_signature
+
+        start = time.perf_counter()
+        signature = source_signature(args.catalog)
+        generation = CatalogGeneration(open_catalog(args.catalog), source=args.catalog)
+        # built on first use otherwise: include it
+        generation.similar
+        meta = write_snapshot(generation, out, signature)
+        print(f"Snapshot of {meta['movies']} movies written to {out} in {time.perf_counter() - start:.1f}s "
+              f"({(meta['state']['size'] + meta['arrays']['size']) / 2 ** 20:.1f} MiB)")
+    else:
+        meta = read_meta(out)
+        if meta is None:
+            parser.exit(1, f"No snapshot in {out}\n")
+        meta["arrays"] = {key: value for key, value in meta["arrays"].items() if key != "layout"}
+        print(json.dumps(meta, indent=2))
@@ -0,0 +1,326 @@
+# Incremental updates of the movie catalog.
+#
+# Changes to the dataset are appended to a change log next to it (JSON
+# lines, MOVIEBOT_CHANGES to use another file), one record per change:
+#
+#   {"op": "upsert", "movie": {"Series_Title": "Dune", "Released_Year": "2021", "No_of_Votes": "712345"}}
+#   {"op": "delete", "Series_Title": "Dune", "Released_Year": "1984"}
+#
+# A movie is identified by its title and release year. An upsert sets the
+# given fields (in the format of the CSV) of the movie, which is added if it
+# is not in the catalog; a delete removes it. The catalog manager follows
+# the log: each new batch of records is applied to the current generation
+# with apply_changes, which patches the catalog, the title, person, rank and
+# genre indexes, the fuzzy matchers, the aggregates, the full-text search
+# and the index of similar movies (if it was built) instead of rebuilding
+# them. Only the changed rows are decoded, parsed and indexed again, and
+# only the postings and groups they belong to are updated; the rest of each
+# structure is shared with the previous generation (a dict through a layer
+# of the changed keys) or copied as a whole array or list. Deleted rows keep
+# their id and are flagged in the catalog.
+#
+#   python -m actions.updates upsert new_releases.csv    # rows in the CSV format
+#   python -m actions.updates delete "Dune" 1984
+#   python -m actions.updates compact                    # write the log into the CSV
+#
+# Only the in-memory (CSV) catalog can be patched; rebuild a columnar
+# catalog with `python -m actions.catalog build` instead.
+
+import argparse
+import copy
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Text, Tuple
+
+import pandas as pd
+
+from .catalog import CSV_PATH, DATASET_PATH, RAW_COLUMNS, DataFrameCatalog, parse_movies, read_dataset
+from .indexes import RankIndex, normalize
+from .similarity import SIMILAR_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+STAR_COLUMNS = ["Star1", "Star2", "Star3", "Star4"]
+# grouping and measured columns of the aggregates
+AGGREGATE_COLUMNS = ["Director", "Genre", "Released_Year", "IMDB_Rating", "Gross", "No_of_Votes"] + STAR_COLUMNS
+
+MovieKey = Tuple[Text, int]
+
+
+def changes_path(dataset_path: Text = DATASET_PATH) -> Text:
+    """The change log of a dataset: imdb_top_1000.csv -> imdb_top_1000.changes.jsonl"""
+    return os.environ.get("MOVIEBOT_CHANGES", os.path.splitext(dataset_path.rstrip(os.sep))[0] + ".changes.jsonl")
+
+
+def _year(value: Any) -> int:
+    # same as the parsing of Released_Year: 0 when not a number
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def movie_key(title: Any, year: Any) -> MovieKey:
+    return str(title), _year(year)
+
+
+def record_key(record: Dict[Text, Any]) -> MovieKey:
+    fields = record["movie"] if record.get("op") == "upsert" else record
+    if "Series_Title" not in fields:
+        raise ValueError(f"Change without Series_Title: {record!r}")
+    return movie_key(fields["Series_Title"], fields.get("Released_Year"))
+
+
+def append_changes(path: Text, records: Iterable[Dict[Text, Any]]) -> int:
+    """Append `records` to the change log at `path`, in a single write."""
+    lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+    return lines.count("\n")
+
+
+def read_changes(path: Text, offset: int = 0) -> Tuple[List[Dict[Text, Any]], int]:
+    """The complete records written to the log after byte `offset`, and the
+    offset of the first record not read yet."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0
+    end = data.rfind(b"\n") + 1
+    records = []
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            logger.warning(f"Skipping an invalid line of {path}: {line[:80]!r}")
+    return records, offset + end
+
+
+def plan_changes(records: Iterable[Dict[Text, Any]]) -> Dict[MovieKey, Tuple[bool, Optional[Dict[Text, Any]]]]:
+    """Fold `records` into, for each movie, (delete the current row?,
+    fields of the row to write, if any)."""
+    plan: Dict[MovieKey, Tuple[bool, Optional[Dict[Text, Any]]]] = {}
+    for record in records:
+        key = record_key(record)
+        delete, fields = plan.get(key, (False, None))
+        if record.get("op") == "upsert":
+            plan[key] = (delete, {**(fields or {}), **record["movie"]})
+        elif record.get("op") == "delete":
+            plan[key] = (True, None)
+        else:
+            raise ValueError(f"Unknown change: {record!r}")
+    return plan
+
+
+def catalog_changes(
+    catalog: DataFrameCatalog, records: Iterable[Dict[Text, Any]], find: Optional[Callable[[MovieKey], Optional[int]]] = None
+) -> Optional[Tuple[Dict[int, Dict[Text, Any]], pd.DataFrame, List[int]]]:
+    """The changes `records` make to `catalog`, as the arguments of its
+    `patched`: ({row: {column: parsed value}}, parsed rows to append, rows to
+    delete). None if nothing changes. `find` gives the row of a movie, None
+    if it is not in the catalog (default: a dict of all the live rows)."""
+    if find is None:
+        live: Dict[MovieKey, int] = {}
+        for row, (title, year) in enumerate(zip(catalog.column("Series_Title"), catalog.column("Released_Year"))):
+            if catalog.deleted is None or not catalog.deleted[row]:
+                live.setdefault(movie_key(title, year), row)
+        find = live.get
+
+    deletes: List[int] = []
+    updated: Dict[int, Dict[Text, Any]] = {}
+    inserted: List[Dict[Text, Any]] = []
+    for key, (delete, fields) in plan_changes(records).items():
+        row = find(key)
+        if row is not None and delete:
+            deletes.append(row)
+            row = None
+        if fields is None:
+            continue
+        if row is None:
+            inserted.append(fields)
+        else:
+            updated[row] = fields
+    if not (deletes or updated or inserted):
+        return None
+
+    def raw(movies: List[Dict[Text, Any]]) -> pd.DataFrame:
+        # as read from the CSV, where an empty field is missing
+        frame = pd.DataFrame(movies, columns=RAW_COLUMNS)
+        return frame.mask(frame.eq(""))
+
+    # parse the new values like the CSV, but only set the fields given
+    updates: Dict[int, Dict[Text, Any]] = {}
+    if updated:
+        parsed = parse_movies(raw(list(updated.values())))
+        for (row, fields), (_, values) in zip(updated.items(), parsed.iterrows()):
+            given = [column for column in RAW_COLUMNS if column in fields]
+            if "Genre" in fields:
+                given += ["Genres", "Genre_Mask"]
+            updates[row] = {column: values[column] for column in given}
+    inserts = parse_movies(raw(inserted))
+    return updates, inserts, deletes
+
+
+def patch_catalog(catalog: DataFrameCatalog, records: Iterable[Dict[Text, Any]]) -> DataFrameCatalog:
+    """`catalog` with `records` applied, without the indexes of a
+    generation (e.g. for the gazetteer)."""
+    changes = catalog_changes(catalog, records)
+    return catalog if changes is None else catalog.patched(*changes)
+
+
+def apply_changes(generation, records: Iterable[Dict[Text, Any]]):
+    """A new CatalogGeneration with `records` applied to `generation`, which
+    is left untouched for its current readers. None if nothing changed."""
+    catalog = generation.catalog
+    if not isinstance(catalog, DataFrameCatalog):
+        raise TypeError(f"{type(catalog).__name__} can't be patched, rebuild it from the updated CSV")
+
+    titles = catalog.column("Series_Title")
+    years = catalog.column("Released_Year")
+
+    def find(key: MovieKey) -> Optional[int]:
+        for row in generation.title_index.lookup(key[0]):
+            if titles[row] == key[0] and years[row] == key[1]:
+                return row
+        return None
+
+    changes = catalog_changes(catalog, records, find)
+    if changes is None:
+        return None
+    updates, inserts, deletes = changes
+    new_rows = list(range(len(catalog), len(catalog) + len(inserts)))
+
+    patched = copy.copy(generation)
+    patched.catalog = catalog.patched(updates, inserts, deletes)
+
+    def changed(columns: Iterable[Text]) -> List[int]:
+        return [row for row, fields in updates.items() if any(column in fields for column in columns)] + new_rows
+
+    # a structure built from none of the changed columns is shared as it is
+    new_titles = patched.catalog.column("Series_Title")
+    title_rows = changed(["Series_Title"])
+    if title_rows or deletes:
+        patched.title_index = generation.title_index.patched(
+            {**{row: new_titles[row] for row in title_rows}, **{row: None for row in deletes}}
+        )
+        gone_titles = {
+            titles[row] for row in deletes + title_rows if row < len(titles)
+            and not any(patched.title_index.titles[other] == titles[row]
+                        for other in patched.title_index.lookup(titles[row]))
+        }
+        patched.title_matcher = generation.title_matcher.patched([new_titles[row] for row in title_rows], gone_titles)
+
+    for role, columns in (("director", ["Director"]), ("actor", STAR_COLUMNS)):
+        index = getattr(generation, f"{role}_index")
+        rows = changed(columns)
+        if not (rows or deletes):
+            continue
+        values = [patched.catalog.column(column, rows) for column in columns]
+        people = {row: list(names) for row, names in zip(rows, zip(*values))}
+        new_index = index.patched({**people, **{row: [] for row in deletes}})
+        before = {name for row in rows + deletes if row < len(index.row_people) for name in index.row_people[row]}
+        added = [name for name in dict.fromkeys(n for names in people.values() for n in names)
+                 if isinstance(name, str) and name and name not in index.surname_of]
+        removed = [name for name in before if name not in new_index.surname_of]
+        removed_surnames = {
+            name.split()[-1] for name in removed if len(name.split()) > 1
+            and not any(other.split()[-1] == name.split()[-1]
+                        for other in new_index.by_surname.get(normalize(name.split()[-1]), []))
+        }
+        setattr(patched, f"{role}_index", new_index)
+        setattr(patched, f"{role}_matcher",
+                getattr(generation, f"{role}_matcher").patched(added, removed, removed_surnames))
+
+    rows = changed(RankIndex.COLUMNS)
+    if rows or deletes:
+        patched.rank_index = generation.rank_index.patched(patched.catalog, rows, deletes)
+    rows = changed(["Genre"])
+    if rows or deletes:
+        patched.genre_index = generation.genre_index.patched(patched.catalog, rows, deletes)
+    rows = changed(AGGREGATE_COLUMNS)
+    if rows or deletes:
+        patched.aggregates = generation.aggregates.patched(catalog, patched.catalog, rows, deletes)
+    rows = changed(["Series_Title", "Overview"])
+    if rows or deletes:
+        patched.text_search = generation.text_search.patched(patched.catalog, rows, deletes)
+    # an index not built yet will be built from the patched catalog
+    patched._similar_lock = threading.Lock()
+    rows = changed(SIMILAR_COLUMNS)
+    if generation._similar is not None and (rows or deletes):
+        patched._similar = generation._similar.patched(patched.catalog, rows, deletes)
+    return patched
+
+
+def _line_terminator(path: Text) -> Text:
+    with open(path, "rb") as f:
+        return "\r\n" if f.readline().endswith(b"\r\n") else "\n"
+
+
+def compact(csv_path: Text = CSV_PATH, log_path: Optional[Text] = None) -> int:
+    """Write the changes of the log into the CSV and empty the log. Returns
+    the number of records written."""
+    log_path = log_path or changes_path(csv_path)
+    records, _ = read_changes(log_path)
+    if not records:
+        return 0
+
+    raw = read_dataset(csv_path, dtype=str, keep_default_na=False)
+    movies = raw.to_dict("records")
+    rows = {movie_key(movie["Series_Title"], movie["Released_Year"]): i for i, movie in enumerate(movies)}
+    deleted = set()
+    for key, (delete, fields) in plan_changes(records).items():
+        row = rows.get(key)
+        if row is not None and delete:
+            deleted.add(row)
+            row = None
+        if fields is None:
+            continue
+        fields = {column: "" if value is None else str(value) for column, value in fields.items() if column in raw}
+        if row is None:
+            movies.append({**{column: "" for column in raw.columns}, **fields})
+        else:
+            movies[row].update(fields)
+    movies = [movie for i, movie in enumerate(movies) if i not in deleted]
+
+    # replaced, not rewritten, so a reader never sees half a file
+    tmp = csv_path + ".tmp"
+    pd.DataFrame(movies, columns=raw.columns).to_csv(tmp, index=False, lineterminator=_line_terminator(csv_path))
+    os.replace(tmp, csv_path)
+    open(log_path + ".tmp", "w").close()
+    os.replace(log_path + ".tmp", log_path)
+    return len(records)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add changes to the movie catalog.")
+    parser.add_argument("--catalog", default=DATASET_PATH, help="dataset the changes apply to")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    upsert = subparsers.add_parser("upsert", help="add or update the movies of a CSV file (same columns as the dataset, all optional but Series_Title and Released_Year)")
+    upsert.add_argument("csv")
+    delete = subparsers.add_parser("delete", help="remove a movie")
+    delete.add_argument("title")
+    delete.add_argument("year")
+    subparsers.add_parser("compact", help="write the logged changes into the CSV dataset and empty the log")
+    args = parser.parse_args()
+
+    log = changes_path(args.catalog)
+    if args.command == "upsert":
+        movies = read_dataset(args.csv, dtype=str, keep_default_na=False).to_dict("records")
+        count = append_changes(log, [
+            {"op": "upsert", "movie": {column: value for column, value in movie.items() if value != ""}}
+            for movie in movies
+        ])
+        print(f"{count} changes added to {log}")
+    elif args.command == "delete":
+        append_changes(log, [{"op": "delete", "Series_Title": args.title, "Released_Year": args.year}])
+        print(f"Deletion added to {log}")
+    else:
+        print(f"{compact(args.catalog, log)} changes written to {args.catalog}")
@@ -0,0 +1,246 @@
+# Benchmark of the custom actions on synthetic catalogs of growing size.
+#
+#   python benchmarks/bench_actions.py                      # 1k, 10k, 100k and 1M rows
+#   python benchmarks/bench_actions.py --sizes 1000,10000 --repeat 50 --json bench.json
+#
+# For every size a catalog with the schema of Dataset/imdb_top_1000.csv is
+# generated, then a fresh Python process imports actions/actions.py on it
+# and calls every Action.run and every FormValidationAction validator with
+# a stub Tracker and a CollectingDispatcher, using exact, misspelled,
+# surname-only and ambiguous inputs. The report gives, per action, latency
+# percentiles, throughput and the peak memory allocated during the calls,
+# plus the import time and the RSS of the process.
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Text
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+CSV_PATH = os.path.join(PROJECT_ROOT, "Dataset", "imdb_top_1000.csv")
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+
+def synthetic_catalog(size: int, seed: int = 0) -> pd.DataFrame:
+    """A catalog of `size` rows with the schema and value ranges of the
+    real dataset. The first 1000 rows are the real ones; the others reuse
+    their texts with numbered titles ("Inception 2") and people recombined
+    from the real first names and surnames, so that the number of distinct
+    titles and people grows with the catalog."""
+    rng = np.random.default_rng(seed)
+    base = pd.read_csv(CSV_PATH)
+    movies_df = base.iloc[np.arange(size) % len(base)].reset_index(drop=True)
+    extra = np.arange(size) >= len(base)
+    n_extra = int(extra.sum())
+    if not n_extra:
+        return movies_df
+
+    copy = (np.arange(size)[extra] // len(base) + 1).astype(str)
+    movies_df.loc[extra, "Series_Title"] = movies_df.loc[extra, "Series_Title"] + " " + copy
+
+    people = pd.concat([base[c] for c in ["Director", "Star1", "Star2", "Star3", "Star4"]]).dropna()
+    first_names = people.str.split().str[0].unique()
+    surnames = people.str.split().str[-1].unique()
+    for column in ["Director", "Star1", "Star2", "Star3", "Star4"]:
+        movies_df.loc[extra, column] = (
+            rng.choice(first_names, n_extra).astype(object) + " " + rng.choice(surnames, n_extra).astype(object)
+        )
+
+    movies_df.loc[extra, "Released_Year"] = rng.integers(1920, 2021, n_extra).astype(str)
+    movies_df.loc[extra, "IMDB_Rating"] = np.round(rng.uniform(7.6, 9.3, n_extra), 1)
+    movies_df.loc[extra, "No_of_Votes"] = rng.integers(25000, 2400000, n_extra)
+    gross = rng.integers(1000, 900000000, n_extra).astype(object)
+    gross[rng.random(n_extra) < 0.17] = np.nan
+    movies_df.loc[extra, "Gross"] = [f"{g:,}" if isinstance(g, int) else g for g in gross]
+    return movies_df
+
+
+def typo(text: Text, rng: random.Random) -> Text:
+    """Swap two adjacent letters."""
+    if len(text) < 4:
+        return text + text[-1]
+    i = rng.randrange(1, len(text) - 2)
+    return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+
+def cases(movies_df: pd.DataFrame, seed: int = 0) -> Dict[Text, List[Dict[Text, Any]]]:
+    """Slot values to call each action with."""
+    rng = random.Random(seed)
+    title = movies_df["Series_Title"].iloc[rng.randrange(len(movies_df))]
+    director = movies_df["Director"].iloc[rng.randrange(len(movies_df))]
+    actor = movies_df["Star1"].iloc[rng.randrange(len(movies_df))]
+    surnames = pd.concat([movies_df["Star1"], movies_df["Star2"]]).dropna().drop_duplicates().str.split().str[-1]
+    ambiguous = surnames[surnames.duplicated()].iloc[0] if surnames.duplicated().any() else actor.split()[-1]
+
+    movie_slots = [{"movie": title}, {"movie": typo(title, rng)}, {"movie": title.split()[-1]}, {"movie": "zzqx"}]
+    director_slots = [director, typo(director, rng), director.split()[-1], "Anderson"]
+    actor_slots = [actor, typo(actor, rng), actor.split()[-1], ambiguous]
+
+    return {
+        "action_list_top_movies": [{}],
+        "action_ask_director": movie_slots,
+        "action_ask_genre": movie_slots,
+        "action_ask_movie_info": movie_slots,
+        "action_similar_movies": movie_slots,
+        "action_search_plot": [{"plot": " ".join(str(movies_df["Overview"].iloc[0]).split()[:4])}, {"plot": "zzqx"}],
+        "action_movies_by_director": [{"director": d} for d in director_slots],
+        "action_movies_by_actor": [{"actor": a} for a in actor_slots],
+        "action_count_films": [{"form_author": d} for d in director_slots]
+        + [{"form_author": director, "form_quality": 8.0}],
+        "action_provide_movie_recommendation": [
+            {"min_release_year": 2000.0, "form_genre": ["drama"], "form_quality": 8.0},
+            {"min_release_year": 1980.0, "form_genre": ["crime", "drama"], "form_quality": 7.5},
+        ],
+        "action_gross_votes_recommendation": [
+            {"form_votes": 100000.0, "form_gross": 1000000.0},
+            {"form_votes": 1000000.0, "form_gross": 100000000.0},
+        ],
+        "validate_film_count_form": [
+            {"form_author": director, "form_quality": "8,5"},
+            {"form_author": "R2D2", "form_quality": "11"},
+        ],
+        "validate_movie_recommendation_form": [
+            {"min_release_year": 2000.0, "form_genre": "drama, crime", "form_quality": "7.5"},
+            {"min_release_year": 2000.0, "form_genre": ["drama", "cartoon"], "form_quality": "x"},
+        ],
+        "validate_gross_votes_recommendation_form": [
+            {"form_votes": "250000", "form_gross": 1000000.0},
+            {"form_votes": "-3", "form_gross": 1000000.0},
+        ],
+    }
+
+
+def stub_tracker(slots: Dict[Text, Any]):
+    from rasa_sdk import Tracker
+
+    return Tracker("bench", dict(slots), {}, [], False, None, {}, None)
+
+
+def calls(module, slot_cases: Dict[Text, List[Dict[Text, Any]]]):
+    """(name, zero-argument callable) for every action and validator."""
+    from rasa_sdk import Action
+    from rasa_sdk.executor import CollectingDispatcher
+    from rasa_sdk.forms import FormValidationAction
+
+    for _, cls in inspect.getmembers(module, inspect.isclass):
+        if cls.__module__ != module.__name__ or not issubclass(cls, Action):
+            continue
+        action = cls()
+        name = action.name()
+        for slots in slot_cases.get(name, [{}]):
+            if issubclass(cls, FormValidationAction):
+                for method, _ in inspect.getmembers(cls, inspect.iscoroutinefunction):
+                    if not method.startswith("validate_"):
+                        continue
+                    slot = method[len("validate_"):]
+                    yield f"{name}.{method}", (
+                        lambda action=action, method=method, slots=slots, slot=slot:
+                        getattr(action, method)(slots.get(slot), CollectingDispatcher(), stub_tracker(slots), {})
+                    )
+            else:
+                yield name, (
+                    lambda action=action, slots=slots: action.run(CollectingDispatcher(), stub_tracker(slots), {})
+                )
+
+
+def worker(csv_path: Text, repeat: int) -> Dict[Text, Any]:
+    """Import the actions on `csv_path` and time every call."""
+    os.environ["MOVIEBOT_CATALOG"] = csv_path
+    # time the lookups themselves, not the response cache (unless asked to)
+    os.environ.setdefault("MOVIEBOT_CACHE_SIZE", "0")
+    os.environ.setdefault("MOVIEBOT_METRICS_PORT", "0")
+    start = time.perf_counter()
+    from actions import actions as module
+
+    import_seconds = time.perf_counter() - start
+    slot_cases = cases(pd.read_csv(csv_path, usecols=["Series_Title", "Director", "Star1", "Star2", "Overview"]))
+    loop = asyncio.new_event_loop()
+
+    timings: Dict[Text, List[float]] = {}
+    peaks: Dict[Text, int] = {}
+    for name, call in calls(module, slot_cases):
+        tracemalloc.start()
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            result = call()
+            if inspect.isawaitable(result):
+                loop.run_until_complete(result)
+            timings.setdefault(name, []).append(time.perf_counter() - t0)
+        peaks[name] = max(peaks.get(name, 0), tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    report = {}
+    for name, samples in timings.items():
+        ms = np.array(samples) * 1000
+        report[name] = {
+            "calls": len(ms),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p90_ms": float(np.percentile(ms, 90)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max()),
+            "throughput_per_s": float(len(ms) / (ms.sum() / 1000)) if ms.sum() else float("inf"),
+            "peak_kib": peaks[name] / 1024,
+        }
+    return {
+        "import_s": import_seconds,
+        "max_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "actions": report,
+    }
+
+
+def print_report(size: int, result: Dict[Text, Any]) -> None:
+    print(f"\n=== {size:,} movies: import {result['import_s']:.2f}s, max RSS {result['max_rss_mib']:.0f} MiB ===")
+    print(f"{'action':<62}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}{'calls/s':>10}{'peak KiB':>10}")
+    for name, stats in sorted(result["actions"].items()):
+        print(
+            f"{name:<62}{stats['p50_ms']:>9.2f}{stats['p90_ms']:>9.2f}{stats['p99_ms']:>9.2f}"
+            f"{stats['max_ms']:>9.2f}{stats['throughput_per_s']:>10.0f}{stats['peak_kib']:>10.0f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the custom actions on synthetic catalogs.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="comma separated catalog sizes")
+    parser.add_argument("--repeat", type=int, default=20, help="calls per action and input")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        json.dump(worker(args.worker, args.repeat), sys.stdout)
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in [int(s) for s in args.sizes.split(",")]:
+            csv_path = os.path.join(tmp, f"movies_{size}.csv")
+            synthetic_catalog(size).to_csv(csv_path, index=False)
+            # one process per size, so import time and RSS are not shared
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", csv_path, "--repeat", str(args.repeat)],
+                check=True, stdout=subprocess.PIPE, cwd=PROJECT_ROOT,
+            ).stdout
+            results[size] = json.loads(output)
+            print_report(size, results[size])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# NLU entity extractor tagging the movies, directors and actors of the
+# catalog in the user messages (see actions/gazetteer.py).
+#
+# The names come from the dataset the action server reads, not from the
+# training data, so a new release is recognized without retraining: the
+# compiled automaton is reloaded when the dataset or its change log
+# changes. It runs after DIETClassifier and replaces the entities of the
+# same types that DIET extracted over the same words, since a misspelled or
+# cut entity sends the actions to the fuzzy fallback.
+
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Text
+
+from rasa.engine.graph import ExecutionContext, GraphComponent
+from rasa.engine.recipes.default_recipe import DefaultV1Recipe
+from rasa.engine.storage.resource import Resource
+from rasa.engine.storage.storage import ModelStorage
+from rasa.nlu.extractors.extractor import EntityExtractorMixin
+from rasa.shared.nlu.constants import ENTITIES, TEXT
+from rasa.shared.nlu.training_data.message import Message
+
+from actions.catalog import DATASET_PATH
+from actions.gazetteer import ENTITY_COLUMNS, Gazetteer, gazetteer_signature, open_gazetteer
+from actions.manager import RELOAD_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+@DefaultV1Recipe.register([DefaultV1Recipe.ComponentType.ENTITY_EXTRACTOR], is_trainable=False)
+class CatalogGazetteer(GraphComponent, EntityExtractorMixin):
+    """Tags the names of the catalog in the messages."""
+
+    @staticmethod
+    def get_default_config() -> Dict[Text, Any]:
+        return {
+            # dataset and automaton directory (default: MOVIEBOT_CATALOG, MOVIEBOT_GAZETTEER)
+            "catalog": None,
+            "directory": None,
+            "entities": list(ENTITY_COLUMNS),
+            # seconds between two checks of the dataset and its change log (0: never)
+            "reload_interval": RELOAD_INTERVAL,
+        }
+
+    def __init__(self, config: Dict[Text, Any]) -> None:
+        self.catalog = config["catalog"] or DATASET_PATH
+        self.directory = config["directory"]
+        self.entities = set(config["entities"])
+        self.reload_interval = config["reload_interval"]
+        self._signature = gazetteer_signature(self.catalog)
+        self._gazetteer: Gazetteer = open_gazetteer(self.catalog, self.directory)
+        self._checked = time.monotonic()
+        self._reloading: Optional[threading.Thread] = None
+
+    @classmethod
+    def create(
+        cls,
+        config: Dict[Text, Any],
+        model_storage: ModelStorage,
+        resource: Resource,
+        execution_context: ExecutionContext,
+    ) -> "CatalogGazetteer":
+        return cls(config)
+
+    def _reload(self, signature) -> None:
+        try:
+            self._gazetteer = open_gazetteer(self.catalog, self.directory)
+        except Exception:
+            logger.exception(f"Could not compile the gazetteer of {self.catalog}, keeping the previous one")
+        self._signature = signature
+
+    def _check(self) -> None:
+        """Recompile the gazetteer in the background if the dataset or its
+        change log changed."""
+        now = time.monotonic()
+        if self.reload_interval <= 0 or now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+        signature = gazetteer_signature(self.catalog)
+        if signature is None or signature == self._signature:
+            return
+        if self._reloading is None or not self._reloading.is_alive():
+            self._reloading = threading.Thread(target=self._reload, args=(signature,), daemon=True)
+            self._reloading.start()
+
+    def process(self, messages: List[Message]) -> List[Message]:
+        self._check()
+        gazetteer = self._gazetteer
+        for message in messages:
+            text = message.get(TEXT)
+            if not text:
+                continue
+            tagged = gazetteer.tag(text, self.entities)
+            if not tagged:
+                continue
+            kept = [
+                entity for entity in message.get(ENTITIES, [])
+                if entity.get("entity") not in self.entities or not any(
+                    entity["start"] < other["end"] and other["start"] < entity["end"] for other in tagged
+                )
+            ]
+            found = [{**entity, "confidence_entity": 1.0} for entity in tagged]
+            message.set(ENTITIES, self.add_extractor_name(found) + kept, add_to_output=True)
+        return messages
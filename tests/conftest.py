@@ -0,0 +1,31 @@
+# Fixtures of the unit tests, run from the root of the repository:
+#
+#   python -m pytest tests
+
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the dataset the bot ships with
+SAMPLE_PATH = os.path.join(ROOT, "Dataset", "imdb_top_1000.csv")
+
+
+@pytest.fixture
+def dataset(tmp_path) -> str:
+    """A copy of the sample dataset, which the test may change."""
+    path = str(tmp_path / "movies.csv")
+    shutil.copy(SAMPLE_PATH, path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def sample_catalog():
+    """The catalog of the sample dataset, which the tests must not change."""
+    from actions.catalog import open_catalog
+
+    return open_catalog(SAMPLE_PATH)
@@ -0,0 +1,46 @@
+import pytest
+
+from actions.batch import _Taken, run_batch, run_each
+from actions.manager import CatalogGeneration
+
+REQUESTS = [
+    {"action": "action_ask_movie_info", "query": "Inception"},
+    {"action": "action_ask_movie_info", "query": "Incepton"},
+    {"action": "action_ask_movie_info", "query": "INCEPTION"},
+    {"action": "action_ask_movie_info", "query": "the"},
+    {"action": "action_ask_movie_info", "query": "zz"},
+    {"action": "action_movies_by_actor", "query": "Michael Caine"},
+    {"action": "action_movies_by_actor", "query": "Cain"},
+    {"action": "action_movies_by_director", "query": "Nolan"},
+    {"action": "action_movies_by_director", "query": "Cristopher Nolan"},
+    {"action": "action_movies_by_director", "query": "Nolan"},
+    {"action": "action_count_films", "query": "Nolan", "slots": {"form_quality": "8"}},
+    {"action": "action_count_films", "query": "Christopher Nolan", "slots": {"form_quality": "8.5"}},
+]
+
+
+@pytest.fixture(scope="module")
+def generation(sample_catalog):
+    return CatalogGeneration(sample_catalog)
+
+
+def test_batch_answers_as_one_call_per_query(generation):
+    results = run_batch(REQUESTS, generation)
+    expected = run_each(REQUESTS, generation)
+    for result, other in zip(results, expected):
+        assert (result["messages"], result["events"]) == (other["messages"], other["events"]), result["query"]
+    assert results[1]["correction"]["name"] == "Inception" and results[1]["correction"]["accepted"]
+    assert results[1]["titles"] == ["Inception"] and results[2]["titles"] == ["Inception"]
+
+
+def test_unknown_action(generation):
+    with pytest.raises(ValueError):
+        run_batch([{"action": "action_greet", "query": "hi"}], generation)
+
+
+def test_taken_frames_are_copies(sample_catalog):
+    catalog = _Taken(sample_catalog)
+    frame = catalog.take([3, 1])
+    frame.loc[3, "Series_Title"] = "changed"
+    assert catalog.take([3, 1]).equals(sample_catalog.take([3, 1]))
+    assert catalog.take([]).equals(sample_catalog.take([])) and len(catalog) == len(sample_catalog)
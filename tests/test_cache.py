@@ -0,0 +1,25 @@
+from actions.cache import ResponseCache, slot_key
+
+
+def test_slot_key_ignores_case_accents_and_spacing():
+    assert slot_key("  Amélie ") == slot_key("amelie") == "amelie"
+    assert slot_key(["The  Matrix", None]) == ("the matrix", None)
+    assert slot_key(8.5) == 8.5
+
+
+def test_slot_key_of_unhashable_values():
+    entity = {"value": "Nolan", "role": "director", "group": None}
+    key = slot_key(entity)
+    assert hash(key) == hash(slot_key({"group": None, "role": "director", "value": "Nolan"}))
+    assert slot_key([entity, {"value": "Caine"}]) != slot_key([entity])
+    assert hash(ResponseCache.key("action_movies_by_director", [entity, [entity], {1, 2}]))
+
+
+def test_response_cache():
+    cache = ResponseCache(maxsize=2, ttl=60)
+    key = ResponseCache.key("action_ask_movie_info", ["Inception"])
+    assert cache.get(key) is None
+    cache.put(key, [{"text": "Inception (2010)"}], [], cache.generation)
+    assert cache.get(ResponseCache.key("action_ask_movie_info", ["  inception"])) == ([{"text": "Inception (2010)"}], [])
+    cache.invalidate()
+    assert cache.get(key) is None
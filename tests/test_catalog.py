@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from actions.catalog import COLUMNS, ColumnarCatalog, DataFrameCatalog, build_columnar, open_catalog
+from conftest import SAMPLE_PATH
+
+# rows with missing texts (Certificate, Gross, Meta_score...) and a few others
+ROWS = [0, 5, 18, 999, 5, 500, 3]
+
+
+@pytest.fixture(scope="module")
+def columnar(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("catalog") / "movies.catalog")
+    build_columnar(SAMPLE_PATH, directory)
+    return open_catalog(directory)
+
+
+def test_open_catalog(sample_catalog, columnar):
+    assert isinstance(sample_catalog, DataFrameCatalog) and isinstance(columnar, ColumnarCatalog)
+    assert len(sample_catalog) == len(columnar) == 1000
+    assert sample_catalog.columns == columnar.columns == COLUMNS
+
+
+@pytest.mark.parametrize("name", COLUMNS)
+def test_backends_read_the_same_columns(sample_catalog, columnar, name):
+    expected = pd.Series(sample_catalog.column(name))
+    # the numeric columns of a columnar catalog are memory-mapped
+    pd.testing.assert_series_equal(pd.Series(np.asarray(columnar.column(name))), expected)
+    pd.testing.assert_series_equal(pd.Series(columnar.column(name, ROWS)), expected[ROWS].reset_index(drop=True))
+    pd.testing.assert_series_equal(pd.Series(sample_catalog.column(name, ROWS)),
+                                   expected[ROWS].reset_index(drop=True))
+
+
+def test_missing_texts_are_nan(sample_catalog, columnar):
+    for catalog in (sample_catalog, columnar):
+        certificates = catalog.column("Certificate")
+        missing = [value for value in certificates if not isinstance(value, str)]
+        assert missing and all(value is np.nan or np.isnan(value) for value in missing)
+
+
+@pytest.mark.parametrize("rows", [ROWS, [], range(0, 1000, 7)])
+def test_backends_take_the_same_rows(sample_catalog, columnar, rows):
+    expected = sample_catalog.take(rows)
+    pd.testing.assert_frame_equal(columnar.take(rows), expected)
+    pd.testing.assert_frame_equal(columnar.take(rows, ["Overview", "Star1", "Gross"]),
+                                  sample_catalog.take(rows, ["Overview", "Star1", "Gross"]))
+    # decoded columns are read from memory
+    columnar.column("Star1")
+    pd.testing.assert_frame_equal(columnar.take(rows), expected)
+
+
+@pytest.fixture(params=["no header", "header only"])
+def empty_csv(request, tmp_path):
+    path = tmp_path / "movies.csv"
+    with open(SAMPLE_PATH, encoding="utf-8") as f:
+        path.write_text("" if request.param == "no header" else f.readline(), encoding="utf-8")
+    return str(path)
+
+
+def test_empty_dataset(sample_catalog, empty_csv):
+    catalog = open_catalog(empty_csv)
+    assert len(catalog) == 0 and catalog.columns == COLUMNS
+    for name in COLUMNS:
+        assert catalog.column(name).dtype == sample_catalog.column(name).dtype, name
+        assert len(catalog.column(name, [])) == 0
+    assert catalog.take([]).dtypes.equals(sample_catalog.take([]).dtypes)
+
+
+def test_category_without_values(sample_catalog):
+    catalog = DataFrameCatalog(sample_catalog.take(range(3)).assign(Certificate=np.nan))
+    assert catalog.column("Certificate", [2, 0]).tolist() == [np.nan] * 2
+    assert catalog.take([1])["Series_Title"].tolist() == sample_catalog.column("Series_Title", [1]).tolist()
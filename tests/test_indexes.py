@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from actions.indexes import PersonIndex, RankIndex, TitleIndex, normalize
+from actions.manager import STAR_COLUMNS
+from actions.updates import catalog_changes
+
+TITLE_QUERIES = ["the", "The Godfather", "godfather", "GODFATHER: part", "amelie", "Amélie", "é", "a", "x", "",
+                 "  ", "lord of the rings", "star wars", "inception", "no such movie", "ing"]
+
+
+@pytest.fixture(scope="module")
+def titles(sample_catalog):
+    return list(sample_catalog.column("Series_Title"))
+
+
+@pytest.fixture(scope="module")
+def title_index(titles):
+    return TitleIndex(titles)
+
+
+@pytest.mark.parametrize("query", TITLE_QUERIES)
+def test_title_search_is_a_normalized_substring_match(titles, title_index, query):
+    needle = normalize(query)
+    assert title_index.search(query) == [row for row, title in enumerate(titles) if needle in normalize(title)]
+
+
+@pytest.mark.parametrize("query", ["the", "godfather", "lord of the rings", "star wars", "ing"])
+def test_title_search_matches_str_contains(titles, title_index, query):
+    # the DataFrame scan the index replaced, for queries without accents
+    mask = pd.Series(titles).str.contains(query, case=False, regex=False)
+    assert title_index.search(query) == list(mask[mask].index)
+
+
+def test_title_lookup(titles, title_index):
+    assert [titles[row] for row in title_index.lookup("inception")] == ["Inception"]
+    assert [titles[row] for row in title_index.lookup("  DRISHYAM")] == []
+    assert [titles[row] for row in title_index.lookup("drishyam")] == ["Drishyam", "Drishyam"]
+    assert title_index.lookup("Incep") == []
+
+
+def test_title_search_many(title_index):
+    found = title_index.search_many(TITLE_QUERIES + ["THE", "Amelie"])
+    assert found == {query: title_index.search(query) for query in TITLE_QUERIES + ["THE", "Amelie"]}
+    # each query gets its own list
+    assert found["the"] is not found["THE"]
+
+
+def test_patched_title_index_matches_a_rebuild(titles, title_index):
+    changes = {0: "The Shawshank Revenge", 5: None, 8: "Amélie 2", len(titles): "Brand New Film",
+               len(titles) + 1: "The Godfather"}
+    patched = title_index.patched(changes)
+    new_titles = titles + [None, None]
+    for row, title in changes.items():
+        new_titles[row] = title
+    rebuilt = TitleIndex(title if title is not None else "" for title in new_titles)
+    for query in TITLE_QUERIES[:-2] + ["revenge", "brand new", "amelie 2"]:
+        if normalize(query):
+            assert patched.search(query) == rebuilt.search(query), query
+        assert patched.lookup(query) == [row for row in rebuilt.lookup(query) if new_titles[row] is not None], query
+    # the old index is left as it was
+    assert title_index.search("revenge") == [] and title_index.lookup("inception") == [8]
+
+
+PERSON_QUERIES = ["Christopher Nolan", "christopher nolan", "Nolan", "NOLAN", "Caine", "Michael Caine",
+                  "Wachowski", "Kátia Lund", "katia lund", "Lund", "chris", "an", "Nobody Atall", "", "  "]
+
+
+@pytest.fixture(scope="module")
+def stars(sample_catalog):
+    return [list(sample_catalog.column(column)) for column in STAR_COLUMNS]
+
+
+@pytest.fixture(scope="module")
+def actor_index(stars):
+    return PersonIndex(*stars)
+
+
+def _expected_rows(columns, query):
+    """PersonIndex.search by a scan of the name columns."""
+    names = {name for column in columns for name in column}
+    key = normalize(query).strip()
+    if not key:
+        return []
+    if any(normalize(name) == key for name in names):
+        wanted = {name for name in names if normalize(name) == key}
+    elif any(normalize(name.split()[-1]) == key for name in names):
+        wanted = {name for name in names if normalize(name.split()[-1]) == key}
+    else:
+        wanted = {name for name in names if key in normalize(name)}
+    return [row for row, people in enumerate(zip(*columns)) if wanted & set(people)]
+
+
+@pytest.mark.parametrize("query", PERSON_QUERIES)
+def test_person_search_matches_a_scan(stars, actor_index, query):
+    assert actor_index.search(query) == _expected_rows(stars, query)
+
+
+def test_person_search_many(actor_index):
+    queries = PERSON_QUERIES + ["CAINE", "michael caine", "Michael Caine", "ck", "zz"]
+    assert actor_index.search_many(queries) == {query: actor_index.search(query) for query in queries}
+
+
+def test_person_index_names(stars, actor_index):
+    names = {name for column in stars for name in column}
+    assert set(actor_index.names) == names and len(actor_index.names) == len(names)
+    assert actor_index.rows_of("michael caine") == [row for row, people in enumerate(zip(*stars))
+                                                    if "Michael Caine" in people]
+    assert set(actor_index.with_surname(actor_index.names, "the Wachowski")) == \
+        {name for name in names if name.split()[-1] == "Wachowski"}
+    rows = actor_index.search("Caine")
+    assert actor_index.people(rows[:1]) == list(dict.fromkeys(column[rows[0]] for column in stars))
+
+
+def test_patched_person_index_matches_a_rebuild(stars, actor_index):
+    columns = [list(column) for column in stars]
+    changes = {
+        0: ["Yu Newstar", "Morgan Freeman"],
+        # the only movie of Kátia Lund, with her surname
+        columns[0].index("Kátia Lund"): [],
+        2: [columns[0][2], columns[1][2], columns[2][2], columns[3][2], "Ann Caine"],
+        len(columns[0]): ["Yu Newstar", "Michael Caine"],
+    }
+    patched = actor_index.patched(changes)
+    rows = {row: people for row, people in enumerate(zip(*columns))}
+    rows.update({row: tuple(people) for row, people in changes.items()})
+    width = max(len(people) for people in rows.values())
+    rebuilt = PersonIndex(*[
+        [people[i] if i < len(people) else None for _, people in sorted(rows.items())] for i in range(width)
+    ])
+    assert set(patched.names) == set(rebuilt.names)
+    assert dict(patched.surname_of) == dict(rebuilt.surname_of)
+    assert {key: sorted(names) for key, names in patched.by_surname.items()} == \
+        {key: sorted(names) for key, names in rebuilt.by_surname.items()}
+    for query in PERSON_QUERIES + ["Yu Newstar", "Newstar", "Ann Caine", "Morgan Freeman"]:
+        assert patched.search(query) == rebuilt.search(query), query
+    # the old index is left as it was
+    assert actor_index.search("Newstar") == [] and actor_index.search("Kátia Lund") != []
+
+
+@pytest.fixture(scope="module")
+def rank_index(sample_catalog):
+    return RankIndex(sample_catalog)
+
+
+def _ranked(values, rows):
+    """`rows` by descending value, missing values last, ties in row order."""
+    return sorted(rows, key=lambda row: (np.isnan(values[row]), -np.nan_to_num(values[row]), row))
+
+
+@pytest.mark.parametrize("column", RankIndex.COLUMNS)
+def test_rank_order(sample_catalog, rank_index, column):
+    values = sample_catalog.column(column).astype(float)
+    assert list(rank_index.order[column]) == _ranked(values, range(len(values)))
+    assert list(rank_index.top(column, 10)) == _ranked(values, range(len(values)))[:10]
+
+
+@pytest.mark.parametrize("column", RankIndex.COLUMNS)
+def test_rank_top_of_a_subset(sample_catalog, rank_index, column):
+    values = sample_catalog.column(column).astype(float)
+    subset = list(range(0, len(values), 7))
+    assert list(rank_index.top(column, 5, rows=subset)) == _ranked(values, subset)[:5]
+    assert list(rank_index.top(column, None, rows=subset)) == _ranked(values, subset)
+    mask = np.zeros(len(values), dtype=bool)
+    mask[subset] = True
+    assert list(rank_index.top(column, 5, rows=mask)) == _ranked(values, subset)[:5]
+
+
+@pytest.mark.parametrize("column", RankIndex.COLUMNS)
+@pytest.mark.parametrize("strict", [False, True])
+def test_rank_at_least(sample_catalog, rank_index, column, strict):
+    values = sample_catalog.column(column).astype(float)
+    for threshold in np.unique(np.concatenate([np.quantile(values[~np.isnan(values)], [0, 0.1, 0.5, 0.9, 1]),
+                                               [0, 8, 8.5, 2000, 10 ** 9]])):
+        kept = [row for row in range(len(values)) if values[row] > threshold or not strict and values[row] == threshold]
+        assert list(rank_index.at_least(column, threshold, strict=strict)) == _ranked(values, kept)
+        assert rank_index.count_at_least(column, threshold, strict) == len(kept)
+        subset = list(range(3, len(values), 5))
+        assert list(rank_index.at_least(column, threshold, rows=subset, strict=strict)) == \
+            [row for row in subset if row in set(kept)]
+
+
+def test_patched_rank_index_matches_a_rebuild(sample_catalog, rank_index):
+    titles, years = sample_catalog.column("Series_Title"), sample_catalog.column("Released_Year")
+    records = [
+        {"op": "upsert", "movie": {"Series_Title": titles[0], "Released_Year": str(years[0]), "IMDB_Rating": "7.6"}},
+        {"op": "upsert", "movie": {"Series_Title": titles[500], "Released_Year": str(years[500]),
+                                   "IMDB_Rating": "9.3", "Gross": "", "No_of_Votes": "1"}},
+        {"op": "delete", "Series_Title": titles[2], "Released_Year": str(years[2])},
+        {"op": "upsert", "movie": {"Series_Title": "Brand New Film", "Released_Year": "2024", "IMDB_Rating": "8.0",
+                                   "No_of_Votes": "5000"}},
+        {"op": "upsert", "movie": {"Series_Title": "Other New Film", "Released_Year": "1950", "IMDB_Rating": "8.0"}},
+    ]
+    updates, inserts, deletes = catalog_changes(sample_catalog, records)
+    catalog = sample_catalog.patched(updates, inserts, deletes)
+    changed = list(updates) + list(range(len(sample_catalog), len(catalog)))
+    patched = rank_index.patched(catalog, changed, deletes)
+    live = [row for row in range(len(catalog)) if not catalog.deleted[row]]
+    for column in RankIndex.COLUMNS:
+        values = catalog.column(column).astype(float)
+        assert list(patched.order[column]) == _ranked(values, live), column
+        assert list(patched.top(column, 10, rows=live[::2])) == _ranked(values, live[::2])[:10], column
+        assert list(patched.at_least(column, 8.0)) == _ranked(values, [row for row in live if values[row] >= 8.0])
+    # the old index is left as it was
+    assert list(rank_index.order["IMDB_Rating"][:1]) == [0]
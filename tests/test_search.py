@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from actions.search import FullTextSearch, TextIndex, tokenize
+from actions.updates import catalog_changes
+
+QUERIES = ["prisoners escape", "dreaming robots", "the movie where a shark attacks", "retired robot memories",
+           "godfather", "love war", "qqqzz", ""]
+
+# three updates, each one patching the search patched by the previous one
+UPDATES = [
+    ([{"op": "upsert", "movie": {"Series_Title": "Inception", "Released_Year": "2010",
+                                 "Overview": "A thief steals the secrets of dreaming robots."}},
+      {"op": "upsert", "movie": {"Series_Title": "Robot Dreams", "Released_Year": "2023",
+                                 "Overview": "A dog builds a robot friend in New York."}}]),
+    ([{"op": "upsert", "movie": {"Series_Title": "Robot Dreams", "Released_Year": "2023",
+                                 "Overview": "A lonely dog and his robot friend spend a summer together."}},
+      {"op": "upsert", "movie": {"Series_Title": "Brand New Film", "Released_Year": "2024",
+                                 "Overview": "A retired robot hunts the thief of its memories."}},
+      {"op": "delete", "Series_Title": "Jaws", "Released_Year": "1975"}]),
+    ([{"op": "delete", "Series_Title": "Inception", "Released_Year": "2010"},
+      {"op": "upsert", "movie": {"Series_Title": "The Shawshank Redemption", "Released_Year": "1994",
+                                 "Overview": "Two prisoners escape together."}}]),
+]
+
+
+def test_tokenize():
+    assert tokenize("The Prisoners escapes, Amélie STORIES") == ["prisoner", "escape", "amelie", "story"]
+    assert tokenize(np.nan) == []
+
+
+@pytest.fixture(scope="module")
+def search(sample_catalog):
+    return FullTextSearch.build(sample_catalog)
+
+
+def test_search(sample_catalog, search):
+    titles = sample_catalog.column("Series_Title")
+    rows, scores = search.search("shawshank", 3)
+    assert titles[rows[0]] == "The Shawshank Redemption" and len(rows) == 1
+    rows, scores = search.search("godfather")
+    assert set(titles[rows[:3]]) == {"The Godfather", "The Godfather: Part II", "The Godfather: Part III"}
+    assert (np.diff(scores) <= 0).all()
+    assert len(search.search("qqqzz")[0]) == 0 and len(search.search("the movie")[0]) == 0
+
+
+def _extra(search):
+    """{token: [(row, tf)]}, lengths by row, of the index of the changed rows."""
+    extra = search.extra
+    postings = {token: list(zip(extra.rows[extra.docs[extra.offsets[t]:extra.offsets[t + 1]]].tolist(),
+                                extra.tfs[extra.offsets[t]:extra.offsets[t + 1]].tolist()))
+                for token, t in extra.vocabulary.items()}
+    return postings, dict(zip(extra.rows.tolist(), extra.lengths.tolist()))
+
+
+def test_patched_search_merges_the_changed_rows(sample_catalog, search):
+    catalog, patched, reindexed = sample_catalog, search, set()
+    for records in UPDATES:
+        updates, inserts, deletes = catalog_changes(catalog, records)
+        catalog = catalog.patched(updates, inserts, deletes)
+        changed = sorted(set(updates) | set(range(len(catalog) - len(inserts), len(catalog))))
+        patched = patched.patched(catalog, changed, deletes)
+        reindexed = (reindexed | set(changed)) - set(deletes)
+
+        # the same as indexing all the rows changed so far again
+        rebuilt = FullTextSearch(search.index, patched.hidden, TextIndex.from_catalog(catalog, sorted(reindexed)))
+        assert _extra(patched) == _extra(rebuilt)
+        assert (np.diff(patched.extra.rows) > 0).all()
+        for query in QUERIES:
+            left, right = patched.search(query), rebuilt.search(query)
+            assert left[0].tolist() == right[0].tolist(), query
+            assert np.allclose(left[1], right[1]), query
+
+    titles = catalog.column("Series_Title")
+    assert [titles[row] for row in patched.search("robot friend", 1)[0]] == ["Robot Dreams"]
+    assert "Jaws" not in [titles[row] for row in patched.search("shark attacks")[0]]
+    assert "Inception" not in [titles[row] for row in patched.search("dreaming")[0]]
+    assert titles[patched.search("prisoners escape", 1)[0][0]] == "The Shawshank Redemption"
+    # the search of the sample is left as it was
+    assert search.extra is None and search.hidden is None
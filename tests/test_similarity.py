@@ -0,0 +1,32 @@
+import pytest
+
+from actions.similarity import SimilarMovies, VectorIndex, build_index, fingerprint
+from actions.updates import patch_catalog
+
+
+def test_saved_index_is_used_while_the_movies_are_the_same(sample_catalog, tmp_path):
+    directory = str(tmp_path / "similar")
+    build_index(sample_catalog, directory, dim=64)
+    assert VectorIndex.load(directory, fingerprint(sample_catalog, dim=64)) is not None
+    # built with other parameters
+    assert VectorIndex.load(directory, fingerprint(sample_catalog)) is None
+
+
+@pytest.mark.parametrize("column, value", [
+    ("Overview", "A new overview."), ("Genre", "Horror"), ("Director", "Zed Newperson"), ("Star3", "Yu Newstar"),
+    ("Star4", ""),
+])
+def test_fingerprint_changes_with_the_embedded_columns(sample_catalog, column, value):
+    movie = {"Series_Title": "The Matrix", "Released_Year": "1999", column: value}
+    catalog = patch_catalog(sample_catalog, [{"op": "upsert", "movie": movie}])
+    assert fingerprint(catalog) != fingerprint(sample_catalog)
+
+
+def test_similar_movies(sample_catalog):
+    similar = SimilarMovies.open(sample_catalog)
+    titles = sample_catalog.column("Series_Title")
+    row = list(titles).index("The Dark Knight")
+    rows, scores = similar.similar(row, 5)
+    assert row not in rows and len(rows) == 5
+    assert list(scores) == sorted(scores, reverse=True)
+    assert "The Dark Knight Rises" in [titles[other] for other in rows]
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from actions.singleflight import SingleFlight
+
+
+def test_calls_of_a_key_in_flight_share_its_result():
+    flight = SingleFlight(enabled=True)
+    computations = []
+
+    async def compute():
+        computations.append(1)
+        await asyncio.sleep(0.2)
+        return "answer"
+
+    async def late(delay):
+        await asyncio.sleep(delay)
+        return await flight.run("key", compute)
+
+    async def main():
+        return await asyncio.gather(flight.run("key", compute), late(0.15), late(0.15), flight.run("other", compute))
+
+    results = asyncio.run(main())
+    assert results == [("answer", False), ("answer", True), ("answer", True), ("answer", False)]
+    assert len(computations) == 2 and flight.in_flight() == 0
+    stats = flight.stats()
+    assert (stats["computed"], stats["coalesced"]) == (2, 2)
+    # the two late calls waited about 0.05 s each, not the whole 0.2 s
+    assert 0.05 < stats["saved_seconds"] < 0.2
+
+
+def test_exception_is_raised_to_all_the_calls():
+    flight = SingleFlight(enabled=True)
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        raise ValueError("no such movie")
+
+    async def main():
+        return await asyncio.gather(flight.run("key", compute), flight.run("key", compute), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    with pytest.raises(ValueError):
+        asyncio.run(flight.run("key", compute))
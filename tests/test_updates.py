@@ -0,0 +1,229 @@
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from actions.aggregates import DIMENSIONS
+from actions.catalog import open_catalog
+from actions.indexes import RankIndex
+from actions.manager import CatalogGeneration
+from actions.updates import append_changes, apply_changes, compact, patch_catalog
+from conftest import SAMPLE_PATH
+
+NEW_MOVIE = {
+    "Series_Title": "Brand New Film", "Released_Year": "2024", "Certificate": "UA", "Runtime": "101 min",
+    "Genre": "Drama, Crime", "IMDB_Rating": "8.2", "Overview": "A retired robot hunts the thief of its memories.",
+    "Director": "Christopher Nolan", "Star1": "Yu Newstar", "Star2": "Michael Caine", "Star3": "Zendaya",
+    "Star4": "Kátia Lund", "No_of_Votes": "12345", "Gross": "1,234,567",
+}
+
+# two batches, so that the second one patches a patched generation; the
+# movies are added in the order compact appends them (by first record)
+BATCHES = [
+    [
+        {"op": "upsert", "movie": {"Series_Title": "Another Release", "Released_Year": "2025", "Genre": "Horror",
+                                   "IMDB_Rating": "7.9", "Director": "Qi Newdir", "Star1": "Yu Newstar"}},
+        {"op": "upsert", "movie": {"Series_Title": "The Shawshank Redemption", "Released_Year": "1994",
+                                   "IMDB_Rating": "9.1", "No_of_Votes": "2400000"}},
+        # the only movie of its director, whose surname stays through a star
+        {"op": "upsert", "movie": {"Series_Title": "The Matrix", "Released_Year": "1999", "Director": "Zed Newperson"}},
+        {"op": "upsert", "movie": {"Series_Title": "Hamilton", "Released_Year": "2020",
+                                   "Genre": "Musical, Comedy", "Star2": "Yu Newstar"}},
+        {"op": "upsert", "movie": {"Series_Title": "Inception", "Released_Year": "2010",
+                                   "Overview": "A thief steals the secrets of dreaming robots.", "Gross": "1,000"}},
+        {"op": "delete", "Series_Title": "Cidade de Deus", "Released_Year": "2002"},
+        # a title shared with another movie
+        {"op": "delete", "Series_Title": "Drishyam", "Released_Year": "2013"},
+    ],
+    [
+        {"op": "upsert", "movie": {"Series_Title": "Cidade de Deus", "Released_Year": "2002", "Genre": "Crime, Drama",
+                                   "IMDB_Rating": "8.6", "Director": "Fernando Meirelles", "Star1": "Kátia Lund"}},
+        {"op": "upsert", "movie": NEW_MOVIE},
+        {"op": "upsert", "movie": {"Series_Title": "Another Release", "Released_Year": "2025", "IMDB_Rating": "7.7"}},
+        {"op": "delete", "Series_Title": "Hamilton", "Released_Year": "2020"},
+        {"op": "delete", "Series_Title": "A Movie That Does Not Exist", "Released_Year": "1900"},
+        {"op": "upsert", "movie": {"Series_Title": "The Dark Knight", "Released_Year": "2008", "Star4": ""}},
+        {"op": "upsert", "movie": {"Series_Title": "The Dark Knight", "Released_Year": "2008", "IMDB_Rating": "8.9"}},
+    ],
+]
+
+TITLE_QUERIES = ["the", "inception", "god", "a", "", "dr", "brand new", "drishyam", "matrix", "xyz"]
+PERSON_QUERIES = ["Nolan", "Christopher Nolan", "Wachowski", "Lana Wachowski", "Zed Newperson", "Newstar",
+                  "Yu Newstar", "Fernando Meirelles", "Meirelles", "Qi Newdir", "Thomas Kail", "Kail", "Caine"]
+
+
+def _live(catalog):
+    return [row for row in range(len(catalog)) if catalog.deleted is None or not catalog.deleted[row]]
+
+
+@pytest.fixture(scope="module")
+def generations(tmp_path_factory):
+    """(the generation of the sample, the same patched with BATCHES, the
+    generation rebuilt from the sample compacted with BATCHES)."""
+    directory = tmp_path_factory.mktemp("updates")
+    csv_path, log_path = str(directory / "movies.csv"), str(directory / "movies.changes.jsonl")
+    shutil.copy(SAMPLE_PATH, csv_path)
+
+    base = CatalogGeneration(open_catalog(csv_path))
+    base.similar
+    patched = base
+    for batch in BATCHES:
+        patched = apply_changes(patched, batch)
+        append_changes(log_path, batch)
+    compact(csv_path, log_path)
+    return base, patched, CatalogGeneration(open_catalog(csv_path))
+
+
+@pytest.fixture(scope="module")
+def keys(generations):
+    """The (title, year) of a row, in each of the three generations."""
+    def keys_of(generation):
+        titles, years = generation.catalog.column("Series_Title"), generation.catalog.column("Released_Year")
+        return lambda rows: [(titles[row], int(years[row])) for row in rows]
+    return [keys_of(generation) for generation in generations]
+
+
+def test_patched_catalog_matches_the_compacted_csv(generations):
+    _, patched, rebuilt = generations
+    live = _live(patched.catalog)
+    assert len(live) == len(rebuilt.catalog)
+    left = patched.catalog.take(live).reset_index(drop=True)
+    right = rebuilt.catalog.take(range(len(rebuilt.catalog))).reset_index(drop=True)
+    pd.testing.assert_frame_equal(left.astype(str), right.astype(str))
+
+
+def test_base_generation_is_left_untouched(generations, dataset):
+    base = generations[0]
+    fresh = CatalogGeneration(open_catalog(dataset))
+    assert len(base.catalog) == len(fresh.catalog) and base.catalog.deleted is None
+    assert dict(base.title_index.grams) == dict(fresh.title_index.grams)
+    assert dict(base.director_index.rows) == dict(fresh.director_index.rows)
+    assert dict(base.actor_index.surname_of) == dict(fresh.actor_index.surname_of)
+    for column in RankIndex.COLUMNS:
+        assert (base.rank_index.order[column] == fresh.rank_index.order[column]).all()
+
+
+def test_title_index(generations, keys):
+    _, patched, rebuilt = generations
+    _, patched_keys, rebuilt_keys = keys
+    for query in TITLE_QUERIES:
+        assert patched_keys(patched.title_index.search(query)) == rebuilt_keys(rebuilt.title_index.search(query))
+        assert patched_keys(patched.title_index.lookup(query)) == rebuilt_keys(rebuilt.title_index.lookup(query))
+    assert set(patched.title_matcher.choices) == set(rebuilt.title_matcher.choices)
+
+
+@pytest.mark.parametrize("role", ["director", "actor"])
+def test_person_indexes(generations, keys, role):
+    _, patched, rebuilt = generations
+    _, patched_keys, rebuilt_keys = keys
+    left, right = getattr(patched, f"{role}_index"), getattr(rebuilt, f"{role}_index")
+    assert set(left.names) == set(right.names)
+    assert dict(left.surname_of) == dict(right.surname_of)
+    assert {key: sorted(names) for key, names in left.by_surname.items()} == \
+        {key: sorted(names) for key, names in right.by_surname.items()}
+    for query in PERSON_QUERIES + list(right.names):
+        assert patched_keys(left.search(query)) == rebuilt_keys(right.search(query)), query
+        assert set(left.people(left.search(query))) == set(right.people(right.search(query))), query
+
+    left, right = getattr(patched, f"{role}_matcher"), getattr(rebuilt, f"{role}_matcher")
+    assert set(left.full_names.choices) == set(right.full_names.choices)
+    assert set(left.surnames.choices) == set(right.surnames.choices)
+
+
+@pytest.mark.parametrize("column", RankIndex.COLUMNS)
+def test_rank_index(generations, keys, column):
+    _, patched, rebuilt = generations
+    _, patched_keys, rebuilt_keys = keys
+    assert patched_keys(patched.rank_index.order[column]) == rebuilt_keys(rebuilt.rank_index.order[column])
+    for value in [0, 7.9, 8, 8.5, 1950, 2020, 10 ** 5, 10 ** 8]:
+        for strict in (False, True):
+            assert patched_keys(patched.rank_index.at_least(column, value, strict=strict)) == \
+                rebuilt_keys(rebuilt.rank_index.at_least(column, value, strict=strict))
+            assert patched.rank_index.count_at_least(column, value, strict) == \
+                rebuilt.rank_index.count_at_least(column, value, strict)
+
+    live = _live(patched.catalog)[::3]
+    row_of = {key: row for row, key in enumerate(rebuilt_keys(range(len(rebuilt.catalog))))}
+    assert patched_keys(patched.rank_index.top(column, 10, rows=live)) == \
+        rebuilt_keys(rebuilt.rank_index.top(column, 10, rows=[row_of[key] for key in patched_keys(live)]))
+
+
+def test_genre_index(generations, keys):
+    _, patched, rebuilt = generations
+    _, patched_keys, rebuilt_keys = keys
+    live = set(_live(patched.catalog))
+    for bit in range(max(len(patched.genre_index.rows), len(rebuilt.genre_index.rows))):
+        rows = [row for row in patched.genre_index.candidates(1 << bit) if row in live]
+        assert sorted(patched_keys(rows)) == sorted(rebuilt_keys(rebuilt.genre_index.candidates(1 << bit))), bit
+
+
+@pytest.mark.parametrize("dimension", DIMENSIONS)
+def test_aggregates(generations, dimension):
+    _, patched, rebuilt = generations
+    groups = rebuilt.aggregates.dimensions[dimension]
+    for key in groups.group_of:
+        for min_rating in [None, 7.9, 8.0, 8.45, 9.0]:
+            assert patched.aggregates.dimensions[dimension].stats(key, min_rating) == groups.stats(key, min_rating), \
+                (key, min_rating)
+    # the groups left without movies
+    patched_groups = patched.aggregates.dimensions[dimension]
+    for key in set(patched_groups.group_of) | set(patched_groups.changed):
+        if key not in groups.group_of:
+            assert patched_groups.stats(key)["count"] == 0, key
+
+
+def test_text_search(generations, keys):
+    _, patched, _ = generations
+    _, patched_keys, _ = keys
+    rows, _ = patched.text_search.search("dreaming robots")
+    assert patched_keys(rows[:1]) == [("Inception", 2010)]
+    rows, _ = patched.text_search.search("retired robot memories")
+    assert patched_keys(rows[:1]) == [("Brand New Film", 2024)]
+    rows, _ = patched.text_search.search("Hamilton")
+    assert ("Hamilton", 2020) not in patched_keys(rows)
+
+
+def test_similar_movies(generations, keys):
+    _, patched, _ = generations
+    _, patched_keys, _ = keys
+    row = patched.title_index.lookup("Brand New Film")[0]
+    rows, _ = patched.similar.similar(row)
+    assert len(rows) and row not in rows
+    assert not set(rows) & set(np.flatnonzero(patched.catalog.deleted))
+
+
+def test_nothing_to_change(generations):
+    base = generations[0]
+    assert apply_changes(base, [{"op": "delete", "Series_Title": "A Movie That Does Not Exist",
+                                 "Released_Year": "1900"}]) is None
+
+
+def test_patch_catalog(generations, dataset):
+    rebuilt = generations[2]
+    catalog = open_catalog(dataset)
+    for batch in BATCHES:
+        catalog = patch_catalog(catalog, batch)
+    live = _live(catalog)
+    assert catalog.take(live).reset_index(drop=True).astype(str).equals(
+        rebuilt.catalog.take(range(len(rebuilt.catalog))).reset_index(drop=True).astype(str)
+    )
+
+
+def test_every_movie_deleted(dataset):
+    generation = CatalogGeneration(open_catalog(dataset))
+    titles, years = generation.catalog.column("Series_Title"), generation.catalog.column("Released_Year")
+    records = [{"op": "delete", "Series_Title": title, "Released_Year": str(year)} for title, year in zip(titles, years)]
+    patched = apply_changes(generation, records)
+    assert patched.catalog.deleted.all() and patched.title_index.search("") == []
+    assert patched.aggregates.count("director", "Christopher Nolan") == 0
+
+    append_changes(dataset + ".changes.jsonl", records)
+    compact(dataset, dataset + ".changes.jsonl")
+    empty = CatalogGeneration(open_catalog(dataset))
+    assert len(empty.catalog) == 0 and empty.title_index.search("") == []
+    added = apply_changes(empty, BATCHES[1])
+    assert sorted(added.catalog.column("Series_Title")) == \
+        ["Another Release", "Brand New Film", "Cidade de Deus", "The Dark Knight"]
+    assert added.catalog.column("Gross").tolist()[1] == 1234567.0
+    assert added.title_index.lookup("brand new film") == [1] and added.similar.similar(1)[0].tolist() != [1]